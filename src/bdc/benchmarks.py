@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""Contains class to benchmark the copy strategies against synthetic trees and ISO images
+
+Trees of a few typical shapes (many tiny files, a few huge files, deep nesting and a
+mix resembling a distribution image) are generated from a fixed seed, packed into an
+ISO9660 image and written with every copy strategy to a file-backed target, so no USB
+hardware is needed. Point --directory at a tmpfs like /dev/shm to leave the disk out
+of it. Each measurement runs in a forked child, so the CPU time and peak RSS reported
+are those of the copy alone. Strategies can run with source and target pages dropped
+from the page cache as bdc does, or kept, and how much of the fixtures and target is
+still cached afterwards is reported (a tmpfs can't drop anything, use a disk to see the
+difference). Results are printed as JSON to be compared across commits.
+
+Usage: python3 -m bdc.benchmarks [--shapes tiny,huge] [--strategies kernel,iso] ...
+
+File name: benchmarks.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import struct
+import sys
+import tempfile
+from subprocess import Popen, PIPE, DEVNULL
+from time import monotonic, time
+from bdc import __version__
+from bdc.copyEngine import CopyEngine
+from bdc.fatImage import FatImageBuilder
+from bdc.isoReader import IsoReader
+from bdc.pageCache import advise, residentBytes, FADV_DONTNEED
+from bdc.rawWriter import RawWriter
+
+SECTOR_SIZE = 2048
+KiB = 1024
+MiB = 1024**2
+
+# files is scaled by --scale, sizes are drawn log-uniformly between minSize and maxSize
+# and spread over width chains of depth nested directories
+SHAPES = {
+    'tiny': {'files': 20000, 'minSize': 512, 'maxSize': 8*KiB, 'width': 100, 'depth': 1},
+    'huge': {'files': 4, 'minSize': 64*MiB, 'maxSize': 64*MiB, 'width': 1, 'depth': 1},
+    'deep': {'files': 2000, 'minSize': 1*KiB, 'maxSize': 64*KiB, 'width': 4, 'depth': 32},
+    'mixed': {'files': 2000, 'minSize': 1*KiB, 'maxSize': 1*MiB, 'width': 20, 'depth': 3},
+}
+
+STRATEGIES = ['kernel', 'userspace', 'hashed', 'iso', 'raw', 'build-fs']
+
+# drop pages once they are done with like bdc does by default, or keep them cached
+PAGE_CACHE = ['drop', 'keep']
+
+def bothEndian(value, size):
+    """packs value in both little and big endian byte order as used by ISO9660"""
+    fmt = 'H' if size == 2 else 'I'
+    return struct.pack('<' + fmt, value) + struct.pack('>' + fmt, value)
+
+class Benchmark:
+    """class that generates fixtures, runs each copy strategy on them and collects results"""
+    def __init__(self, directory=None, shapes=None, strategies=None, scale=1.0, repeat=1,
+                 seed=0, workers=4, sync=True, pageCache=None, writeWindow=(64*MiB)):
+        """initializes member variables
+
+        directory is where fixtures and targets are created (a new temporary directory
+        by default), shapes maps names to shape dictionaries like SHAPES and sync makes
+        every measurement include flushing the written data with os.sync(). Every strategy
+        is run in each mode of pageCache (from PAGE_CACHE, only 'drop' by default) and
+        writeWindow is passed on like bdc's --write-window.
+        """
+        self.directory = directory
+        self.shapes = shapes if shapes is not None else SHAPES
+        self.strategies = strategies if strategies is not None else STRATEGIES
+        self.scale = scale
+        self.repeat = repeat
+        self.seed = seed
+        self.workers = workers
+        self.sync = sync
+        self.pageCache = pageCache if pageCache is not None else ['drop']
+        self.writeWindow = writeWindow
+        self.dropCache = True
+        self.results = []
+
+    def layout(self, shape):
+        """returns the directories and (relative path, size) tuples of a shape
+
+        The same seed always gives the same layout.
+        """
+        rng = random.Random(self.seed)
+        directories = []
+        leaves = []
+        for chain in range(shape['width']):
+            path = ''
+            for level in range(shape['depth']):
+                path = os.path.join(path, 'd{0:03d}'.format(chain if level == 0 else level))
+                directories.append(path)
+                leaves.append(path)
+
+        files = []
+        count = max(1, int(shape['files'] * self.scale))
+        low = math.log(shape['minSize'])
+        high = math.log(shape['maxSize'])
+        for i in range(count):
+            size = int(math.exp(rng.uniform(low, high)))
+            files.append((os.path.join(leaves[i % len(leaves)], 'f{0:06d}.bin'.format(i)), size))
+        return directories, files
+
+    def createTree(self, root, shape):
+        """writes the files of a shape under root
+
+        File contents repeat a seeded random block, shifted per file, so they are neither
+        compressible nor all zeroes that a raw write could skip.
+        """
+        block = random.Random(self.seed).getrandbits(8 * MiB).to_bytes(MiB, 'little')
+        directories, files = self.layout(shape)
+        for directory in directories:
+            os.makedirs(os.path.join(root, directory), exist_ok=True)
+        for index, (relPath, size) in enumerate(files):
+            shift = (index * 4099) % MiB
+            data = block[shift:] + block[:shift]
+            with open(os.path.join(root, relPath), 'wb') as f:
+                remaining = size
+                while remaining > 0:
+                    f.write(data[:min(remaining, MiB)])
+                    remaining -= MiB
+        return directories, files
+
+    @staticmethod
+    def isoRecord(extent, size, isDir, identifier):
+        """returns an ISO9660 directory record"""
+        record = (bytes([0, 0]) + bothEndian(extent, 4) + bothEndian(size, 4) + bytes(7) +
+                  bytes([2 if isDir else 0, 0, 0]) + bothEndian(1, 2) +
+                  bytes([len(identifier)]) + identifier)
+        record += b'\x00' * (len(record) % 2)
+        return bytes([len(record)]) + record[1:]
+
+    @staticmethod
+    def sectors(size):
+        """returns the number of sectors needed to hold size bytes"""
+        return (size + SECTOR_SIZE - 1) // SECTOR_SIZE
+
+    def directorySectors(self, records):
+        """packs records into sectors, a record never crosses a sector boundary"""
+        data = bytearray()
+        for record in records:
+            used = len(data) % SECTOR_SIZE
+            if used + len(record) > SECTOR_SIZE:
+                data += bytes(SECTOR_SIZE - used)
+            data += record
+        return bytes(data) + bytes(-len(data) % SECTOR_SIZE)
+
+    def writeIso(self, root, path, directories, files):
+        """packs a tree generated by createTree into a plain ISO9660 image at path
+
+        Generated names are already valid 8.3 identifiers, so no Rock Ridge or Joliet
+        extensions are needed. The image is written in one pass without holding the file
+        contents in memory, and directories can span several sectors.
+        """
+        dirs = [''] + sorted(directories, key=lambda d: (d.count('/'), d))
+        children = {d: [] for d in dirs}
+        for d in dirs[1:]:
+            children[os.path.dirname(d)].append(d)
+        contents = {d: [] for d in dirs}
+        for relPath, size in files:
+            contents[os.path.dirname(relPath)].append((relPath, size))
+
+        def identifier(name, isDir):
+            """returns the on-disc identifier of name"""
+            return (name.upper() if isDir else name.upper() + ';1').encode()
+
+        pathTable = b''
+        for d in dirs:
+            ident = identifier(os.path.basename(d), True) if d else b'\x00'
+            parent = dirs.index(os.path.dirname(d)) + 1 if d else 1
+            pathTable += bytes([len(ident), 0]) + struct.pack('<IH', 0, parent) + ident
+            pathTable += b'\x00' * (len(ident) % 2)
+        pathTableSector = 18
+        sector = pathTableSector + self.sectors(len(pathTable))
+
+        # sizes of directories only depend on the number and length of their records
+        dirSizes = {}
+        for d in dirs:
+            records = [self.isoRecord(0, 0, True, b'\x00'), self.isoRecord(0, 0, True, b'\x01')]
+            records += [self.isoRecord(0, 0, True, identifier(os.path.basename(c), True))
+                        for c in children[d]]
+            records += [self.isoRecord(0, 0, False, identifier(os.path.basename(f), False))
+                        for f, size in contents[d]]
+            dirSizes[d] = len(self.directorySectors(records))
+        dirExtents = {}
+        for d in dirs:
+            dirExtents[d] = sector
+            sector += dirSizes[d] // SECTOR_SIZE
+        fileExtents = {}
+        for relPath, size in files:
+            fileExtents[relPath] = sector if size else 0
+            sector += self.sectors(size)
+
+        pathTable = bytearray(pathTable)
+        offset = 0
+        for d in dirs:
+            struct.pack_into('<I', pathTable, offset + 2, dirExtents[d])
+            offset += 8 + pathTable[offset] + pathTable[offset] % 2
+
+        descriptor = bytearray(SECTOR_SIZE)
+        descriptor[0:7] = b'\x01CD001\x01'
+        descriptor[80:88] = bothEndian(sector, 4)
+        descriptor[120:132] = bothEndian(1, 2) + bothEndian(1, 2) + bothEndian(SECTOR_SIZE, 2)
+        descriptor[132:140] = bothEndian(len(pathTable), 4)
+        descriptor[140:144] = struct.pack('<I', pathTableSector)
+        descriptor[156:190] = self.isoRecord(dirExtents[''], dirSizes[''], True, b'\x00')
+        descriptor[881] = 1
+
+        with open(path, 'wb') as f:
+            f.write(bytes(16 * SECTOR_SIZE))
+            f.write(descriptor)
+            f.write(b'\xffCD001\x01'.ljust(SECTOR_SIZE, b'\x00'))
+            f.write(bytes(pathTable) + bytes(-len(pathTable) % SECTOR_SIZE))
+            for d in dirs:
+                parent = os.path.dirname(d)
+                records = [self.isoRecord(dirExtents[d], dirSizes[d], True, b'\x00'),
+                           self.isoRecord(dirExtents[parent], dirSizes[parent], True, b'\x01')]
+                records += [self.isoRecord(dirExtents[c], dirSizes[c], True,
+                                           identifier(os.path.basename(c), True))
+                            for c in children[d]]
+                records += [self.isoRecord(fileExtents[relPath], size, False,
+                                           identifier(os.path.basename(relPath), False))
+                            for relPath, size in contents[d]]
+                f.write(self.directorySectors(records))
+            for relPath, size in files:
+                with open(os.path.join(root, relPath), 'rb') as src:
+                    shutil.copyfileobj(src, f, MiB)
+                f.write(bytes(-size % SECTOR_SIZE))
+
+    def runKernel(self, tree, iso, target, totalBytes):
+        """copies the tree with copy_file_range or sendfile"""
+        engine = CopyEngine(tree, target, workers=self.workers, writeWindow=self.writeWindow,
+                            dropCache=self.dropCache)
+        engine.run()
+        return engine.totalBytes, engine.totalFiles
+
+    def runUserspace(self, tree, iso, target, totalBytes):
+        """copies the tree through userspace buffers"""
+        engine = CopyEngine(tree, target, workers=self.workers, writeWindow=self.writeWindow,
+                            dropCache=self.dropCache)
+        engine.strategies = []
+        engine.run()
+        return engine.totalBytes, engine.totalFiles
+
+    def runHashed(self, tree, iso, target, totalBytes):
+        """copies the tree while hashing every file, as --verify does"""
+        engine = CopyEngine(tree, target, workers=self.workers, algorithm='sha256',
+                            writeWindow=self.writeWindow, dropCache=self.dropCache)
+        engine.run()
+        return engine.totalBytes, engine.totalFiles
+
+    def runIso(self, tree, iso, target, totalBytes):
+        """copies the files out of the image with the in-process ISO9660 reader"""
+        with IsoReader(iso, self.dropCache) as reader:
+            engine = CopyEngine(None, target, workers=self.workers, reader=reader,
+                                writeWindow=self.writeWindow, dropCache=self.dropCache)
+            engine.run()
+        return engine.totalBytes, engine.totalFiles
+
+    def runRaw(self, tree, iso, target, totalBytes):
+        """writes the image byte for byte onto a target file"""
+        writer = RawWriter(iso, target + '.img', writeWindow=self.writeWindow,
+                           dropCache=self.dropCache)
+        open(writer.target, 'wb').close()
+        writer.run()
+        return writer.totalBytes, 1
+
+    def runBuildFs(self, tree, iso, target, totalBytes):
+        """builds a FAT32 file system from the image into a sparse target file"""
+        with IsoReader(iso, self.dropCache) as reader:
+            files = [(entry.path, entry.size, entry.mtime) for entry in reader.files()]
+            with open(target + '.img', 'wb') as fdst:
+                size = max(64*MiB, 2 * totalBytes + 64*MiB)
+                fdst.truncate(size)
+                builder = FatImageBuilder(size, reader.directories(), files)
+                builder.write(fdst, lambda path: reader.readChunks(reader.entry(path)))
+        return builder.bytesWritten, len(files)
+
+    def strategy(self, name):
+        """returns the method that runs the strategy called name"""
+        return {'kernel': self.runKernel, 'userspace': self.runUserspace,
+                'hashed': self.runHashed, 'iso': self.runIso, 'raw': self.runRaw,
+                'build-fs': self.runBuildFs}[name]
+
+    def measure(self, name, tree, iso, target, totalBytes):
+        """runs a strategy in a forked child and returns its timing and resource usage
+
+        The child reports how long the copy took and how much it moved through a pipe,
+        its CPU time and peak RSS come from wait4, so neither includes the fixtures.
+        """
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            status = 0
+            try:
+                start = monotonic()
+                totalBytes, totalFiles = self.strategy(name)(tree, iso, target, totalBytes)
+                if self.sync:
+                    os.sync()
+                result = {'seconds': monotonic() - start, 'bytes': totalBytes,
+                          'files': totalFiles}
+            except Exception as err:
+                result = {'error': '{0}: {1}'.format(type(err).__name__, err)}
+                status = 1
+            with os.fdopen(write, 'w') as f:
+                json.dump(result, f)
+            os._exit(status)
+
+        os.close(write)
+        with os.fdopen(read) as f:
+            output = f.read()
+        usage = os.wait4(pid, 0)[2]
+        result = json.loads(output) if output else {'error': 'benchmark process died'}
+        if 'seconds' in result:
+            seconds = max(result['seconds'], 1e-9)
+            result['mbPerSecond'] = result['bytes'] / MiB / seconds
+            result['filesPerSecond'] = result['files'] / seconds
+        result.update(cpuUser=usage.ru_utime, cpuSystem=usage.ru_stime,
+                      peakRssKiB=usage.ru_maxrss)
+        return result
+
+    @staticmethod
+    def walk(root):
+        """yields the path of every regular file under root"""
+        for path, dirs, files in os.walk(root):
+            for name in files:
+                yield os.path.join(path, name)
+
+    def evict(self, root):
+        """drops every file under root from the page cache so each run starts cold"""
+        for path in self.walk(root):
+            with open(path, 'rb') as f:
+                advise(f.fileno(), 0, 0, FADV_DONTNEED)
+
+    def cachedBytes(self, root):
+        """returns how many bytes of the files under root are in the page cache"""
+        total = 0
+        for path in self.walk(root):
+            resident = residentBytes(path)
+            if resident is None:
+                return None
+            total += resident
+        return total
+
+    def runShape(self, shapeName, root):
+        """generates the fixtures of a shape and measures every strategy on them"""
+        tree = os.path.join(root, 'tree')
+        iso = os.path.join(root, 'image.iso')
+        target = os.path.join(root, 'target')
+        directories, files = self.createTree(tree, self.shapes[shapeName])
+        self.writeIso(tree, iso, directories, files)
+        totalBytes = sum(size for relPath, size in files)
+
+        for name in self.strategies:
+            for mode in self.pageCache:
+                self.dropCache = mode == 'drop'
+                for run in range(self.repeat):
+                    for path in (target, target + '.img'):
+                        if os.path.isdir(path):
+                            shutil.rmtree(path)
+                        elif os.path.exists(path):
+                            os.remove(path)
+                    os.makedirs(target)
+                    os.sync()
+                    self.evict(root)
+                    result = {'shape': shapeName, 'strategy': name, 'pageCache': mode, 'run': run}
+                    result.update(self.measure(name, tree, iso, target, totalBytes))
+                    cached = self.cachedBytes(root)
+                    result['cachedKiB'] = cached // KiB if cached is not None else None
+                    self.results.append(result)
+
+        shutil.rmtree(root)
+
+    @staticmethod
+    def commit():
+        """returns the git commit the benchmark runs on, or None outside a git checkout"""
+        try:
+            process = Popen(['git', 'rev-parse', 'HEAD'], stdout=PIPE, stderr=DEVNULL,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+            output = process.communicate()[0]
+        except OSError:
+            return None
+        return output.decode().strip() if process.returncode == 0 else None
+
+    def report(self):
+        """returns the results along with what they were measured on"""
+        return {'version': __version__, 'commit': self.commit(), 'time': int(time()),
+                'python': platform.python_version(), 'platform': platform.platform(),
+                'cpus': os.cpu_count(), 'scale': self.scale, 'seed': self.seed,
+                'workers': self.workers, 'sync': self.sync, 'writeWindow': self.writeWindow,
+                'results': self.results}
+
+    def run(self):
+        """measures every strategy on every shape and returns the report"""
+        self.results = []
+        for shapeName in self.shapes:
+            root = tempfile.mkdtemp(prefix='bdc-bench-', dir=self.directory)
+            try:
+                self.runShape(shapeName, root)
+            finally:
+                shutil.rmtree(root, ignore_errors=True)
+        return self.report()
+
+def main():
+    """parses command line arguments, runs the benchmark and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description='benchmark the copy strategies of bdc')
+    parser.add_argument('--shapes', type=str, default=','.join(SHAPES),
+                        help='comma separated shapes to generate ({0})'.format(', '.join(SHAPES)))
+    parser.add_argument('--strategies', type=str, default=','.join(STRATEGIES),
+                        help='comma separated strategies to run ({0})'
+                        .format(', '.join(STRATEGIES)))
+    parser.add_argument('--directory', type=str,
+                        help='where fixtures and targets are created (use a tmpfs like /dev/shm '
+                             'to leave the disk out)')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies the number of files')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each strategy')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated fixtures')
+    parser.add_argument('--workers', type=int, default=4, help='threads used to copy files')
+    parser.add_argument('--no-sync', default=False, action='store_true',
+                        help='don\'t include flushing the target in the measurements')
+    parser.add_argument('--page-cache', type=str, default='drop',
+                        help='comma separated page cache modes to run every strategy in '
+                             '({0})'.format(', '.join(PAGE_CACHE)))
+    parser.add_argument('--write-window', type=int, default=64, metavar='MB',
+                        help='MB written but not yet on the target before writing waits for '
+                             'it (0 turns this off)')
+    parser.add_argument('--output', type=str, help='write the JSON report to a file')
+    args = parser.parse_args()
+
+    shapes = args.shapes.split(',')
+    strategies = args.strategies.split(',')
+    for name in shapes:
+        if name not in SHAPES:
+            sys.exit('Error: unknown shape \'{0}\''.format(name))
+    for name in strategies:
+        if name not in STRATEGIES:
+            sys.exit('Error: unknown strategy \'{0}\''.format(name))
+    modes = args.page_cache.split(',')
+    for mode in modes:
+        if mode not in PAGE_CACHE:
+            sys.exit('Error: unknown page cache mode \'{0}\''.format(mode))
+
+    benchmark = Benchmark(args.directory, {name: SHAPES[name] for name in shapes}, strategies,
+                          args.scale, args.repeat, args.seed, args.workers, not args.no_sync,
+                          modes, args.write_window * MiB)
+    report = json.dumps(benchmark.run(), indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
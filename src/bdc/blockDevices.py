@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""Contains class to discover disks, partitions and their mount points in-process
+
+The topology is read straight from sysfs and mountinfo instead of parsing lsblk output,
+which also gets partition names like nvme0n1p1 and mmcblk0p1 right. The index is cached
+and only rebuilt once the set of block devices or the mount table changes.
+
+File name: blockDevices.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import os
+import re
+
+SYSFS_BLOCK = '/sys/class/block'
+MOUNTINFO = '/proc/self/mountinfo'
+DEV = '/dev'
+
+class Partition:
+    """partition of a disk along with its size in bytes, mount points and start sector"""
+    def __init__(self, path, disk, size, mountpoints, start=0):
+        """initializes member variables"""
+        self.path = path
+        self.disk = disk
+        self.size = size
+        self.mountpoints = mountpoints
+        self.start = start
+
+    def mountpoint(self):
+        """returns the first mount point of the partition or '' if it isn't mounted"""
+        return self.mountpoints[0] if self.mountpoints else ''
+
+class Disk:
+    """whole disk along with its size in bytes and partitions"""
+    def __init__(self, path, size, mountpoints):
+        """initializes member variables"""
+        self.path = path
+        self.size = size
+        self.mountpoints = mountpoints
+        self.partitions = []
+
+class BlockTopology:
+    """class that indexes disks, partitions, sizes and mount points"""
+    def __init__(self, sysfs=SYSFS_BLOCK, mountinfo=MOUNTINFO, dev=DEV):
+        """initializes member variables, paths can point at a fake sysfs tree for testing"""
+        self.sysfs = sysfs
+        self.mountinfo = mountinfo
+        self.dev = dev
+        self.disks = {}
+        self.partitions = {}
+        self.signature = None
+
+    @staticmethod
+    def readFile(path, default=''):
+        """returns the stripped contents of a small file or default if it can't be read"""
+        try:
+            with open(path) as f:
+                return f.read().strip()
+        except OSError:
+            return default
+
+    @staticmethod
+    def unescape(path):
+        """decodes the octal escapes mountinfo uses for spaces and other characters"""
+        return re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), path)
+
+    def readMounts(self, mountinfo):
+        """returns dictionary of 'major:minor' device numbers and device names and their mounts
+
+        Btrfs and other file systems report an anonymous '0:NN' device number, so mounts
+        are also indexed by the name of the /dev node given as mount source after the
+        ' - ' separator, with symlinks like /dev/disk/by-uuid/... resolved.
+        """
+        mounts = {}
+        for line in mountinfo.splitlines():
+            fields = line.split()
+            if len(fields) < 5:
+                continue
+            mountpoint = self.unescape(fields[4])
+            mounts.setdefault(fields[2], []).append(mountpoint)
+            if '-' not in fields[5:]:
+                continue
+            # the separator is followed by the file system type and the mount source
+            source = fields[fields.index('-', 5) + 1:][1:2]
+            if source and source[0].startswith('/dev/'):
+                name = os.path.basename(os.path.realpath(self.unescape(source[0])))
+                if mountpoint not in mounts.get(name, []):
+                    mounts.setdefault(name, []).append(mountpoint)
+        return mounts
+
+    @staticmethod
+    def mountsOf(mounts, dev, name):
+        """returns the mount points of a device found by its number or by its name"""
+        ret = list(mounts.get(dev, []))
+        ret += [mountpoint for mountpoint in mounts.get(name, []) if mountpoint not in ret]
+        return ret
+
+    def currentSignature(self):
+        """returns a cheap snapshot of the device list and mount table
+
+        The index has to be rebuilt whenever this changes.
+        """
+        try:
+            names = tuple(sorted(os.listdir(self.sysfs)))
+        except OSError:
+            names = ()
+        return names, self.readFile(self.mountinfo)
+
+    def invalidate(self):
+        """forces the index to be rebuilt on next access"""
+        self.signature = None
+
+    def refresh(self):
+        """rebuilds the index if the devices or mounts changed since it was last built"""
+        signature = self.currentSignature()
+        if signature == self.signature:
+            return
+        names, mountinfo = signature
+        mounts = self.readMounts(mountinfo)
+        disks = {}
+        partitions = {}
+
+        for name in names:
+            entry = os.path.join(self.sysfs, name)
+            if os.path.exists(os.path.join(entry, 'partition')):
+                continue
+            size = int(self.readFile(os.path.join(entry, 'size'), '0')) * 512
+            dev = self.readFile(os.path.join(entry, 'dev'))
+            disk = Disk(os.path.join(self.dev, name), size, self.mountsOf(mounts, dev, name))
+            disks[disk.path] = disk
+
+            for child in sorted(os.listdir(entry)):
+                childEntry = os.path.join(entry, child)
+                if not os.path.exists(os.path.join(childEntry, 'partition')):
+                    continue
+                size = int(self.readFile(os.path.join(childEntry, 'size'), '0')) * 512
+                dev = self.readFile(os.path.join(childEntry, 'dev'))
+                start = int(self.readFile(os.path.join(childEntry, 'start'), '0'))
+                partition = Partition(os.path.join(self.dev, child), disk.path, size,
+                                      self.mountsOf(mounts, dev, child), start)
+                disk.partitions.append(partition)
+                partitions[partition.path] = partition
+
+        self.disks = disks
+        self.partitions = partitions
+        self.signature = signature
+
+    def getPartitions(self):
+        """returns dictionary of partition paths and Partition objects"""
+        self.refresh()
+        return self.partitions
+
+    def getDisks(self):
+        """returns dictionary of disk paths and Disk objects"""
+        self.refresh()
+        return self.disks
+
+    def diskOf(self, path):
+        """returns the path of the disk a partition is on, or path itself if it is a disk"""
+        partition = self.getPartitions().get(path)
+        return partition.disk if partition is not None else path
+
+    def partitionsOf(self, disk):
+        """returns the partitions of a disk"""
+        entry = self.getDisks().get(disk)
+        return entry.partitions if entry is not None else []
+
+    def isSystemMount(self, mountpoint):
+        """returns if a mount point holds the running OS"""
+        return mountpoint == '/' or '/boot' in mountpoint
+
+    def systemDisks(self):
+        """returns the set of disks that have a partition holding the running OS"""
+        return set(partition.disk for partition in self.getPartitions().values()
+                   if any(self.isSystemMount(mountpoint) for mountpoint in partition.mountpoints))
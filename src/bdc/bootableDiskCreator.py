@@ -8,161 +8,725 @@ by Windows or OS X (using dd)
 File name: bootableDiskCreator.py
 Author: Adam Jenkins
 Date created: 9/5/2018
-Date last modified: 10/27/18
+Date last modified: 10/18/2026
 Python Version: 3.6.5
 """
 
 from subprocess import Popen, PIPE
+from shlex import quote
 from getpass import getuser
 from sys import stderr, stdout
 import sys
-import shutil
 import os
+import hashlib
 import pwd
+import stat
 import threading
+from time import monotonic, time
+from bdc.blockDevices import BlockTopology
+from bdc.copyEngine import CopyEngine
+from bdc.eventBuffer import EventBuffer
+from bdc.jobEngine import CommandError, Job, JobCancelled, JobEngine, JobError, Stage
+from bdc.manifest import Manifest, MANIFEST_NAME
+from bdc.mounts import MountError, NativeMounts
+from bdc.pageCache import DropBehind
+from bdc.progressModel import ProgressModel, formatEta
+from bdc.rawWriter import RawWriter
+from bdc.stats import Stats
+from bdc.writeBack import WriteBack
 
 class BootableDiskCreator:
     """class that contains variables and methods to create a bootable drive"""
 
-    class StringBuffer:
-        """contains string which stores output normally written to stdout
-
-        This string is then accessed by PyQt to display the logging output to the GUI
-        instead of stdout. Access to BootableDiskCreator's instance of StringBuffer is thread safe.
-        """
-        def __init__(self):
-            """initializes string to default value"""
-            self.string = ''
-
-        def write(self, string):
-            """concatenates member variable with input"""
-            self.string += string
-
-        def read(self):
-            """returns member variable value and resets it"""
-            ret = self.string
-            self.string = ''
-            return ret
-
     def __init__(self):
         """initializes member variables to default values"""
         self.totalBytes = 0
         self.totalBytesWritten = 0
         self.isoMount = '/mnt/iso/'
         self.target = '/mnt/target/'
-        self.buffer = self.StringBuffer()
+        self.buffer = EventBuffer()
+        self.buffer.listener = self.notify
+        self.listener = None
         self.copyProgress = 0.0
         self.done = False
-        self.thread = object()
         self.mutex = threading.Lock()
         self.iso = ''
         self.device = ''
+        self.devices = []
+        self.failedDevices = []
+        self.deviceWriters = []
+        self.deviceSize = 0
         self.verbose = True
+        self.workers = 4
+        self.writeWindow = 64*1024**2
+        self.dropCache = True
+        self.bufferCount = 4
+        self.bufferSize = None
+        self.reader = None
+        self.raw = False
+        self.topology = BlockTopology()
+        self.mounts = NativeMounts()
+        self.engine = None
+        self.verify = False
+        self.hashAlgorithm = 'sha256'
+        self.hashes = {}
+        self.mismatches = []
+        self.incremental = False
+        self.manifest = None
+        self.cache = None
+        self.cached = {}
+        self.buildFs = False
+        self.streamSize = 0
+        self.compressed = None
+        self.streamDigest = None
+        self.jobs = JobEngine()
+        self.job = None
+        self.future = None
+        self.error = None
+        self.process = None
+        self.interrupted = threading.Event()
+        self.stageTimeouts = {'mount': 300, 'format': 600, 'cleanup': 300}
+        self.stats = Stats()
+        self.progress = ProgressModel()
+        self.statsPath = None
+        self.statsTextfile = None
+        self.interactive = True
 
     def getStringBuffer(self):
-        """locks thread while getting buffer and returns result"""
+        """locks thread while rendering unread events of the buffer as text and returns result"""
         ret = ''
         self.mutex.acquire()
         ret = self.buffer.read()
         self.mutex.release()
         return ret
 
+    def notify(self, kind=None):
+        """calls the listener when events are stored in the buffer or the job has finished"""
+        if self.listener is not None:
+            self.listener()
+
+    def stageStart(self, description, logging=True):
+        """records the start of a stage in the buffer and prints it if verbose"""
+        if logging:
+            self.mutex.acquire()
+            self.buffer.stageStart(description)
+            self.mutex.release()
+
+        if self.verbose:
+            print(description, end='')
+
+    def stageEnd(self, result='done', logging=True):
+        """records the result of the current stage in the buffer and prints it if verbose"""
+        if logging:
+            self.mutex.acquire()
+            self.buffer.stageEnd(result)
+            self.mutex.release()
+
+        if self.verbose:
+            print(result)
+
+    def fileCallback(self, path, size, seconds=0.0, count=1):
+        """records files that have been copied completely and how long they took
+
+        A batch of count small files is recorded at once under its directory's path.
+        """
+        self.mutex.acquire()
+        self.buffer.fileDone(path, size, count)
+        self.mutex.release()
+        self.stats.fileDone(path, size, seconds, count)
+        self.progress.add(files=count)
+
     def progressCallback(self, bytesWritten):
-        """prints percentange of image that has successfully been copied"""
+        """prints percentange of image that has successfully been copied
+
+        The throughput and ETA come from the progress model, which can also be read
+        without a lock through self.progress.snapshot().
+        """
+        if self.interrupted.is_set():
+            raise JobCancelled('cancelled')
         self.mutex.acquire()
         self.totalBytesWritten += bytesWritten
+        compressed = self.compressed
+        if compressed is not None:
+            # the size of a compressed image is estimated until all of it is read
+            self.totalBytes = max(self.totalBytesWritten, self.expectedBytes())
         self.copyProgress = float(self.totalBytesWritten/self.totalBytes)*100
-        self.buffer.write('copying image... {0:.2f}%\n'.format(self.copyProgress))
+        devices = self.deviceSummary()
+        self.buffer.progress(self.totalBytesWritten, self.totalBytes, devices)
+        self.progress.add(bytesWritten, totalBytes=self.totalBytes)
         if self.verbose:
-            stdout.write('copying image... {0:.2f}%\r'.format(self.copyProgress))
+            snapshot = self.progress.snapshot()
+            rate = '{0:.1f} MB/s, {1} left'.format(snapshot['mbPerSecond'],
+                                                   formatEta(snapshot['eta']))
+            if devices:
+                rate += ', ' + devices
+        if self.verbose and compressed is not None:
+            stdout.write('copying image... {0:.2f}% ({1:.0f} of {2:.0f} MB compressed read, '
+                         '{3:.0f} MB written, {4})\r'.format(self.copyProgress,
+                                                              compressed.compressedRead() / 1024**2,
+                                                              compressed.compressedSize / 1024**2,
+                                                              self.totalBytesWritten / 1024**2,
+                                                              rate))
+        elif self.verbose:
+            stdout.write('copying image... {0:.2f}% ({1})\r'.format(self.copyProgress, rate))
         self.mutex.release()
+        self.stats.addBytes(bytesWritten)
         stdout.flush()
 
-    def copyfileobj(self, fsrc, fdst, length=(16*1024)):
-        """taken directly from shutil.copyfileobj
+    def bufferOptions(self):
+        """returns the buffer count and size to copy with, each copier has its own default size"""
+        options = {'bufferCount': self.bufferCount}
+        if self.bufferSize:
+            options['bufferSize'] = self.bufferSize
+        return options
 
-        this method is exactly the same as the library method except for the added
-        progressCallback() function call to update users on how much of the image
-        has been successfully copied
+    def planCopy(self):
+        """creates the CopyEngine and builds its work list, which also gives the image size
+
+        Files are streamed straight out of the image if it was opened with an IsoReader,
+        otherwise the mounted image is walked once.
         """
-        fsrcRead = fsrc.read
-        fdstWrite = fdst.write
-        while True:
-            buf = fsrcRead(length)
-            if not buf:
-                break
-            fdstWrite(buf)
-            self.progressCallback(len(buf))
+        self.engine = CopyEngine(self.isoMount, self.target, self.progressCallback,
+                                 self.workers, reader=self.reader,
+                                 fileCallback=self.fileCallback,
+                                 algorithm=self.hashAlgorithm if self.verify else None,
+                                 writeWindow=self.writeWindow, dropCache=self.dropCache,
+                                 **self.bufferOptions())
+        if 'files' in self.cached:
+            self.engine.loadWorkList(self.cached['directories'],
+                                     (entry[:3] for entry in self.cached['files']))
+        else:
+            self.engine.buildWorkList()
+            self.describeImage()
+        self.totalBytes = self.engine.totalBytes * max(1, len(self.devices))
+        self.progress.add(totalBytes=self.totalBytes, totalFiles=self.engine.totalFiles)
 
-    def copyImage(self):
-        """copies everything from the mounted image onto the mounted partition (except symlinks)"""
-        # shutil.copytree() is used to preserve nested directories
-        for entry in os.listdir(self.isoMount):
-            isoEntry = self.isoMount + entry
-            targetEntry = self.target + entry
-            if os.path.islink(isoEntry):
+        # files don't have to pass through userspace if their hashes are already known
+        knownHashes = self.knownHashes()
+        if all(entry[0] in knownHashes for entry in self.engine.files()):
+            self.engine.algorithm = None
+
+        # record every file of the image so the next run can update the drive incrementally
+        self.manifest = Manifest(image=os.path.basename(self.iso))
+        for relPath, size in self.engine.files():
+            self.manifest.add(relPath, size, self.engine.mtimes[relPath])
+
+    def describeImage(self):
+        """records the file list of the image built by planCopy so it can be cached"""
+        extents = {}
+        if self.reader is not None:
+            extents = {entry.path: entry.extents for entry in self.reader.files()}
+        self.cached['mounted'] = self.reader is None
+        self.cached['directories'] = self.engine.directories
+        self.cached['files'] = [[relPath, size, self.engine.mtimes[relPath],
+                                 extents.get(relPath, [])]
+                                for relPath, size in self.engine.files()]
+
+    def knownHashes(self):
+        """returns the hashes of the image's files already known from the cache"""
+        return self.cached.get('hashes', {}).get(self.hashAlgorithm, {})
+
+    def loadCache(self):
+        """looks the image up in the metadata cache"""
+        self.cached = {}
+        if self.cache is not None:
+            self.cached = self.cache.get(self.iso) or {}
+
+    def saveCache(self):
+        """adds the hashes taken while copying to the cached metadata and stores it"""
+        if self.hashes:
+            hashes = self.cached.setdefault('hashes', {})
+            hashes.setdefault(self.hashAlgorithm, {}).update(self.hashes)
+        if self.cache is not None:
+            self.cache.put(self.iso, self.cached)
+
+    def isFat32(self, device):
+        """returns if a partition already holds a FAT32 file system"""
+        try:
+            with open(device, 'rb') as f:
+                bootSector = f.read(512)
+        except OSError:
+            return False
+        return bootSector[82:90] == b'FAT32   ' and bootSector[510:512] == b'\x55\xaa'
+
+    def mountExisting(self):
+        """mounts the partition without formatting it if an earlier run left a manifest on it
+
+        Returns the manifest, or None if the partition has to be formatted and copied in full.
+        """
+        if not self.isFat32(self.device):
+            return None
+        self.mount('mouting {0} to {1}...'.format(self.device, self.target), self.device,
+                   self.target)
+        previous = Manifest.load(self.target)
+        if previous is None:
+            self.unmount('unmounting {0}...'.format(self.device), self.target)
+        return previous
+
+    def planIncremental(self, previous):
+        """drops files that are already identical on the target from the work list
+
+        A file is unchanged if its size and mtime match the previous manifest and the
+        copy on the target still has that size. When verifying, files that were hashed
+        the last time are also hashed from the image and compared. The previous manifest
+        is deleted before files that are no longer in the image are deleted from the
+        target, a new one is only written once the copy has succeeded.
+        """
+        self.stageStart('comparing with previous copy...')
+        unchanged = []
+        for relPath, entry in self.manifest.files.items():
+            if not previous.unchanged(self.target, relPath, entry['size'], entry['mtime']):
+                continue
+            digest = previous.files[relPath].get('hash')
+            if self.verify and digest is not None and self.sourceHash(relPath) != digest:
+                continue
+            if digest is not None:
+                entry['hash'] = digest
+            unchanged.append(relPath)
+
+        Manifest.invalidate(self.target)
+        removed = previous.removeStale(self.target, self.manifest.files)
+        self.engine.skip(unchanged)
+        self.totalBytes = self.engine.totalBytes
+        self.progress.add(totalBytes=self.totalBytes, totalFiles=self.engine.totalFiles)
+        self.stageEnd('{0} unchanged, {1} to copy, {2} removed'.format(
+            len(unchanged), self.engine.totalFiles, len(removed)))
+
+    def writeManifest(self):
+        """stores the manifest, with the hashes taken while copying, on every device written
+
+        Everything copied is synced first, so the manifest never describes files that
+        aren't on the device yet.
+        """
+        for relPath, digest in self.hashes.items():
+            if relPath in self.manifest.files:
+                self.manifest.files[relPath]['hash'] = digest
+        os.sync()
+        for device in self.devices:
+            if device in self.failedDevices:
                 continue
-            elif os.path.isdir(isoEntry):
-                shutil.copytree(isoEntry, targetEntry)
-            elif os.path.isfile(isoEntry):
-                shutil.copy(isoEntry, self.target)
+            try:
+                self.manifest.save(self.targetFor(device))
+            except OSError as err:
+                # the drive is still usable, the next run just can't be incremental
+                message = 'Warning: could not write manifest to {0}: {1}'.format(device,
+                                                                                err.strerror)
+                self.mutex.acquire()
+                self.buffer.error(message)
+                self.mutex.release()
+                print(message, file=stderr)
+
+    def copyImage(self):
+        """copies everything from the mounted image onto the mounted partition (except symlinks)
+
+        The tree is copied by a CopyEngine using self.workers threads, progressCallback
+        is thread safe so progress stays correct across workers. The work list built by
+        planCopy is reused so the image isn't walked twice.
+        """
+        if self.engine is None:
+            self.planCopy()
+        self.hashes = {}
+        if len(self.devices) > 1:
+            self.fanOutTree()
+        elif self.verify and self.engine.algorithm is None:
+            copied = [entry[0] for entry in self.engine.files()]
+            self.engine.run()
+            self.hashes = {relPath: self.knownHashes()[relPath] for relPath in copied}
+        else:
+            self.engine.run()
+            self.hashes = self.engine.hashes
+        self.engine = None
 
         # delete previous line from callback function
         if self.verbose:
             stdout.write('\x1b[2K')
             print('copying image...done')
 
-    def executeCommand(self, description, command, logging=True):
-        """Executes command given and exits if error is encountered"""
-        if logging:
+    def writeImage(self):
+        """writes the image byte for byte onto the whole device (or every device given)
+
+        Compressed images are decompressed while they are written.
+        """
+        from bdc.compressedImage import CompressedImage, compression
+        knownHash = self.knownHashes().get('')
+        digest = hashlib.new(self.hashAlgorithm) if self.verify and not knownHash else None
+        if compression(self.iso) is not None:
+            self.compressed = CompressedImage(self.iso, self.dropCache)
+            self.compressed.open()
+            self.totalBytes = self.compressed.estimatedSize() * len(self.devices)
+        try:
+            if len(self.devices) > 1:
+                if self.compressed is not None:
+                    self.fanOutImage(self.compressed, None, digest)
+                else:
+                    with open(self.iso, 'rb') as fsrc:
+                        self.fanOutImage(fsrc, DropBehind(fsrc.fileno(), self.dropCache), digest)
+                self.streamSize = self.compressed.bytesRead if self.compressed is not None \
+                    else os.path.getsize(self.iso)
+            else:
+                writer = RawWriter(self.iso, self.device, self.progressCallback, digest=digest,
+                                   writeWindow=self.writeWindow, dropCache=self.dropCache,
+                                   source=self.compressed, **self.bufferOptions())
+                writer.run()
+                self.streamSize = writer.totalBytes
+        finally:
+            if self.compressed is not None:
+                self.compressed.close()
+                self.compressed = None
+
+        self.hashes = {'': digest.hexdigest()} if digest is not None else {}
+        if self.verify and knownHash:
+            self.hashes = {'': knownHash}
+
+        # delete previous line from callback function
+        if self.verbose:
+            stdout.write('\x1b[2K')
+            print('writing image...done')
+
+    def fanOutImage(self, fsrc, dropBehind, digest):
+        """writes the whole content of the open image onto every device at once"""
+        from bdc.fanOut import RawSink
+        from bdc.verifier import HashingReader
+        sinks = [RawSink(device) for device in self.devices]
+        if digest is not None:
+            fsrc = HashingReader(fsrc, digest)
+        fanOut = self.startFanOut(sinks, self.totalBytes // len(self.devices))
+        self.reportDevices(fanOut.run(lambda fanOut: fanOut.writeStream(fsrc, dropBehind)))
+
+    def sourceChunks(self, path):
+        """returns an iterator over the contents of a file of the image in chunks"""
+        if self.reader is not None:
+            return self.reader.readChunks(self.reader.entry(path))
+        return self.readFileChunks(os.path.join(self.isoMount, path), self.dropCache)
+
+    def sourceHash(self, path):
+        """returns the hex digest of a file of the image, from the cache if it is known"""
+        if path in self.knownHashes():
+            return self.knownHashes()[path]
+        digest = hashlib.new(self.hashAlgorithm)
+        for buf in self.sourceChunks(path):
+            digest.update(buf)
+        return digest.hexdigest()
+
+    def buildImage(self):
+        """builds the FAT32 file system in userspace and streams it onto the partition
+
+        This replaces formatting, mounting and copying file by file. Since the partition
+        is never mounted, the manifest is added to the file system as one more file.
+        When verifying, the whole stream is hashed so it can be read back in one pass.
+        """
+        from bdc.fatImage import FatImageBuilder, FatError
+        knownHashes = self.knownHashes()
+        for relPath, entry in self.manifest.files.items():
+            if relPath in knownHashes:
+                entry['hash'] = knownHashes[relPath]
+        manifestData = self.manifest.data()
+        files = [(relPath, size, self.engine.mtimes[relPath])
+                 for relPath, size in self.engine.files()]
+        files.append((MANIFEST_NAME, len(manifestData), int(time())))
+        self.totalBytes = self.engine.totalBytes + len(manifestData)
+
+        def readChunks(path):
+            """yields the contents of a file of the image or of the manifest"""
+            if path == MANIFEST_NAME:
+                yield manifestData
+            else:
+                yield from self.readChunks(path)
+
+        partition = self.topology.getPartitions().get(self.device)
+        digest = hashlib.new(self.hashAlgorithm) if self.verify else None
+        self.hashes = {}
+        with open(self.device, 'r+b', buffering=(4*1024**2)) as fdst:
+            try:
+                builder = FatImageBuilder(fdst.seek(0, os.SEEK_END), self.engine.directories,
+                                          files, hiddenSectors=partition.start if partition else 0)
+            except FatError as err:
+                raise JobError('can\'t build file system on \'{0}\': {1}'.format(self.device,
+                                                                                  err))
+            fdst.seek(0)
+            writeBack = WriteBack(self.progressCallback, self.writeWindow,
+                                  dropCache=self.dropCache)
+            stream = writeBack.stream(fdst.fileno(), flush=fdst.flush)
+            try:
+                builder.write(fdst, readChunks, self.progressCallback, digest, stream)
+                fdst.flush()
+                stream.close()
+                writeBack.drain()
+            finally:
+                writeBack.abort()
+            os.fsync(fdst.fileno())
+
+        self.streamSize = builder.bytesWritten
+        self.streamDigest = digest.hexdigest() if digest is not None else None
+        self.engine = None
+
+        # delete previous line from callback function
+        if self.verbose:
+            stdout.write('\x1b[2K')
+            print('writing file system...done')
+
+    def readChunks(self, path):
+        """yields the contents of a file of the image in chunks, hashing them if verifying"""
+        digest = hashlib.new(self.hashAlgorithm) if self.verify else None
+        for buf in self.sourceChunks(path):
+            if digest is not None:
+                digest.update(buf)
+            yield buf
+
+        if digest is not None:
+            self.hashes[path] = digest.hexdigest()
+
+    @staticmethod
+    def readFileChunks(path, dropCache=False):
+        """yields the contents of a file in chunks, dropping them from the page cache if asked"""
+        with open(path, 'rb') as fsrc:
+            source = DropBehind(fsrc.fileno(), dropCache)
+            while True:
+                buf = fsrc.read(4*1024**2)
+                if not buf:
+                    source.close()
+                    return
+                source.advance(len(buf))
+                yield buf
+
+    def fanOutCallback(self, writer, bytesWritten):
+        """adds bytes written to one of several devices to the overall progress
+
+        The writer has already added them to its own bytesCommitted.
+        """
+        self.progressCallback(bytesWritten)
+
+    def deviceFailed(self, writer):
+        """drops what a device that failed won't write anymore from the overall progress"""
+        self.mutex.acquire()
+        self.totalBytes = max(self.totalBytesWritten, self.expectedBytes())
+        if self.totalBytes:
+            self.copyProgress = float(self.totalBytesWritten/self.totalBytes)*100
+        self.buffer.progress(self.totalBytesWritten, self.totalBytes, self.deviceSummary())
+        self.progress.add(totalBytes=self.totalBytes)
+        self.mutex.release()
+
+    def startFanOut(self, sinks, size):
+        """returns a FanOutWriter for the sinks, size is the number of bytes each device gets
+
+        Its writers are kept so progress can be shown per device.
+        """
+        from bdc.fanOut import FanOutWriter
+        fanOut = FanOutWriter(sinks, self.fanOutCallback, writeWindow=self.writeWindow,
+                              dropCache=self.dropCache, failed=self.deviceFailed)
+        self.mutex.acquire()
+        self.deviceWriters = fanOut.writers
+        self.deviceSize = size
+        self.mutex.release()
+        return fanOut
+
+    def expectedBytes(self):
+        """returns the bytes every device is expected to get in total
+
+        A device that failed only counts what it committed, the size of a compressed
+        image is estimated until all of it is read. Has to be called with the lock held.
+        """
+        size = self.deviceSize
+        if self.compressed is not None:
+            size = self.compressed.estimatedSize()
+        if not self.deviceWriters:
+            return size * len(self.devices)
+        return sum(writer.bytesCommitted if writer.error is not None else size
+                   for writer in self.deviceWriters)
+
+    def deviceProgress(self):
+        """returns the progress of every device of a fan-out by device
+
+        Every entry holds the bytes committed, the percentage of the device done and if
+        the device failed. Empty unless the image is written onto several devices.
+        """
+        size = self.deviceSize
+        compressed = self.compressed
+        if compressed is not None:
+            size = compressed.estimatedSize()
+        ret = {}
+        for writer in self.deviceWriters:
+            done = writer.bytesCommitted
+            ret[writer.device] = {'bytes': done,
+                                  'progress': min(100.0, done / size * 100) if size else 0.0,
+                                  'failed': writer.error is not None}
+        return ret
+
+    def deviceSummary(self):
+        """returns the progress of every device of a fan-out as text, like 'sdb 50%, sdc failed'"""
+        parts = []
+        for device, entry in self.deviceProgress().items():
+            name = os.path.basename(device)
+            if entry['failed']:
+                parts.append('{0} failed'.format(name))
+            else:
+                parts.append('{0} {1:.0f}%'.format(name, entry['progress']))
+        return ', '.join(parts)
+
+    def fanOutTree(self):
+        """copies the work list onto every mounted device while reading each file only once"""
+        from bdc.fanOut import TreeSink
+        sinks = [TreeSink(device, self.targetFor(device)) for device in self.devices]
+        files = [entry[0] for entry in self.engine.files()]
+        fanOut = self.startFanOut(sinks, self.engine.totalBytes)
+        self.reportDevices(fanOut.run(
+            lambda fanOut: fanOut.writeTree(self.engine.directories, files, self.readChunks)))
+
+    def reportDevices(self, writers):
+        """logs the throughput of every device and the error of every device that failed
+
+        Raises JobError naming the failed devices once all of them have been logged.
+        """
+        self.failedDevices = []
+        for writer in writers:
+            self.stats.deviceFinished(writer.device, writer.bytesCommitted,
+                                      writer.endTime - writer.startTime, writer.error)
+            if writer.error is None:
+                self.stageStart('{0}: '.format(writer.device))
+                self.stageEnd('{0:.2f} MB/s'.format(writer.throughput()))
+                continue
+
+            self.failedDevices.append(writer.device)
+            message = 'Error: writing {0} failed: {1}'.format(writer.device, writer.error)
             self.mutex.acquire()
-            self.buffer.write(description)
+            self.buffer.error(message)
             self.mutex.release()
+            print(message, file=stderr)
 
-        if self.verbose:
-            print(description, end='')
+        if self.failedDevices:
+            raise JobError('writing failed on {0}'.format(', '.join(self.failedDevices)))
+
+    def verifyImage(self):
+        """reads back what was written to every device and compares it to the copy hashes
 
-        process = Popen(command, stdout=PIPE, stderr=PIPE, shell=True)
-        out, err = process.communicate()
+        Files are read on self.workers threads. Every mismatch is logged and kept in
+        self.mismatches as a (device, path, problem) tuple, then JobError is raised
+        listing them.
+        """
+        from bdc.verifier import Verifier
+        self.stageStart('verifying image...')
+        self.mismatches = []
+        for device in self.devices:
+            if device in self.failedDevices:
+                continue
+            if self.raw or self.buildFs:
+                expected = self.hashes[''] if self.raw else self.streamDigest
+                problem = Verifier(device, {}, self.hashAlgorithm).checkDevice(device,
+                                                                               self.streamSize,
+                                                                               expected)
+                problems = [('', problem)] if problem is not None else []
+            else:
+                problems = Verifier(self.targetFor(device), self.hashes, self.hashAlgorithm,
+                                    self.workers).run()
+            self.mismatches += [(device, path, problem) for path, problem in problems]
+
+        if not self.mismatches:
+            self.stageEnd()
+            return
+
+        self.stageEnd('{0} mismatches'.format(len(self.mismatches)))
+        for device, path, problem in self.mismatches:
+            message = 'Error: {0}: {1}'.format(os.path.join(device, path) if path else device,
+                                               problem)
+            self.mutex.acquire()
+            self.buffer.error(message)
+            self.mutex.release()
+            print(message, file=stderr)
+        raise JobError('verification failed: {0}'.format(', '.join(
+            os.path.join(device, path) if path else device
+            for device, path, problem in self.mismatches)))
+
+    def executeCommand(self, description, command, logging=True):
+        """Executes command given and raises CommandError if error is encountered
+
+        command is a list of arguments, it is run without a shell so paths can contain spaces.
+        """
+        self.stageStart(description, logging)
+
+        text = ' '.join(quote(arg) for arg in command)
+        started = monotonic()
+        process = Popen(command, stdout=PIPE, stderr=PIPE)
+        self.mutex.acquire()
+        self.process = process
+        self.mutex.release()
+        try:
+            out, err = process.communicate()
+        finally:
+            self.mutex.acquire()
+            self.process = None
+            self.mutex.release()
+            self.stats.command(description, text, monotonic() - started, process.returncode)
         out = out[:-1].decode()
         err = err[:-1].decode()
 
         if process.returncode:
-            print('fail\n\'{0}\' returned the following error:\n\'{1}\''.format(command, err),
-                  file=stderr)
-            sys.exit(process.returncode)
+            self.commandFailed(text, err, logging)
+            raise CommandError('\'{0}\' failed'.format(text), process.returncode)
+
+        self.stageEnd('done', logging)
+
+        return out
 
+    def executeMount(self, description, command, operation, logging=True):
+        """Runs a mount operation like executeCommand, command describes it in the log"""
+        self.stageStart(description, logging)
+
+        started = monotonic()
+        code = 0
+        try:
+            operation()
+        except MountError as err:
+            code = err.code
+            self.commandFailed(command, str(err), logging)
+            raise CommandError('\'{0}\' failed'.format(command), code)
+        finally:
+            self.stats.command(description, command, monotonic() - started, code)
+
+        self.stageEnd('done', logging)
+
+    def commandFailed(self, command, err, logging=True):
+        """logs the error of a failed command"""
         if logging:
             self.mutex.acquire()
-            self.buffer.write('done\n')
+            self.buffer.stageEnd('fail')
+            self.buffer.error('\'{0}\' returned the following error:\n\'{1}\''
+                              .format(command, err))
             self.mutex.release()
+        print('fail\n\'{0}\' returned the following error:\n\'{1}\''.format(command, err),
+              file=stderr)
 
-        if self.verbose:
-            print('done')
+    def mount(self, description, device, target):
+        """mounts the FAT32 file system of a partition on target"""
+        self.executeMount(description, 'mount {0} {1}'.format(quote(device), quote(target)),
+                          lambda: self.mounts.mount(device, target, 'vfat'))
 
-        return out
+    def unmount(self, description, target):
+        """unmounts the file system mounted on target"""
+        self.executeMount(description, 'umount {0}'.format(quote(target)),
+                          lambda: self.mounts.unmount(target))
 
     def getAvailablePartitions(self, logging=True):
         """Creates and returns dictionary of partitions and their mountpoints"""
-        # get list of partitions
-        out = self.executeCommand('getting available partitions...',
-                                  'lsblk -l | awk \'{if($6 == "part") {print $1","$7}}\'', logging)
+        self.stageStart('getting available partitions...', logging)
 
         # creates dictionary of partitions and their mount points (ex {'/dev/sdb1':'/mnt/target'})
         # if mount point is '', then partition is not mounted
-        devices = {}
-        for line in out.split('\n'):
-            parts = line.split(',')
-            devices[('/dev/' + parts[0])] = parts[1]
+        devices = {path: partition.mountpoint()
+                   for path, partition in self.topology.getPartitions().items()}
 
+        self.stageEnd('done', logging)
         return devices
 
     def validateInput(self, args):
         """Validates user input and if input is correct, takes appropriate action"""
+        from bdc.compressedImage import compression, decompressor, FORMATS, MODULES
+        from bdc.imageCache import ImageCache
         # check if script was executed with root privilages
         self.checkRoot()
 
-        self.device = args.device
+        # device is a list when several devices are written at once
+        self.devices = args.device if isinstance(args.device, list) else [args.device]
+        self.device = self.devices[0]
         self.iso = args.image
         self.verbose = not args.silent
 
@@ -173,16 +737,78 @@ class BootableDiskCreator:
         if args.device_mount:
             self.target = args.device_mount
 
-        # check if file provided has .iso extension
-        if self.iso.split('.')[-1] != 'iso':
+        if args.workers:
+            self.workers = args.workers
+
+        if args.write_window is not None:
+            if args.write_window < 0:
+                sys.exit('Error: --write-window can\'t be negative')
+            self.writeWindow = args.write_window*1024**2
+
+        self.dropCache = not args.keep_page_cache
+
+        if args.buffers is not None:
+            if args.buffers < 2:
+                sys.exit('Error: --buffers has to be at least 2')
+            self.bufferCount = args.buffers
+
+        if args.buffer_size is not None:
+            if args.buffer_size < 1:
+                sys.exit('Error: --buffer-size has to be at least 1')
+            self.bufferSize = args.buffer_size*1024**2
+
+        self.raw = args.raw
+        self.verify = args.verify
+        self.incremental = args.incremental
+        self.cache = None if args.no_cache else ImageCache()
+        self.buildFs = args.build_fs
+        self.statsPath = args.stats
+        self.statsTextfile = args.stats_textfile
+
+        if self.buildFs and (self.raw or self.incremental or len(self.devices) > 1):
+            sys.exit('Error: --build-fs only works with a single partition and can\'t be '
+                     'combined with --raw or --incremental')
+
+        if self.incremental and (self.raw or len(self.devices) > 1):
+            sys.exit('Error: --incremental only works with a single partition')
+
+        # check if file provided has .iso extension, possibly followed by a compression one
+        fmt = compression(self.iso)
+        name = self.iso[:-len(fmt) - 1] if fmt else self.iso
+        if name.split('.')[-1] != 'iso':
             sys.exit('Error: \'{0}\' is not an ISO image'.format(self.iso))
 
+        if fmt and not self.raw:
+            sys.exit('Error: compressed images can only be written with --raw')
+
+        if fmt and fmt not in MODULES and decompressor(fmt) is None:
+            sys.exit('Error: {0} is needed to decompress \'{1}\''
+                     .format(FORMATS[fmt][0][0], self.iso))
+
         # check if image file provided exists
         if not os.path.isfile(self.iso):
             sys.exit('Error: image \'{0}\' does not exist'.format(self.iso))
 
         devices = self.getAvailablePartitions()
 
+        for device in self.devices:
+            self.device = device
+            if self.raw:
+                self.validateRawTarget()
+            else:
+                self.validatePartition(devices)
+        self.device = self.devices[0]
+
+        if self.raw:
+            return
+
+        # if mount point does not exist, make it
+        for mountPoint in [self.isoMount] + [self.targetFor(device) for device in self.devices]:
+            if not os.path.isdir(mountPoint):
+                os.makedirs(mountPoint)
+
+    def validatePartition(self, devices):
+        """Validates a partition to be formatted and unmounts it if needed"""
         # check if partition exists
         if self.device not in devices.keys():
             sys.exit('Error: partition \'{0}\' does not exist'.format(self.device))
@@ -199,11 +825,12 @@ class BootableDiskCreator:
                      .format(self.device, devices[self.device]))
 
         # check if user provided partition on same disk as OS and warn them
-        osDisk = False
+        osDisk = self.topology.diskOf(self.device) in self.topology.systemDisks()
         choice = ''
-        for key, value in devices.items():
-            if self.device[:-1] in key and (value == '/' or '/boot' in value):
-                osDisk = True
+
+        if osDisk and not self.interactive:
+            sys.exit('Error: partition \'{0}\' is on the same disk as your OS'
+                     .format(self.device))
 
         if osDisk:
             print(('Warning: it looks like the given partition is on the same disk as your OS.\n'
@@ -222,13 +849,45 @@ class BootableDiskCreator:
 
         # if device is mounted, unmount it
         if devices[self.device] != '':
-            self.executeCommand('unmounting drive to be formated...',
-                                'umount {0}'.format(self.device))
+            self.unmount('unmounting drive to be formated...', devices[self.device])
 
-        # if mount point does not exist, make it
-        for mountPoint in [self.isoMount, self.target]:
-            if not os.path.isdir(mountPoint):
-                os.mkdir(mountPoint)
+    def targetFor(self, device):
+        """returns the mount point of a device, each device gets its own below target"""
+        if len(self.devices) > 1:
+            return os.path.join(self.target, os.path.basename(device))
+        return self.target
+
+    def validateRawTarget(self):
+        """Validates the whole device an image is written to in raw mode"""
+        from bdc.compressedImage import imageSize
+        # check if device exists and is a block device
+        if not os.path.exists(self.device) or not stat.S_ISBLK(os.stat(self.device).st_mode):
+            sys.exit('Error: device \'{0}\' does not exist'.format(self.device))
+
+        fd = os.open(self.device, os.O_RDONLY)
+        try:
+            deviceSize = os.lseek(fd, 0, os.SEEK_END)
+        finally:
+            os.close(fd)
+
+        # the size of most compressed images isn't known before they are written
+        imageBytes = imageSize(self.iso)
+        if imageBytes is not None and imageBytes > deviceSize:
+            sys.exit('Error: not enough space to copy \'{0}\' onto \'{1}\''
+                     .format(self.iso, self.device))
+
+        # check if any partition on the device is mounted as something important
+        partitions = self.topology.partitionsOf(self.device)
+        for partition in partitions:
+            for mountpoint in partition.mountpoints:
+                if self.topology.isSystemMount(mountpoint):
+                    sys.exit('Error: partition \'{0}\' currently mounted as \'{1}\''
+                             .format(partition.path, mountpoint))
+
+        # unmount every mounted partition on the device
+        for partition in partitions:
+            for mountpoint in partition.mountpoints:
+                self.unmount('unmounting {0}...'.format(partition.path), mountpoint)
 
     def checkRoot(self):
         """checks if script was executed with root privilages
@@ -240,44 +899,218 @@ class BootableDiskCreator:
             sys.exit('Error: must run as root')
 
     def start(self, args):
-        """validates user input and starts thread to create drive"""
-        self.validateInput(args)
+        """validates user input and submits the job that creates the drive to the job engine"""
+        try:
+            self.validateInput(args)
+        except CommandError as err:
+            sys.exit(err.returncode)
 
-        self.thread = threading.Thread(target=self.main)
-        self.thread.start()
+        self.future = self.jobs.submit(self.createJob())
 
-    def main(self):
-        """Reads command line arguments, mounts image, and copies image files to given partition"""
-        self.done = False
+    def openImage(self):
+        """opens the image with an in-process ISO9660 reader so it doesn't have to be mounted
 
-        # check if the image mount point is already in use
-        if os.path.ismount(self.isoMount):
-            self.executeCommand('unmounting previously mounted iso...',
-                                'umount {0}'.format(self.isoMount))
+        Returns None if the image can't be read that way (UDF images for example), in
+        which case it has to be loop mounted instead
+        """
+        from bdc.isoReader import IsoEntry, IsoReader, IsoError
+        self.stageStart('reading image metadata...')
+        if self.cached.get('mounted'):
+            self.stageEnd('cached, image has to be loop mounted')
+            return None
+
+        entries = None
+        if 'files' in self.cached:
+            entries = [IsoEntry(directory, isDir=True) for directory in self.cached['directories']]
+            entries += [IsoEntry(relPath, size, [tuple(extent) for extent in extents], mtime=mtime)
+                        for relPath, size, mtime, extents in self.cached['files']]
+        reader = IsoReader(self.iso, self.dropCache)
+        try:
+            reader.open(entries)
+        except (OSError, IsoError):
+            self.stageEnd('unsupported, falling back to loop mount')
+            return None
 
-        # mount iso image onto loop device
-        self.executeCommand('mounting image...',
-                            'mount -o loop {0} {1}'.format(self.iso, self.isoMount))
+        self.stageEnd()
+        return reader
 
-        # get size of mounted image
-        self.totalBytes = int(self.executeCommand(
-            'getting size of mounted image...',
-            'du -sb {0} | awk \'{{print $1}}\''.format(self.isoMount)))
+    def mountImage(self):
+        """opens the image in-process, or loop mounts it if the reader can't handle it"""
+        self.reader = self.openImage()
+        if self.reader is None:
+            # check if the image mount point is already in use
+            if os.path.ismount(self.isoMount):
+                self.unmount('unmounting previously mounted iso...', self.isoMount)
 
-        # format given partition and then mount it
-        self.executeCommand('formatting partition as fat32...',
-                            'mkfs.fat -F32 -I {0}'.format(self.device))
-        self.executeCommand('mouting {0} to {1}...'.format(self.device, self.target),
-                            'mount {0} {1}'.format(self.device, self.target))
+            # mount iso image onto loop device
+            self.executeMount('mounting image...', 'mount -o loop,ro {0} {1}'
+                              .format(quote(self.iso), quote(self.isoMount)),
+                              lambda: self.mounts.mountImage(self.iso, self.isoMount))
 
-        # use overridden copy funtion which includes callback
-        shutil.copyfileobj = self.copyfileobj
+    def sizeImage(self):
+        """gets the size of the image and the list of files to copy"""
+        self.stageStart('getting size of image...')
+        self.planCopy()
+        self.stageEnd()
 
+    def prepareDevices(self):
+        """formats and mounts every partition, or mounts one that can be updated in place"""
         self.totalBytesWritten = 0
-        self.copyImage()
+        if self.buildFs:
+            return
+
+        # update a drive written by an earlier run in place if possible
+        previous = self.mountExisting() if self.incremental else None
+        if previous is not None:
+            self.planIncremental(previous)
+            return
+
+        # format given partitions and then mount them
+        for device in self.devices:
+            self.executeCommand('formatting {0} as fat32...'.format(device),
+                                ['mkfs.fat', '-F32', '-I', device])
+            self.mount('mouting {0} to {1}...'.format(device, self.targetFor(device)), device,
+                       self.targetFor(device))
+
+    def writeDevices(self):
+        """copies the image onto every device, verifies it if asked to and caches its metadata"""
+        if self.raw:
+            self.totalBytes = os.path.getsize(self.iso) * len(self.devices)
+            self.totalBytesWritten = 0
+            self.writeImage()
+        elif self.buildFs:
+            self.buildImage()
+        else:
+            self.copyImage()
+
+        if self.verify:
+            self.verifyImage()
+        if not self.raw and not self.buildFs:
+            self.writeManifest()
+        self.saveCache()
+
+    def cleanup(self):
+        """closes or unmounts the image and unmounts every partition"""
+        self.closeImage()
+        self.unmountDevices()
+
+    def closeImage(self):
+        """closes the image reader or unmounts the image if it is mounted"""
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        elif os.path.ismount(self.isoMount):
+            self.unmount('unmounting image...', self.isoMount)
 
-        # final clean up
-        self.executeCommand('unmounting image...', 'umount {0}'.format(self.isoMount))
-        self.executeCommand('unmounting {0}...'.format(self.device),
-                            'umount {0}'.format(self.device))
+    def unmountDevices(self):
+        """unmounts every partition that is mounted"""
+        if self.buildFs:
+            return
+        for device in self.devices:
+            if os.path.ismount(self.targetFor(device)):
+                self.unmount('unmounting {0}...'.format(device), self.targetFor(device))
+
+    def interrupt(self):
+        """stops the running stage by failing the next progress update and killing commands"""
+        self.interrupted.set()
+        self.mutex.acquire()
+        process = self.process
+        self.mutex.release()
+        if process is not None:
+            process.kill()
+
+    def cancel(self):
+        """cancels the running job, what was done so far is rolled back"""
+        if self.job is not None:
+            self.job.cancel()
+
+    def createJob(self):
+        """returns the Job that creates the drive
+
+        Raw writes are a single stage. Otherwise the image is mounted, sized, the
+        partitions are formatted, the image is copied and everything is cleaned up.
+        A failure unmounts whatever was mounted so far.
+        """
+        self.done = False
+        self.error = None
+        self.interrupted.clear()
+        if not self.devices:
+            self.devices = [self.device]
+        self.stats = Stats(self.iso, list(self.devices))
+        self.progress = ProgressModel()
+        self.loadCache()
+
+        def timed(name, run):
+            """returns run timed for the stats and tracked by the progress model"""
+            return self.stats.timed(name, self.progress.timed(name, run))
+
+        timeouts = self.stageTimeouts
+        if self.raw:
+            stages = [Stage('copy', timed('copy', self.writeDevices), cancel=self.interrupt)]
+        else:
+            stages = [Stage('mount', timed('mount', self.mountImage), self.closeImage,
+                            self.interrupt, timeouts.get('mount')),
+                      Stage('size', timed('size', self.sizeImage), None, self.interrupt,
+                            timeouts.get('size')),
+                      Stage('format', timed('format', self.prepareDevices), self.unmountDevices,
+                            self.interrupt, timeouts.get('format')),
+                      Stage('copy', timed('copy', self.writeDevices), None, self.interrupt,
+                            timeouts.get('copy')),
+                      Stage('cleanup', timed('cleanup', self.cleanup), None, self.interrupt,
+                            timeouts.get('cleanup'))]
+        self.job = Job(stages, self.iso, self.finish)
+        return self.job
+
+    def finish(self, error):
+        """records how the job ended and logs the error if it failed"""
+        self.error = error
+        # failed commands have already been logged by executeCommand
+        if error is not None and not isinstance(error, CommandError):
+            message = 'Error: {0}'.format(error if not isinstance(error, JobCancelled) else
+                                          'cancelled, changes were rolled back')
+            self.mutex.acquire()
+            self.buffer.error(message)
+            self.mutex.release()
+            print(message, file=stderr)
+        self.stats.finish(error)
+        self.progress.flush()
+        self.writeStats()
         self.done = True
+        self.notify()
+
+    def writeStats(self):
+        """writes the metrics of the job as JSON and as a Prometheus textfile if asked to
+
+        Metrics are informational, so failing to write them only prints a warning.
+        """
+        for path, write in ((self.statsPath, self.stats.writeJson),
+                            (self.statsTextfile, self.stats.writeTextfile)):
+            if not path:
+                continue
+            try:
+                write(path)
+            except OSError as err:
+                print('Warning: can\'t write stats to \'{0}\': {1}'.format(path, err),
+                      file=stderr)
+
+    def wait(self):
+        """blocks until the job has finished and exits with an error if it failed
+
+        Ctrl-C cancels the job and still waits for it to be rolled back.
+        """
+        try:
+            self.job.finished.wait()
+        except KeyboardInterrupt:
+            self.cancel()
+            self.job.finished.wait()
+
+        if self.error is not None:
+            sys.exit(self.error.returncode if isinstance(self.error, CommandError) else 1)
+
+    def main(self):
+        """creates the drive by running every stage of the job on this thread's event loop"""
+        try:
+            self.jobs.run(self.createJob())
+        except Exception:
+            # finish has already logged the error and recorded it in self.error
+            pass
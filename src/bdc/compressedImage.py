@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""Contains class to stream a compressed image without decompressing it to disk first
+
+Images shipped as .iso.gz, .iso.xz, .iso.zst or .iso.bz2 are decompressed by a child
+process reading the compressed file and are written as they come out of it. Parallel
+decompressors are preferred where the format allows it (pigz, xz -T0, lbzip2 or
+pbzip2), gzip, xz and bzip2 fall back to Python's own modules if no program is found,
+which are only imported then.
+Since the child reads the file descriptor shared with this process, its position
+gives how much of the compressed image has been consumed.
+
+File name: compressedImage.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import importlib
+import os
+import shutil
+from subprocess import Popen, PIPE, DEVNULL
+from bdc.pageCache import DropBehind
+
+# extension of each format and the programs that decompress it to stdout, fastest first
+FORMATS = {
+    'gz': [['pigz', '-d', '-c'], ['gzip', '-d', '-c']],
+    'xz': [['xz', '-d', '-c', '-T0']],
+    'zst': [['zstd', '-d', '-c', '-q']],
+    'bz2': [['lbzip2', '-d', '-c'], ['pbzip2', '-d', '-c'], ['bzip2', '-d', '-c']],
+}
+
+# modules used if none of the programs is installed
+MODULES = {'gz': 'gzip', 'xz': 'lzma', 'bz2': 'bz2'}
+
+class CompressionError(Exception):
+    """raised when a compressed image can't be decompressed"""
+
+def compression(path):
+    """returns the compression format of an image from its extension, or None"""
+    extension = path.rsplit('.', 1)[-1]
+    return extension if extension in FORMATS else None
+
+def decompressor(fmt):
+    """returns the command that decompresses fmt, or None if only a module can"""
+    for command in FORMATS[fmt]:
+        if shutil.which(command[0]):
+            return command
+    return None
+
+def imageSize(path):
+    """returns the size of an image once decompressed, or None if it isn't known up front
+
+    Only xz keeps the uncompressed size in an index that can be read without
+    decompressing everything.
+    """
+    fmt = compression(path)
+    if fmt is None:
+        return os.path.getsize(path)
+    if fmt != 'xz' or decompressor(fmt) is None:
+        return None
+    try:
+        process = Popen(['xz', '--robot', '--list', path], stdout=PIPE, stderr=DEVNULL)
+        output = process.communicate()[0].decode()
+    except OSError:
+        return None
+    if process.returncode != 0:
+        return None
+    for line in output.splitlines():
+        fields = line.split('\t')
+        if fields[0] == 'totals' and len(fields) > 4:
+            return int(fields[4])
+    return None
+
+class CompressedImage:
+    """class that reads a compressed image as a stream of decompressed bytes"""
+    def __init__(self, path, dropCache=False):
+        """initializes member variables, dropCache drops compressed pages once consumed"""
+        self.path = path
+        self.format = compression(path)
+        self.dropCache = dropCache
+        self.compressedSize = os.path.getsize(path)
+        self.size = None
+        self.bytesRead = 0
+        self.file = None
+        self.process = None
+        self.stream = None
+        self.dropBehind = None
+        self.errors = (OSError, EOFError)
+
+    def __enter__(self):
+        """opens the image when used as a context manager"""
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        """closes the image when leaving the context manager"""
+        self.close()
+
+    def open(self):
+        """starts decompressing the image"""
+        if self.format is None:
+            raise CompressionError('\'{0}\' is not a compressed image'.format(self.path))
+        self.size = imageSize(self.path)
+        self.bytesRead = 0
+        self.file = open(self.path, 'rb', buffering=0)
+        self.dropBehind = DropBehind(self.file.fileno(), self.dropCache)
+        command = decompressor(self.format)
+        try:
+            if command is not None:
+                self.process = Popen(command, stdin=self.file, stdout=PIPE, stderr=PIPE)
+                self.stream = self.process.stdout
+            elif self.format in MODULES:
+                module = importlib.import_module(MODULES[self.format])
+                self.stream = module.open(self.file)
+                if hasattr(module, 'LZMAError'):
+                    self.errors = (OSError, EOFError, module.LZMAError)
+            else:
+                raise CompressionError('{0} is needed to decompress \'{1}\''
+                                       .format(FORMATS[self.format][0][0], self.path))
+        except Exception:
+            self.close()
+            raise
+
+    def compressedRead(self):
+        """returns how many bytes of the compressed image have been consumed"""
+        if self.file is None or self.file.closed:
+            return self.compressedSize
+        return os.lseek(self.file.fileno(), 0, os.SEEK_CUR)
+
+    def estimatedSize(self):
+        """returns the size of the decompressed image, estimated from the ratio so far"""
+        if self.size is not None:
+            return self.size
+        consumed = self.compressedRead()
+        if not self.bytesRead or not consumed:
+            return self.compressedSize
+        return max(self.bytesRead, int(self.bytesRead * self.compressedSize / consumed))
+
+    def readinto(self, buf):
+        """fills buf with decompressed bytes, returns less than its length only at the end"""
+        view = memoryview(buf).cast('B')
+        filled = 0
+        try:
+            while filled < len(view):
+                count = self.stream.readinto(view[filled:])
+                if not count:
+                    break
+                filled += count
+        except self.errors as err:
+            raise CompressionError('can\'t decompress \'{0}\': {1}'.format(self.path, err))
+        finally:
+            view.release()
+        self.bytesRead += filled
+        self.dropBehind.advance(self.compressedRead() - self.dropBehind.end)
+        if filled < len(buf):
+            self.finish()
+        return filled
+
+    def read(self, length):
+        """returns up to length decompressed bytes, an empty bytes object at the end"""
+        buf = bytearray(length)
+        count = self.readinto(buf)
+        return bytes(buf[:count])
+
+    def finish(self):
+        """checks that the decompressor succeeded once everything has been read"""
+        if self.process is not None and self.process.poll() is None:
+            self.process.wait()
+        if self.process is not None and self.process.returncode != 0:
+            message = self.process.stderr.read().decode(errors='replace').strip()
+            raise CompressionError('can\'t decompress \'{0}\': {1}'
+                                   .format(self.path, message or 'decompressor failed'))
+        self.size = self.bytesRead
+
+    def close(self):
+        """stops the decompressor and closes the image"""
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+            self.process.stdout.close()
+            self.process.stderr.close()
+            self.process = None
+        elif self.stream is not None:
+            self.stream.close()
+        self.stream = None
+        if self.file is not None:
+            self.dropBehind.close()
+            self.file.close()
+            self.file = None
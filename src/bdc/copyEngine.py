@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+"""Contains class to copy the contents of a mounted image using a pool of worker threads
+
+The whole source tree is walked up front to build a work list, every directory is
+created in a pre-pass, and then large and small files are scheduled on separate
+queues so that slow multi-GB copies never leave the device idle behind them. Files
+copied in userspace are read on a second thread while the last buffer is written.
+Files below smallFileSize are copied in batches from one directory at a time, which
+saves most of the per-file work and keeps the entries of a FAT directory together.
+
+File name: copyEngine.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import errno
+import hashlib
+import os
+import shutil
+import threading
+from collections import deque, OrderedDict
+from time import monotonic
+from bdc.pageCache import advise, DropBehind, FADV_DONTNEED
+from bdc.pipeline import BufferPool, Pipeline
+from bdc.writeBack import WriteBack
+
+# errors meaning a kernel copy syscall can't be used for this pair of files
+FALLBACK_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP,
+                   errno.EBADF, errno.ETXTBSY, errno.EPERM)
+
+class CopyEngine:
+    """class that copies every regular file and directory from source onto target"""
+    def __init__(self, source, target, callback=None, workers=4, largeFileSize=(64*1024**2),
+                 reader=None, fileCallback=None, algorithm=None, writeWindow=None,
+                 dropCache=False, bufferCount=4, bufferSize=(1024**2), smallFileSize=(64*1024)):
+        """initializes member variables
+
+        callback is called with the number of bytes written about every progressInterval
+        bytes and must be thread safe, workers is the size of the pool and largeFileSize is
+        the threshold in bytes at which a file is scheduled on the large file queue.
+        If reader is an open IsoReader, files are streamed out of the image instead of
+        being read from the source directory. fileCallback is called with the relative
+        path, size, copy time in seconds and a file count of 1 for every file once it
+        has been copied, and once per batch of small files with the batch's directory,
+        bytes, time and number of files. If
+        algorithm is set, every file is hashed as it is read and the hex digests are stored
+        in hashes. If writeWindow is set, at most that many bytes written are left waiting
+        for the device and callback is only called once bytes are committed to it.
+        dropCache drops source pages once they are copied and target pages once they
+        are committed. Files copied in userspace go through bufferCount buffers of
+        bufferSize bytes per worker. Files smaller than smallFileSize are copied in
+        batches that fit in one buffer.
+        """
+        self.source = source
+        self.reader = reader
+        self.target = target
+        self.callback = callback
+        self.writeBack = WriteBack(callback, writeWindow, dropCache=dropCache)
+        self.dropCache = dropCache
+        self.fileCallback = fileCallback
+        self.algorithm = algorithm
+        self.hashes = {}
+        self.workers = max(1, workers)
+        self.largeFileSize = largeFileSize
+        self.smallFileSize = smallFileSize
+        self.batchFiles = 256
+        self.batchDescriptors = 8
+        self.bufferCount = max(2, bufferCount)
+        self.bufferSize = bufferSize
+        self.pool = None
+        self.kernelChunk = 8*1024**2
+        self.progressInterval = 8*1024**2
+        self.strategies = [name for name in ('copy_file_range', 'sendfile') if hasattr(os, name)]
+        self.directories = []
+        self.largeFiles = deque()
+        self.smallFiles = deque()
+        self.batches = deque()
+        self.totalBytes = 0
+        self.totalFiles = 0
+        self.mtimes = {}
+        self.mutex = threading.Lock()
+        self.errors = []
+        self.built = False
+
+    def buildWorkList(self):
+        """walks the whole source tree once and sorts its contents into the work lists
+
+        The total size comes out of the same walk, so the mounted image doesn't have to
+        be walked again by du. Symlinks are skipped since they are not supported by FAT32.
+        Large files are ordered biggest first so the longest copies start as early as possible.
+        """
+        self.directories = []
+        if self.reader is not None:
+            self.directories = self.reader.directories()
+            files = ((entry.path, entry.size, entry.mtime) for entry in self.reader.files())
+        else:
+            files = self.walk()
+        self.loadWorkList(self.directories, files)
+
+    def loadWorkList(self, directories, files):
+        """sorts directories and (relative path, size, mtime) tuples into the work lists
+
+        This is also used to plan a copy from cached metadata without walking the image.
+        """
+        self.directories = directories
+        self.mtimes = {}
+        largeFiles = []
+        smallFiles = []
+        batched = []
+        self.totalBytes = 0
+
+        for relPath, size, mtime in files:
+            self.mtimes[relPath] = mtime
+            entry = (relPath, size)
+            if entry[1] >= self.largeFileSize:
+                largeFiles.append(entry)
+            elif entry[1] < min(self.smallFileSize, self.bufferSize):
+                batched.append(entry)
+            else:
+                smallFiles.append(entry)
+            self.totalBytes += entry[1]
+
+        largeFiles.sort(key=lambda entry: entry[1], reverse=True)
+        self.largeFiles = deque(largeFiles)
+        self.smallFiles = deque(smallFiles)
+        self.batches = deque(self.batch(batched))
+        self.totalFiles = len(largeFiles) + len(smallFiles) + len(batched)
+        self.built = True
+
+    def batch(self, files):
+        """splits small files into batches of files from the same directory
+
+        Directories keep the order they were found in and files keep their order within
+        a directory. A batch holds at most batchFiles files and fits in one buffer.
+        """
+        directories = OrderedDict()
+        for entry in files:
+            directories.setdefault(os.path.dirname(entry[0]), []).append(entry)
+        batches = []
+        for entries in directories.values():
+            batch = []
+            batchBytes = 0
+            for entry in entries:
+                if batch and (len(batch) == self.batchFiles or
+                              batchBytes + entry[1] > self.bufferSize):
+                    batches.append(batch)
+                    batch = []
+                    batchBytes = 0
+                batch.append(entry)
+                batchBytes += entry[1]
+            if batch:
+                batches.append(batch)
+        return batches
+
+    def walk(self):
+        """yields the relative path, size and mtime of every regular file below source
+
+        Directories are added to self.directories as they are found. os.scandir is used so
+        file types come from the directory entries and each file is only stat'ed once.
+        """
+        pending = ['']
+        while pending:
+            relDir = pending.pop()
+            # the iterator is closed right away so a deep tree doesn't hold a descriptor per level
+            with os.scandir(os.path.join(self.source, relDir)) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+            for entry in entries:
+                if entry.is_symlink():
+                    continue
+                relPath = os.path.join(relDir, entry.name)
+                if entry.is_dir():
+                    self.directories.append(relPath)
+                    pending.append(relPath)
+                elif entry.is_file():
+                    stats = entry.stat()
+                    yield relPath, stats.st_size, int(stats.st_mtime)
+
+    def files(self):
+        """returns every (relative path, size) tuple still on the work list"""
+        return (list(self.largeFiles) + list(self.smallFiles) +
+                [entry for batch in self.batches for entry in batch])
+
+    def skip(self, paths):
+        """removes files from the work list, used for files already identical on the target"""
+        paths = set(paths)
+        self.largeFiles = deque(entry for entry in self.largeFiles if entry[0] not in paths)
+        self.smallFiles = deque(entry for entry in self.smallFiles if entry[0] not in paths)
+        self.batches = deque(self.batch(entry for batch in self.batches for entry in batch
+                                        if entry[0] not in paths))
+        files = self.files()
+        self.totalBytes = sum(entry[1] for entry in files)
+        self.totalFiles = len(files)
+
+    def createDirectories(self):
+        """creates every directory of the work list on the target before any file is copied"""
+        for directory in self.directories:
+            os.makedirs(os.path.join(self.target, directory), exist_ok=True)
+
+    def bufferPool(self):
+        """returns the buffer pool shared by the workers, allocating it the first time"""
+        self.mutex.acquire()
+        if self.pool is None:
+            self.pool = BufferPool(self.bufferCount * self.workers, self.bufferSize)
+        self.mutex.release()
+        return self.pool
+
+    def copyfileobj(self, fsrc, fdst, offset=0, digest=None, report=None, size=None):
+        """copies data between file objects in userspace starting at offset
+
+        The next buffer is read on another thread while the last one is written, unless
+        size says the rest of the file fits in a single buffer. Progress is reported to
+        report (the callback by default) every progressInterval bytes instead of every
+        chunk to keep lock traffic in the callback low. If digest is given, everything
+        copied is also added to it.
+        """
+        report = report or self.report
+        fsrc.seek(offset)
+        fdst.seek(offset)
+        fsrcReadinto = fsrc.readinto
+        fdstWrite = fdst.write
+        pending = 0
+
+        def read(view):
+            """fills view from the source and hashes what was read"""
+            count = fsrcReadinto(view)
+            if digest is not None and count:
+                digest.update(view[:count])
+            return count
+
+        def write(view):
+            """writes view to the target and reports progress every progressInterval bytes"""
+            nonlocal pending
+            fdstWrite(view)
+            pending += len(view)
+            if pending >= self.progressInterval:
+                report(pending)
+                pending = 0
+
+        pool = self.bufferPool()
+        if size is not None and size - offset <= pool.size:
+            # a second thread doesn't pay for itself on a single buffer
+            view = pool.get()
+            try:
+                count = read(view)
+                while count:
+                    with view[:count] as part:
+                        write(part)
+                    count = read(view)
+            finally:
+                pool.put(view)
+        else:
+            Pipeline(pool, read, write, self.bufferCount).run()
+        report(pending)
+
+    def kernelCopy(self, strategy, infd, outfd, offset, size, report=None):
+        """copies bytes from offset up to size inside the kernel using copy_file_range or sendfile
+
+        Returns the offset reached, which is less than size only if the syscall is
+        not supported for these files, in which case the strategy is disabled.
+        """
+        report = report or self.report
+        pending = 0
+        if strategy == 'sendfile':
+            os.lseek(outfd, offset, os.SEEK_SET)
+        while offset < size:
+            count = min(self.kernelChunk, size - offset)
+            try:
+                if strategy == 'copy_file_range':
+                    sent = os.copy_file_range(infd, outfd, count, offset, offset)
+                else:
+                    sent = os.sendfile(outfd, infd, offset, count)
+            except OSError as err:
+                if err.errno not in FALLBACK_ERRORS:
+                    raise
+                self.disableStrategy(strategy)
+                break
+            if sent == 0:
+                break
+            offset += sent
+            pending += sent
+            if pending >= self.progressInterval:
+                report(pending)
+                pending = 0
+        report(pending)
+        return offset
+
+    def disableStrategy(self, strategy):
+        """stops using a kernel copy strategy that failed with an unsupported error"""
+        self.mutex.acquire()
+        if strategy in self.strategies:
+            self.strategies.remove(strategy)
+        self.mutex.release()
+
+    def report(self, bytesWritten):
+        """passes bytes written to the callback if there is one"""
+        if bytesWritten and self.callback:
+            self.callback(bytesWritten)
+
+    def copyFileData(self, fsrc, fdst, size, report=None):
+        """copies file contents with the fastest strategy available
+
+        copy_file_range and sendfile keep the data inside the kernel. If neither is
+        available or a syscall is rejected, the rest of the file is copied in userspace.
+        """
+        offset = 0
+        for strategy in list(self.strategies):
+            offset = self.kernelCopy(strategy, fsrc.fileno(), fdst.fileno(), offset, size,
+                                     report)
+            if offset >= size:
+                return
+        self.copyfileobj(fsrc, fdst, offset, report=report, size=size)
+
+    def copyFile(self, relPath, size):
+        """copies a single file from source to target along with its permission bits
+
+        Bytes written are reported through the write-back stream of the target file.
+        """
+        dst = os.path.join(self.target, relPath)
+        digest = hashlib.new(self.algorithm) if self.algorithm else None
+        if self.reader is not None:
+            with open(dst, 'wb') as fdst:
+                stream = self.writeBack.stream(fdst.fileno(), flush=fdst.flush)
+                self.reader.copyFile(self.reader.entry(relPath), fdst, stream.wrote,
+                                     self.progressInterval, digest)
+                fdst.flush()
+                stream.close()
+        else:
+            src = os.path.join(self.source, relPath)
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                stream = self.writeBack.stream(fdst.fileno(), flush=fdst.flush)
+                source = DropBehind(fsrc.fileno(), self.dropCache)
+
+                def wrote(count):
+                    """reports bytes written and lets go of the source pages they came from"""
+                    stream.wrote(count)
+                    source.advance(count)
+
+                if digest is None:
+                    self.copyFileData(fsrc, fdst, size, wrote)
+                else:
+                    # the data has to pass through userspace to be hashed
+                    self.copyfileobj(fsrc, fdst, digest=digest, report=wrote, size=size)
+                fdst.flush()
+                stream.close()
+                source.close()
+            shutil.copymode(src, dst)
+
+        if digest is not None:
+            self.mutex.acquire()
+            self.hashes[relPath] = digest.hexdigest()
+            self.mutex.release()
+
+    def readSmallFile(self, relPath, view):
+        """reads a whole small file into view, returns the number of bytes read"""
+        if self.reader is not None:
+            return self.reader.readinto(self.reader.entry(relPath), view)
+        fd = os.open(os.path.join(self.source, relPath), os.O_RDONLY)
+        try:
+            filled = 0
+            while filled < len(view):
+                count = os.readv(fd, [view[filled:]])
+                if not count:
+                    break
+                filled += count
+            if self.dropCache:
+                advise(fd, 0, 0, FADV_DONTNEED)
+        finally:
+            os.close(fd)
+        return filled
+
+    def settleFile(self, fd, count):
+        """waits until a file of a batch is on the device and closes it"""
+        try:
+            self.writeBack.settle(fd, count)
+        finally:
+            os.close(fd)
+
+    def copyBatch(self, batch):
+        """copies a batch of small files from one directory
+
+        Every file is read into one pooled buffer first, then the files are created one
+        after the other so the directory's entries are written together. Permission bits
+        aren't copied since FAT32 doesn't keep them. Write-out of every file is started
+        once it is written, and the bytes of the whole batch are reported after every
+        file has been waited on. At most batchDescriptors files are kept open for that,
+        the oldest one is waited on and closed when there are more. fileCallback is also
+        called once for the batch, with its directory, bytes and number of files.
+        """
+        pool = self.bufferPool()
+        view = pool.get()
+        started = monotonic()
+        opened = deque()
+        try:
+            files = []
+            offset = 0
+            for relPath, size in batch:
+                # slices are released right away, the pool can't free exported buffers
+                with view[offset:offset + size] as part:
+                    count = self.readSmallFile(relPath, part)
+                files.append((relPath, offset, count))
+                offset += count
+
+            total = offset
+            hashes = {}
+            for relPath, offset, count in files:
+                fd = os.open(os.path.join(self.target, relPath),
+                             os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+                opened.append((fd, count))
+                with view[offset:offset + count] as data:
+                    written = 0
+                    while written < count:
+                        written += os.write(fd, data[written:])
+                    if self.algorithm:
+                        hashes[relPath] = hashlib.new(self.algorithm, data).hexdigest()
+                self.writeBack.start(fd, count)
+                if len(opened) > self.batchDescriptors:
+                    self.settleFile(*opened.popleft())
+            while opened:
+                self.settleFile(*opened.popleft())
+        finally:
+            for fd, count in opened:
+                os.close(fd)
+            pool.put(view)
+        self.writeBack.report(total)
+
+        if hashes:
+            self.mutex.acquire()
+            self.hashes.update(hashes)
+            self.mutex.release()
+        if self.fileCallback:
+            self.fileCallback(os.path.dirname(batch[0][0]), total, monotonic() - started,
+                              len(files))
+
+    def nextFile(self, preferLarge):
+        """pops the next file or batch of files to copy, preferring large or small files"""
+        queues = (self.largeFiles, self.smallFiles, self.batches)
+        if not preferLarge:
+            queues = queues[::-1]
+
+        self.mutex.acquire()
+        try:
+            if self.errors:
+                return None
+            for queue in queues:
+                if queue:
+                    return queue.popleft()
+            return None
+        finally:
+            self.mutex.release()
+
+    def worker(self, preferLarge):
+        """copies files and batches until the queues are empty or another worker has failed"""
+        while True:
+            entry = self.nextFile(preferLarge)
+            if entry is None:
+                return
+            try:
+                if isinstance(entry, list):
+                    self.copyBatch(entry)
+                    continue
+                started = monotonic()
+                self.copyFile(entry[0], entry[1])
+                if self.fileCallback:
+                    self.fileCallback(entry[0], entry[1], monotonic() - started, 1)
+            except Exception as err:
+                self.mutex.acquire()
+                self.errors.append(err)
+                self.mutex.release()
+                return
+
+    def run(self):
+        """builds the work list if needed, creates directories and copies files in parallel
+
+        A quarter of the workers (at least one) prefer large files and the rest prefer
+        small files, so both kinds of work are in flight until one queue drains.
+        The first error raised by any worker is re-raised once all workers have stopped.
+        """
+        if not self.built:
+            self.buildWorkList()
+        self.createDirectories()
+        self.errors = []
+
+        largeWorkers = max(1, self.workers // 4) if self.largeFiles else 0
+        threads = [threading.Thread(target=self.worker, args=(i < largeWorkers,))
+                   for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+        if self.errors:
+            self.writeBack.abort()
+            raise self.errors[0]
+        self.writeBack.drain()
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""Contains classes to run BootableDiskCreator jobs from a daemon with a JSON API on a Unix socket
+
+`bdc serve` pays for Python startup, dependency and privilege checks once, then accepts
+jobs from any number of clients. Requests and responses are JSON objects, one per line:
+
+    {"command": "submit", "image": "/path/to/image.iso", "device": ["/dev/sdb1"], ...}
+    {"command": "status"}                  every job, or a single one with "id"
+    {"command": "progress", "id": 1}       streams a line on every update until it finishes
+    {"command": "cancel", "id": 1}
+
+Every response has "ok" set, plus "error" when it is false. Jobs run concurrently up to
+a limit, sharing one event loop and pool of stage workers, and a job only starts once no
+other job is writing to the same disk.
+
+File name: daemon.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import asyncio
+import json
+import os
+import signal
+import socket
+import threading
+from argparse import Namespace
+from time import time
+from bdc.blockDevices import BlockTopology
+from bdc.bootableDiskCreator import BootableDiskCreator
+from bdc.jobEngine import JobCancelled, JobEngine, JobError
+
+DEFAULT_SOCKET = '/run/bdc.sock'
+DEFAULT_MOUNT_ROOT = '/run/bdc'
+FINISHED = ('done', 'failed', 'cancelled')
+
+# options of a submit request and their defaults, named like the bdc arguments
+OPTIONS = {'raw': False, 'verify': False, 'incremental': False, 'build_fs': False,
+           'no_cache': False, 'workers': None, 'image_mount': None, 'device_mount': None,
+           'write_window': None, 'keep_page_cache': False, 'buffers': None, 'buffer_size': None,
+           'stats': None, 'stats_textfile': None}
+
+class DaemonJob:
+    """class that holds a submitted job along with its state, log and progress"""
+    def __init__(self, jobId, args, disks):
+        """initializes member variables, disks are the disks locked while the job runs"""
+        self.id = jobId
+        self.args = args
+        self.disks = disks
+        self.bdc = None
+        self.state = 'queued'
+        self.error = None
+        self.progress = 0.0
+        self.deviceProgress = {}
+        self.mbPerSecond = 0.0
+        self.eta = None
+        self.log = []
+        self.cancelled = False
+        self.submitted = time()
+        self.started = None
+        self.finished = None
+        self.changed = asyncio.Event()
+        self.flushPending = False
+
+    def status(self):
+        """returns the state of the job as a dictionary that can be serialized as JSON"""
+        stage = None
+        if self.bdc is not None and self.bdc.job is not None and self.bdc.job.current is not None:
+            stage = self.bdc.job.current.name
+        return {'id': self.id, 'image': self.args.image, 'devices': self.args.device,
+                'state': self.state, 'stage': stage, 'progress': self.progress,
+                'deviceProgress': self.deviceProgress, 'mbPerSecond': self.mbPerSecond,
+                'eta': self.eta, 'error': self.error,
+                'submitted': self.submitted, 'started': self.started, 'finished': self.finished}
+
+class Daemon:
+    """class that serves the JSON API and schedules jobs with per-disk locking"""
+    def __init__(self, path=DEFAULT_SOCKET, maxJobs=4, workers=16, mountRoot=DEFAULT_MOUNT_ROOT,
+                 interval=0.1, history=1000):
+        """initializes member variables
+
+        maxJobs is the number of jobs run at once, workers the size of the shared pool of
+        stage workers, every job gets its own mount points below mountRoot and progress
+        is pushed to clients at most once per interval seconds. Only the last history
+        finished jobs are kept.
+        """
+        self.path = path
+        self.maxJobs = maxJobs
+        self.engine = JobEngine(workers)
+        self.mountRoot = mountRoot
+        self.interval = interval
+        self.history = history
+        self.topology = BlockTopology()
+        self.jobs = {}
+        self.pending = []
+        self.running = set()
+        self.locked = set()
+        self.nextId = 1
+        self.loop = None
+        self.server = None
+        self.ready = threading.Event()
+        self.commands = {'submit': self.submit, 'status': self.status,
+                         'progress': self.progress, 'cancel': self.cancel}
+
+    def bind(self):
+        """creates the listening socket, readable and writable by its owner only
+
+        A socket file left behind by a daemon that died is replaced, one that a daemon
+        is still listening on is an error.
+        """
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.remove(self.path)
+            else:
+                raise OSError('\'{0}\' is already in use'.format(self.path))
+            finally:
+                probe.close()
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        return sock
+
+    def serve(self):
+        """serves requests until stop is called or the daemon gets SIGINT or SIGTERM"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(
+                asyncio.start_unix_server(self.handle, sock=self.bind()))
+            if threading.current_thread() is threading.main_thread():
+                for signum in (signal.SIGINT, signal.SIGTERM):
+                    self.loop.add_signal_handler(signum, self.shutdown)
+            self.ready.set()
+            self.loop.run_forever()
+        finally:
+            if self.server is not None:
+                self.server.close()
+            self.loop.run_until_complete(self.cancelAll())
+            self.loop.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def shutdown(self):
+        """stops the event loop, running jobs are cancelled and rolled back before serve returns"""
+        self.loop.stop()
+
+    def stop(self):
+        """stops the daemon from another thread"""
+        self.loop.call_soon_threadsafe(self.shutdown)
+
+    async def cancelAll(self):
+        """cancels every job and waits for the running ones to be rolled back"""
+        for job in list(self.jobs.values()):
+            if job.state not in FINISHED:
+                self.cancelJob(job)
+        while self.running:
+            job = next(iter(self.running))
+            await job.changed.wait()
+
+    async def handle(self, reader, writer):
+        """answers the requests of one client, one JSON object per line"""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line.decode())
+                    if not isinstance(request, dict):
+                        raise ValueError('request must be a JSON object')
+                    command = self.commands.get(request.get('command'))
+                    if command is None:
+                        raise ValueError('unknown command \'{0}\''.format(request.get('command')))
+                    await command(request, writer)
+                except ValueError as err:
+                    self.send(writer, {'ok': False, 'error': str(err)})
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            # the client went away or sent a line longer than the stream limit
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def send(writer, response):
+        """writes a response as a line of JSON"""
+        writer.write(json.dumps(response).encode() + b'\n')
+
+    def job(self, request):
+        """returns the job a request refers to"""
+        job = self.jobs.get(request.get('id'))
+        if job is None:
+            raise ValueError('unknown job \'{0}\''.format(request.get('id')))
+        return job
+
+    def arguments(self, request, jobId):
+        """returns the bdc arguments of a submit request"""
+        image = request.get('image')
+        devices = request.get('device')
+        if isinstance(devices, str):
+            devices = [devices]
+        if not isinstance(image, str) or not isinstance(devices, list) or not devices or \
+           not all(isinstance(device, str) for device in devices):
+            raise ValueError('submit needs an image and at least one device')
+
+        args = Namespace(image=image, device=devices, silent=True)
+        for option, default in OPTIONS.items():
+            setattr(args, option, request.get(option, default))
+        # jobs running at once can't share mount points
+        root = os.path.join(self.mountRoot, str(jobId))
+        if args.image_mount is None:
+            args.image_mount = os.path.join(root, 'iso')
+        if args.device_mount is None:
+            args.device_mount = os.path.join(root, 'target')
+        return args
+
+    async def submit(self, request, writer):
+        """queues a job and answers with its id"""
+        args = self.arguments(request, self.nextId)
+        job = DaemonJob(self.nextId, args, {self.topology.diskOf(device) for device in args.device})
+        self.nextId += 1
+        self.jobs[job.id] = job
+        self.pending.append(job)
+        self.schedule()
+        self.send(writer, {'ok': True, 'id': job.id})
+
+    async def status(self, request, writer):
+        """answers with the state of one job or of every job"""
+        if 'id' in request:
+            self.send(writer, {'ok': True, 'job': self.job(request).status()})
+        else:
+            self.send(writer, {'ok': True, 'jobs': [job.status() for job in self.jobs.values()]})
+
+    async def progress(self, request, writer):
+        """streams the state and new log output of a job on every update until it finishes"""
+        job = self.job(request)
+        index = 0
+        while True:
+            changed = job.changed
+            finished = job.state in FINISHED
+            response = dict(job.status(), log=''.join(job.log[index:]))
+            index = len(job.log)
+            self.send(writer, {'ok': True, 'job': response})
+            await writer.drain()
+            if finished:
+                return
+            await changed.wait()
+
+    async def cancel(self, request, writer):
+        """cancels a job, one that is running is rolled back"""
+        job = self.job(request)
+        if job.state in FINISHED:
+            raise ValueError('job {0} has already finished'.format(job.id))
+        self.cancelJob(job)
+        self.send(writer, {'ok': True, 'id': job.id})
+
+    def cancelJob(self, job):
+        """cancels a queued job right away or asks a running one to stop"""
+        job.cancelled = True
+        if job in self.pending:
+            self.pending.remove(job)
+            self.finishJob(job, 'cancelled', None)
+        elif job.bdc is not None:
+            job.bdc.cancel()
+
+    def schedule(self):
+        """starts queued jobs in order as long as slots are free and their disks aren't locked"""
+        for job in list(self.pending):
+            if len(self.running) >= self.maxJobs:
+                break
+            if job.disks & self.locked:
+                continue
+            self.pending.remove(job)
+            self.running.add(job)
+            self.locked |= job.disks
+            asyncio.ensure_future(self.execute(job))
+
+    def validate(self, bdc, args):
+        """validates the arguments of a job, turning validation errors into JobError"""
+        try:
+            bdc.validateInput(args)
+        except SystemExit as err:
+            raise JobError(err.code if isinstance(err.code, str) else 'validation failed')
+
+    async def execute(self, job):
+        """validates and runs a job on the shared pool, then starts the next ones"""
+        job.state = 'running'
+        job.started = time()
+        job.bdc = BootableDiskCreator()
+        job.bdc.verbose = False
+        job.bdc.interactive = False
+        job.bdc.jobs = self.engine
+        job.bdc.listener = lambda: self.loop.call_soon_threadsafe(self.update, job)
+        self.flush(job)
+
+        state = 'done'
+        error = None
+        try:
+            await self.loop.run_in_executor(self.engine.executor, self.validate, job.bdc,
+                                            job.args)
+            if job.cancelled:
+                raise JobCancelled('cancelled')
+            await job.bdc.createJob().run(self.loop, self.engine.executor)
+        except JobCancelled:
+            state = 'cancelled'
+        except Exception as err:
+            state, error = 'failed', str(err)
+            if job.bdc.job is None:
+                job.log.append('Error: {0}\n'.format(err))
+
+        job.bdc.listener = None
+        self.running.discard(job)
+        self.locked -= job.disks
+        self.removeMountPoints(job)
+        self.finishJob(job, state, error)
+        self.schedule()
+
+    def finishJob(self, job, state, error):
+        """records how a job ended, wakes its watchers and forgets the oldest finished jobs"""
+        job.state = state
+        job.error = error
+        job.finished = time()
+        self.flush(job)
+
+        finished = [other for other in self.jobs.values() if other.state in FINISHED]
+        for other in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[other.id]
+
+    def removeMountPoints(self, job):
+        """removes the empty mount point directories created for a job"""
+        root = os.path.join(self.mountRoot, str(job.id))
+        for path, dirs, files in os.walk(root, topdown=False):
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+
+    def update(self, job):
+        """pushes new log output and progress of a job to its watchers at most once per interval"""
+        if not job.flushPending:
+            job.flushPending = True
+            self.loop.call_later(self.interval, self.flush, job)
+
+    def flush(self, job):
+        """reads new log output and progress of a job and wakes everyone watching it"""
+        job.flushPending = False
+        if job.bdc is not None:
+            text = job.bdc.getStringBuffer()
+            if text:
+                job.log.append(text)
+            job.progress = job.bdc.copyProgress
+            job.deviceProgress = job.bdc.deviceProgress()
+            snapshot = job.bdc.progress.snapshot()
+            job.mbPerSecond = snapshot['mbPerSecond']
+            job.eta = snapshot['eta']
+        changed = job.changed
+        job.changed = asyncio.Event()
+        changed.set()
+
+class DaemonClient:
+    """class that sends requests to a running daemon"""
+    def __init__(self, path=DEFAULT_SOCKET):
+        """initializes member variables"""
+        self.path = path
+
+    def connect(self):
+        """returns a socket connected to the daemon and a file to read its responses"""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        return sock, sock.makefile('rb')
+
+    def request(self, command, **arguments):
+        """sends a request and returns the response"""
+        sock, responses = self.connect()
+        try:
+            sock.sendall(json.dumps(dict(arguments, command=command)).encode() + b'\n')
+            return json.loads(responses.readline().decode())
+        finally:
+            responses.close()
+            sock.close()
+
+    def watch(self, jobId):
+        """yields the state of a job every time it changes until it has finished"""
+        sock, responses = self.connect()
+        try:
+            sock.sendall(json.dumps({'command': 'progress', 'id': jobId}).encode() + b'\n')
+            for line in responses:
+                response = json.loads(line.decode())
+                if not response['ok']:
+                    raise JobError(response['error'])
+                yield response['job']
+                if response['job']['state'] in FINISHED:
+                    return
+        finally:
+            responses.close()
+            sock.close()
@@ -1,23 +1,90 @@
 #!/usr/bin/env python3
 """Contains class to check required dependencies for BootableDiskCreator CLI and GUI
 
+Each frontend only checks what it uses, so the CLI never imports PyQt5. Where the
+commands were found is kept in a small stamp file, later runs with the same PATH and
+interpreter only check that those files are still there instead of searching PATH.
+
 File name: dependencyChecker.py
 Author: Adam Jenkins
 Date created: 10/28/18
-Date last modified: 10/28/18
+Date last modified: 10/18/2026
 Python Version: 3.6.5
 """
+import json
+import os
 import sys
 import shutil
 
+STAMP_DIRECTORY = '/var/cache/bdc'
+
 class DependencyChecker:
     """class to check BootableDiskCreator dependencies"""
-    def __init__(self):
-        """initializes member variables"""
-        self.bashDependencies = ['awk', 'mkfs.fat', 'lsblk', 'mount']
+    def __init__(self, frontend='gui', stampDirectory=STAMP_DIRECTORY):
+        """initializes member variables
+
+        frontend is 'cli' or 'gui', only the GUI needs PyQt5. Results aren't cached if
+        stampDirectory is None.
+        """
+        self.frontend = frontend
+        self.bashDependencies = ['mkfs.fat', 'mount']
         self.PyQtVersion = '5.11.3'
         self.errors = ''
         self.PyQtInstall = False
+        self.stampDirectory = stampDirectory
+
+    def stampPath(self):
+        """returns the path of the stamp file of this frontend"""
+        return os.path.join(self.stampDirectory, 'dependencies-{0}.json'.format(self.frontend))
+
+    def environment(self):
+        """returns what the cached results depend on"""
+        return {'path': os.environ.get('PATH', os.defpath), 'executable': sys.executable,
+                'version': sys.version, 'commands': self.bashDependencies}
+
+    def cachedCommands(self):
+        """returns True if the stamp file is current and every command in it still exists"""
+        if self.stampDirectory is None:
+            return False
+        try:
+            with open(self.stampPath()) as f:
+                stamp = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if not isinstance(stamp, dict) or stamp.get('environment') != self.environment():
+            return False
+        paths = stamp.get('found', {})
+        return all(isinstance(paths.get(i), str) and os.access(paths[i], os.X_OK)
+                   for i in self.bashDependencies)
+
+    def writeStamp(self, paths):
+        """stores where the commands were found, the stamp is only a cache so errors are ignored"""
+        if self.stampDirectory is None:
+            return
+        path = self.stampPath()
+        tmpPath = '{0}.{1}.tmp'.format(path, os.getpid())
+        try:
+            os.makedirs(self.stampDirectory, exist_ok=True)
+            with open(tmpPath, 'w') as f:
+                json.dump({'environment': self.environment(), 'found': paths}, f)
+            os.replace(tmpPath, path)
+        except OSError:
+            try:
+                os.remove(tmpPath)
+            except OSError:
+                pass
+
+    def checkCommands(self):
+        """searches PATH for the commands that aren't known to exist from the stamp file"""
+        if self.cachedCommands():
+            return
+        paths = {}
+        for i in self.bashDependencies:
+            paths[i] = shutil.which(i)
+            if paths[i] is None:
+                self.errors += 'Error: missing required dependency: {}\n'.format(i)
+        if None not in paths.values():
+            self.writeStamp(paths)
 
     def main(self):
         """method to check if dependencies are satisfied"""
@@ -25,11 +92,12 @@ class DependencyChecker:
             self.errors += ('Error: found Python {}.{}, Python >= 3.5 required\n'
                             .format(sys.version_info.major, sys.version_info.minor))
 
-        try:
-            import PyQt5
-            self.PyQtInstall = True
-        except ImportError:
-            self.errors += 'Error: missing required dependency: PyQt5\n'
+        if self.frontend == 'gui':
+            try:
+                import PyQt5
+                self.PyQtInstall = True
+            except ImportError:
+                self.errors += 'Error: missing required dependency: PyQt5\n'
 
         if self.PyQtInstall:
             from PyQt5 import Qt
@@ -37,9 +105,7 @@ class DependencyChecker:
                 print('Warning: found PyQt5 {}, this software has only been tested with PyQt5 {}'
                       .format(Qt.PYQT_VERSION_STR, self.PyQtVersion), file=sys.stderr)
 
-        for i in self.bashDependencies:
-            if shutil.which(i) is None:
-                self.errors += 'Error: missing required dependency: {}\n'.format(i)
+        self.checkCommands()
 
         if self.errors:
             sys.exit(self.errors[:-1])
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""Contains class to store log events from BootableDiskCreator in a bounded ring buffer
+
+Events are stored in preallocated slots instead of being formatted and concatenated
+as they happen, so a slow (or absent) reader costs nothing but a fixed amount of
+memory. Progress updates are coalesced and text is only rendered when it is read.
+Copied files are only counted and carried by the next progress event, so per-file
+traffic never evicts stage or error events from the ring.
+An optional listener is told whenever an event is stored, so a reader can sleep until
+there is something to read instead of polling.
+
+File name: eventBuffer.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+from time import monotonic
+
+STAGE_START = 0
+STAGE_END = 1
+BYTES_COPIED = 2
+ERROR = 4
+
+class EventBuffer:
+    """fixed capacity ring buffer of typed events
+
+    When the buffer is full the oldest unread events are overwritten and counted in
+    dropped. Access to BootableDiskCreator's instance of EventBuffer is thread safe.
+    """
+    def __init__(self, capacity=1024, progressRate=10.0):
+        """initializes the event slots, progressRate is the maximum progress events per second"""
+        self.capacity = capacity
+        self.progressRate = progressRate
+        self.kinds = [STAGE_START] * capacity
+        self.values = [0] * capacity
+        self.totals = [0] * capacity
+        self.messages = [''] * capacity
+        self.files = [0] * capacity
+        self.filesDone = 0
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+        self.lastProgress = -1.0
+        self.pending = None
+        self.listener = None
+
+    def notify(self, kind):
+        """calls the listener with the kind of event that was stored
+
+        The listener runs on the thread that stored the event, with BootableDiskCreator's
+        lock held, so it must only wake the reader and not read the buffer itself.
+        """
+        if self.listener is not None:
+            self.listener(kind)
+
+    def push(self, kind, value=0, total=0, message=''):
+        """stores an event in the next slot, overwriting the oldest one if the buffer is full"""
+        slot = self.head % self.capacity
+        self.kinds[slot] = kind
+        self.values[slot] = value
+        self.totals[slot] = total
+        self.messages[slot] = message
+        self.files[slot] = self.filesDone
+        self.head += 1
+        if self.head - self.tail > self.capacity:
+            self.tail += 1
+            self.dropped += 1
+        self.notify(kind)
+
+    def flushProgress(self):
+        """stores a progress update that was held back by the rate limit"""
+        if self.pending is not None:
+            value, total, devices = self.pending
+            self.pending = None
+            self.push(BYTES_COPIED, value, total, devices)
+
+    def stageStart(self, description):
+        """records the start of a stage, like running a command"""
+        self.flushProgress()
+        self.push(STAGE_START, message=description)
+
+    def stageEnd(self, result='done'):
+        """records the end of the current stage along with its result"""
+        self.flushProgress()
+        self.push(STAGE_END, message=result)
+
+    def fileDone(self, path, size, count=1):
+        """counts files that have been copied completely
+
+        Nothing is stored or flushed, the count is carried by the next progress event.
+        """
+        self.filesDone += count
+
+    def error(self, message):
+        """records an error"""
+        self.flushProgress()
+        self.push(ERROR, message=message)
+
+    def progress(self, bytesWritten, totalBytes, devices=''):
+        """records bytes copied so far, coalescing updates to at most progressRate per second
+
+        If the newest event is an unread progress event it is updated in place, otherwise a
+        new event is stored unless the last one was stored less than 1/progressRate ago
+        or the buffer is full, so progress never evicts stage or error events on its own.
+        devices is an optional summary of the progress of every device, kept as the message.
+        """
+        last = (self.head - 1) % self.capacity
+        if self.head > self.tail and self.kinds[last] == BYTES_COPIED:
+            self.values[last] = bytesWritten
+            self.totals[last] = totalBytes
+            self.messages[last] = devices
+            self.files[last] = self.filesDone
+            self.notify(BYTES_COPIED)
+            return
+
+        now = monotonic()
+        if (now - self.lastProgress < 1.0 / self.progressRate or
+                self.head - self.tail >= self.capacity):
+            self.pending = (bytesWritten, totalBytes, devices)
+            return
+
+        self.lastProgress = now
+        self.pending = None
+        self.push(BYTES_COPIED, bytesWritten, totalBytes, devices)
+
+    def events(self):
+        """returns unread events as (kind, value, total, message, files) tuples and marks them read
+
+        files is the number of files copied when the event was stored or last updated.
+        A progress update held back while the buffer is full is returned last without
+        being stored, so reading never evicts an unread event.
+        """
+        if self.head - self.tail < self.capacity:
+            self.flushProgress()
+        ret = []
+        for index in range(self.tail, self.head):
+            slot = index % self.capacity
+            ret.append((self.kinds[slot], self.values[slot], self.totals[slot],
+                        self.messages[slot], self.files[slot]))
+        self.tail = self.head
+        if self.pending is not None:
+            value, total, devices = self.pending
+            self.pending = None
+            ret.append((BYTES_COPIED, value, total, devices, self.filesDone))
+        return ret
+
+    @staticmethod
+    def render(event):
+        """returns the log text of a single event"""
+        kind, value, total, message, files = event
+        if kind == STAGE_START:
+            return message
+        if kind == STAGE_END:
+            return message + '\n'
+        if kind == BYTES_COPIED:
+            percent = (value / total * 100) if total else 0.0
+            if message:
+                return 'copying image... {0:.2f}% ({1})\n'.format(percent, message)
+            return 'copying image... {0:.2f}%\n'.format(percent)
+        if kind == ERROR:
+            return message + '\n'
+        return ''
+
+    def read(self):
+        """renders unread events as log text and marks them read"""
+        return ''.join(self.render(event) for event in self.events())
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""Contains classes to write one image onto several devices with a single source read
+
+Every chunk is read from the source once and the same buffer is handed to a writer
+thread per device through a bounded queue. A slow device can fall at most depth
+buffers behind before the reader waits for it, and a device that fails is dropped
+without affecting the others.
+
+File name: fanOut.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import os
+import queue
+import stat
+import threading
+from time import monotonic
+from bdc.writeBack import WriteBack
+
+class RawSink:
+    """writes a stream of buffers byte for byte onto a device"""
+    def __init__(self, device):
+        """initializes member variables"""
+        self.device = device
+        self.fd = None
+
+    def handle(self, op, arg):
+        """opens, writes or flushes and closes the device"""
+        if op == 'open':
+            flags = os.O_WRONLY
+            if not os.path.exists(self.device) or not stat.S_ISBLK(os.stat(self.device).st_mode):
+                flags |= os.O_CREAT | os.O_TRUNC
+            self.fd = os.open(self.device, flags, 0o644)
+        elif op == 'write':
+            view = memoryview(arg)
+            while view:
+                view = view[os.write(self.fd, view):]
+        elif op == 'close':
+            os.fsync(self.fd)
+            self.abort()
+
+    def stream(self, writeBack):
+        """returns a write-back stream for the device once it is open"""
+        return writeBack.stream(self.fd)
+
+    def abort(self):
+        """closes the device if it is open"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+class TreeSink:
+    """writes directories and files below the mount point of a device"""
+    def __init__(self, device, root):
+        """initializes member variables"""
+        self.device = device
+        self.root = root
+        self.file = None
+
+    def handle(self, op, arg):
+        """creates a directory or opens, writes and closes a file"""
+        if op == 'mkdir':
+            os.makedirs(os.path.join(self.root, arg), exist_ok=True)
+        elif op == 'open':
+            self.file = open(os.path.join(self.root, arg), 'wb')
+        elif op == 'write':
+            self.file.write(arg)
+        elif op == 'close':
+            self.abort()
+
+    def stream(self, writeBack):
+        """returns a write-back stream for the file that was just opened"""
+        return writeBack.stream(self.file.fileno(), flush=self.file.flush)
+
+    def abort(self):
+        """closes the current file if there is one"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class DeviceWriter:
+    """thread that applies queued operations to one sink and records its throughput"""
+    def __init__(self, sink, callback=None, depth=16, writeWindow=None, dropCache=False,
+                 failed=None):
+        """initializes member variables
+
+        callback is called with (writer, bytes written), or (writer, bytes committed)
+        if writeWindow bounds the bytes left waiting for the device. dropCache drops
+        committed pages from the page cache. failed is called with the writer as soon
+        as it stops because of an error.
+        """
+        self.sink = sink
+        self.device = sink.device
+        self.callback = callback
+        self.failed = failed
+        self.writeBack = WriteBack(self.committed, writeWindow, dropCache=dropCache)
+        self.stream = None
+        self.queue = queue.Queue(depth)
+        self.thread = threading.Thread(target=self.run)
+        self.bytesWritten = 0
+        self.bytesCommitted = 0
+        self.filesWritten = 0
+        self.startTime = 0.0
+        self.endTime = 0.0
+        self.error = None
+
+    def run(self):
+        """applies operations until the end of the stream
+
+        After a failure the queue keeps being drained so the reader never blocks on it.
+        """
+        self.startTime = monotonic()
+        while True:
+            op, arg = self.queue.get()
+            if op is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                if op == 'close' and self.stream is not None:
+                    # the file has to be handed over while it is still open
+                    self.stream.close()
+                    self.stream = None
+                self.sink.handle(op, arg)
+                if op == 'open':
+                    self.stream = self.sink.stream(self.writeBack)
+                elif op == 'write':
+                    self.bytesWritten += len(arg)
+                    self.stream.wrote(len(arg))
+                elif op == 'close':
+                    self.filesWritten += 1
+            except Exception as err:
+                self.sink.abort()
+                self.writeBack.abort()
+                self.fail(err)
+
+        if self.error is None:
+            try:
+                self.writeBack.drain()
+            except Exception as err:
+                self.fail(err)
+        self.endTime = monotonic()
+
+    def fail(self, err):
+        """records the error that stopped the writer and reports it"""
+        self.error = err
+        if self.failed:
+            self.failed(self)
+
+    def committed(self, count):
+        """counts bytes committed to the device and passes them to the callback"""
+        self.bytesCommitted += count
+        if self.callback:
+            self.callback(self, count)
+
+    def throughput(self):
+        """returns the average write speed in MB/s"""
+        elapsed = self.endTime - self.startTime
+        return (self.bytesWritten / elapsed / 1024**2) if elapsed > 0 else 0.0
+
+class FanOutWriter:
+    """class that feeds the same stream of operations to one DeviceWriter per device"""
+    def __init__(self, sinks, callback=None, depth=16, length=(4*1024**2), writeWindow=None,
+                 dropCache=False, failed=None):
+        """initializes member variables, length is the size of the buffers read from source"""
+        self.writers = [DeviceWriter(sink, callback, depth, writeWindow, dropCache, failed)
+                        for sink in sinks]
+        self.length = length
+
+    def put(self, op, arg=None):
+        """queues an operation for every device that hasn't failed"""
+        for writer in self.writers:
+            if writer.error is None:
+                writer.queue.put((op, arg))
+
+    def active(self):
+        """returns if at least one device is still being written"""
+        return any(writer.error is None for writer in self.writers)
+
+    def run(self, produce):
+        """starts the writers, calls produce with this object and waits for every device
+
+        produce queues operations through put, the writers are always stopped even if it
+        raises. Returns the list of DeviceWriters so results can be reported per device.
+        """
+        for writer in self.writers:
+            writer.thread.start()
+        try:
+            produce(self)
+        finally:
+            for writer in self.writers:
+                writer.queue.put((None, None))
+            for writer in self.writers:
+                writer.thread.join()
+        return self.writers
+
+    def writeStream(self, fsrc, dropBehind=None):
+        """queues the whole content of a file object as one stream
+
+        If given, dropBehind is a DropBehind advanced over everything read from fsrc.
+        """
+        self.put('open')
+        while self.active():
+            buf = fsrc.read(self.length)
+            if not buf:
+                break
+            if dropBehind is not None:
+                dropBehind.advance(len(buf))
+            self.put('write', buf)
+        self.put('close')
+        if dropBehind is not None:
+            dropBehind.close()
+
+    def writeTree(self, directories, files, readChunks):
+        """queues directories and then every file, readChunks(path) yields a file's buffers"""
+        for directory in directories:
+            self.put('mkdir', directory)
+        for path in files:
+            if not self.active():
+                break
+            self.put('open', path)
+            for buf in readChunks(path):
+                self.put('write', buf)
+            self.put('close')
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""Contains class to build a complete FAT32 file system in userspace
+
+Instead of running mkfs.fat, mounting the partition and creating every file through
+the kernel's vfat driver, the whole layout is planned up front from the file list:
+boot sector, FSInfo, both FATs and every directory, with each directory and file in
+one contiguous run of clusters. The result is then written to the partition as a
+single sequential stream, so no mount is needed and FAT metadata is written once.
+
+File name: fatImage.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import os
+import struct
+import time
+
+SECTOR_SIZE = 512
+RESERVED_SECTORS = 32
+NUM_FATS = 2
+MIN_CLUSTERS = 65525
+MAX_CLUSTERS = 0x0FFFFFF4
+END_OF_CHAIN = 0x0FFFFFFF
+MAX_FILE_SIZE = 0xFFFFFFFF
+
+ATTR_VOLUME_ID = 0x08
+ATTR_DIRECTORY = 0x10
+ATTR_ARCHIVE = 0x20
+ATTR_LONG_NAME = 0x0F
+
+# characters allowed in 8.3 short names besides letters and digits
+SHORT_NAME_SPECIALS = "$%'-_@~`!(){}^#&"
+
+class FatError(Exception):
+    """raised when the files don't fit in a FAT32 file system of the given size"""
+
+class FatImageBuilder:
+    """class that lays out files in a FAT32 file system and streams it out sequentially"""
+    def __init__(self, size, directories, files, label='BDC', hiddenSectors=0, volumeId=None):
+        """initializes member variables and plans the layout
+
+        size is the size of the partition in bytes, directories is a list of relative
+        directory paths and files is a list of (relative path, size, mtime) tuples.
+        hiddenSectors is the offset of the partition on its disk in sectors.
+        """
+        self.totalSectors = size // SECTOR_SIZE
+        if self.totalSectors > 0xFFFFFFFF:
+            raise FatError('partition is too large for FAT32')
+        self.label = label.upper()[:11]
+        self.hiddenSectors = hiddenSectors
+        self.created = time.time()
+        self.volumeId = volumeId if volumeId is not None else int(self.created) & 0xFFFFFFFF
+        self.sectorsPerCluster = 0
+        self.fatSectors = 0
+        self.clusterCount = 0
+        self.clusterSize = 0
+        self.children = {'': []}
+        self.sizes = {}
+        self.mtimes = {}
+        self.shortNames = {}
+        self.longNames = {}
+        self.firstClusters = {}
+        self.layout = []
+        self.usedClusters = 0
+        self.bytesWritten = 0
+        self.chooseGeometry()
+        self.plan(directories, files)
+
+    def chooseGeometry(self):
+        """picks the cluster size the way Microsoft's FAT32 table does and sizes the FATs
+
+        The cluster size is halved if that is needed to reach the FAT32 minimum cluster count.
+        """
+        if self.totalSectors <= 532480:
+            sectorsPerCluster = 1
+        elif self.totalSectors <= 16777216:
+            sectorsPerCluster = 8
+        elif self.totalSectors <= 33554432:
+            sectorsPerCluster = 16
+        elif self.totalSectors <= 67108864:
+            sectorsPerCluster = 32
+        else:
+            sectorsPerCluster = 64
+
+        while True:
+            perFatSector = (256 * sectorsPerCluster + NUM_FATS) // 2
+            self.fatSectors = -(-(self.totalSectors - RESERVED_SECTORS) // perFatSector)
+            dataSectors = self.totalSectors - RESERVED_SECTORS - NUM_FATS * self.fatSectors
+            self.clusterCount = max(0, dataSectors // sectorsPerCluster)
+            if self.clusterCount >= MIN_CLUSTERS or sectorsPerCluster == 1:
+                break
+            sectorsPerCluster //= 2
+
+        if self.clusterCount < MIN_CLUSTERS:
+            raise FatError('partition is too small for FAT32')
+        self.clusterCount = min(self.clusterCount, MAX_CLUSTERS - 1)
+        self.sectorsPerCluster = sectorsPerCluster
+        self.clusterSize = sectorsPerCluster * SECTOR_SIZE
+
+    def clustersFor(self, size):
+        """returns the number of clusters needed to hold size bytes"""
+        return -(-size // self.clusterSize)
+
+    def addDirectory(self, relPath):
+        """adds a directory and every missing parent to the tree"""
+        if relPath in self.children:
+            return
+        parent = os.path.dirname(relPath)
+        self.addDirectory(parent)
+        self.children[relPath] = []
+        self.children[parent].append(relPath)
+
+    def plan(self, directories, files):
+        """builds the directory tree, names every entry and assigns clusters
+
+        Directories come first, starting with the root at cluster 2, followed by files
+        in directory order, which is also the order everything is written in.
+        """
+        for directory in sorted(directories):
+            self.addDirectory(directory)
+        for relPath, size, mtime in files:
+            if size > MAX_FILE_SIZE:
+                raise FatError('\'{0}\' is larger than FAT32 allows'.format(relPath))
+            self.addDirectory(os.path.dirname(relPath))
+            self.children[os.path.dirname(relPath)].append(relPath)
+            self.sizes[relPath] = size
+            self.mtimes[relPath] = mtime
+
+        directoryOrder = sorted(self.children, key=lambda d: (d.count('/') + bool(d), d))
+        for directory in directoryOrder:
+            self.children[directory].sort(key=lambda path: os.path.basename(path).lower())
+            self.nameEntries(directory)
+
+        cluster = 2
+        for directory in directoryOrder:
+            count = max(1, self.clustersFor(self.directorySize(directory)))
+            self.firstClusters[directory] = cluster
+            self.layout.append((directory, True, count))
+            cluster += count
+        for directory in directoryOrder:
+            for relPath in self.children[directory]:
+                if relPath in self.children:
+                    continue
+                count = self.clustersFor(self.sizes[relPath])
+                self.firstClusters[relPath] = cluster if count else 0
+                self.layout.append((relPath, False, count))
+                cluster += count
+
+        self.usedClusters = cluster - 2
+        if self.usedClusters > self.clusterCount:
+            raise FatError('files need {0} bytes but only {1} are available'.format(
+                self.usedClusters * self.clusterSize, self.clusterCount * self.clusterSize))
+
+    @staticmethod
+    def cleanShortPart(part):
+        """returns part upper cased with characters not allowed in short names replaced"""
+        part = part.upper().replace(' ', '').replace('.', '')
+        return ''.join(char if ord(char) < 128 and (char.isalnum() or char in SHORT_NAME_SPECIALS)
+                       else '_' for char in part)
+
+    def shortName(self, name, used):
+        """returns the 11 byte short name for name and whether a long name is needed too
+
+        Names that are valid 8.3 names once upper cased keep their short name, the
+        others get a numeric tail like Windows does.
+        """
+        stripped = name.lstrip('.')
+        base, ext = (stripped.rsplit('.', 1) if '.' in stripped else (stripped, ''))
+        shortBase = self.cleanShortPart(base) or '_'
+        shortExt = self.cleanShortPart(ext)[:3]
+        exact = (stripped == name and shortBase == base.upper() and shortExt == ext.upper() and
+                 len(base) <= 8)
+        candidate = (shortBase.ljust(8) + shortExt.ljust(3)).encode('ascii')
+        if exact and candidate not in used:
+            return candidate, (shortBase + '.' + shortExt if shortExt else shortBase) != name
+
+        number = 1
+        while True:
+            tail = '~{0}'.format(number)
+            candidate = ((shortBase[:8 - len(tail)] + tail).ljust(8) +
+                         shortExt.ljust(3)).encode('ascii')
+            if candidate not in used:
+                return candidate, True
+            number += 1
+
+    def nameEntries(self, directory):
+        """assigns a unique short name, and a long name where needed, to every child"""
+        used = set()
+        for relPath in self.children[directory]:
+            name = os.path.basename(relPath)
+            short, needsLong = self.shortName(name, used)
+            used.add(short)
+            self.shortNames[relPath] = short
+            if needsLong:
+                units = len(name.encode('utf-16-le')) // 2
+                if units > 255:
+                    raise FatError('\'{0}\' has a name that is too long for FAT32'.format(relPath))
+                self.longNames[relPath] = name
+
+    def longEntryCount(self, relPath):
+        """returns the number of long name entries in front of a short entry"""
+        name = self.longNames.get(relPath)
+        if name is None:
+            return 0
+        return -(-(len(name.encode('utf-16-le')) // 2) // 13)
+
+    def directorySize(self, directory):
+        """returns the number of bytes the entries of a directory take up"""
+        count = 1 if directory == '' else 2
+        for relPath in self.children[directory]:
+            count += 1 + self.longEntryCount(relPath)
+        return count * 32
+
+    @staticmethod
+    def timestamp(mtime):
+        """returns the FAT (date, time) pair in local time, clamped to the years FAT can hold"""
+        moment = time.localtime(mtime)
+        if moment.tm_year < 1980:
+            return (1 << 5) | 1, 0
+        if moment.tm_year > 2107:
+            return (127 << 9) | (12 << 5) | 31, (23 << 11) | (59 << 5) | 29
+        date = ((moment.tm_year - 1980) << 9) | (moment.tm_mon << 5) | moment.tm_mday
+        return date, (moment.tm_hour << 11) | (moment.tm_min << 5) | (moment.tm_sec // 2)
+
+    @staticmethod
+    def checksum(short):
+        """returns the checksum of a short name stored in its long name entries"""
+        total = 0
+        for byte in short:
+            total = (((total & 1) << 7) + (total >> 1) + byte) & 0xFF
+        return total
+
+    def shortEntry(self, short, attr, cluster, size, mtime):
+        """returns a 32 byte short directory entry"""
+        date, clock = self.timestamp(mtime)
+        return struct.pack('<11sBBBHHHHHHHI', short, attr, 0, 0, clock, date, date,
+                           cluster >> 16, clock, date, cluster & 0xFFFF, size)
+
+    def longEntries(self, name, short):
+        """returns the long name entries for name, last part first as they are stored"""
+        units = name.encode('utf-16-le')
+        count = -(-len(units) // 26)
+        padded = units + b'\x00\x00' if len(units) < count * 26 else units
+        padded = padded.ljust(count * 26, b'\xff')
+        checksum = self.checksum(short)
+        entries = []
+        for sequence in range(count, 0, -1):
+            part = padded[(sequence - 1) * 26:sequence * 26]
+            order = sequence | (0x40 if sequence == count else 0)
+            entries.append(struct.pack('<B10sBBB12sH4s', order, part[:10], ATTR_LONG_NAME, 0,
+                                       checksum, part[10:22], 0, part[22:26]))
+        return b''.join(entries)
+
+    def directoryData(self, directory):
+        """returns the entries of a directory padded to its clusters"""
+        cluster = self.firstClusters[directory]
+        if directory == '':
+            data = [struct.pack('<11sB20x', self.label.ljust(11).encode('ascii', 'replace'),
+                                ATTR_VOLUME_ID)]
+        else:
+            parent = os.path.dirname(directory)
+            parentCluster = self.firstClusters[parent] if parent else 0
+            data = [self.shortEntry(b'.'.ljust(11), ATTR_DIRECTORY, cluster, 0, self.created),
+                    self.shortEntry(b'..'.ljust(11), ATTR_DIRECTORY, parentCluster, 0,
+                                    self.created)]
+
+        for relPath in self.children[directory]:
+            short = self.shortNames[relPath]
+            if relPath in self.longNames:
+                data.append(self.longEntries(self.longNames[relPath], short))
+            if relPath in self.children:
+                data.append(self.shortEntry(short, ATTR_DIRECTORY, self.firstClusters[relPath],
+                                            0, self.created))
+            else:
+                data.append(self.shortEntry(short, ATTR_ARCHIVE, self.firstClusters[relPath],
+                                            self.sizes[relPath], self.mtimes[relPath]))
+
+        data = b''.join(data)
+        return data.ljust(max(1, self.clustersFor(len(data))) * self.clusterSize, b'\x00')
+
+    def bootSector(self):
+        """returns the boot sector with the FAT32 BIOS parameter block"""
+        sector = struct.pack('<3s8sHBHBHHBHHHIIIHHIHH12sBBBI11s8s',
+                             b'\xeb\x58\x90', b'mkfs.fat', SECTOR_SIZE, self.sectorsPerCluster,
+                             RESERVED_SECTORS, NUM_FATS, 0, 0, 0xF8, 0, 32, 64,
+                             self.hiddenSectors, self.totalSectors, self.fatSectors, 0, 0, 2, 1,
+                             6, bytes(12), 0x80, 0, 0x29, self.volumeId,
+                             self.label.ljust(11).encode('ascii', 'replace'), b'FAT32   ')
+        return sector.ljust(SECTOR_SIZE - 2, b'\x00') + b'\x55\xaa'
+
+    def fsInfoSector(self):
+        """returns the FSInfo sector with the free cluster count and next free cluster"""
+        free = self.clusterCount - self.usedClusters
+        return struct.pack('<I480xIII12xI', 0x41615252, 0x61417272, free,
+                           self.usedClusters + 2, 0xAA550000)
+
+    def reservedRegion(self):
+        """returns the reserved sectors, the boot and FSInfo sectors are backed up at sector 6"""
+        region = bytearray(RESERVED_SECTORS * SECTOR_SIZE)
+        for sector in (0, 6):
+            region[sector * SECTOR_SIZE:(sector + 1) * SECTOR_SIZE] = self.bootSector()
+            region[(sector + 1) * SECTOR_SIZE:(sector + 2) * SECTOR_SIZE] = self.fsInfoSector()
+            # the third boot sector only carries the signature
+            region[(sector + 3) * SECTOR_SIZE - 2:(sector + 3) * SECTOR_SIZE] = b'\x55\xaa'
+        return bytes(region)
+
+    def fatTable(self):
+        """returns the used part of the FAT, every run of clusters is chained in order"""
+        table = [0x0FFFFFF8, END_OF_CHAIN]
+        for relPath, isDir, count in self.layout:
+            first = len(table)
+            table.extend(range(first + 1, first + count))
+            if count:
+                table.append(END_OF_CHAIN)
+        return struct.pack('<{0}I'.format(len(table)), *table)
+
+    def write(self, fdst, readChunks, callback=None, digest=None, stream=None):
+        """writes the file system to the file object fdst from start to end in one pass
+
+        readChunks(path) yields the contents of a file, callback is called with the
+        number of file bytes written and digest, if given, is updated with every byte
+        written. Free clusters after the last file are not written. If stream is a
+        WriteBackStream, everything written goes through it and file bytes are reported
+        by it once they are committed instead of through callback.
+        """
+        zeroes = bytes(1024**2)
+        self.bytesWritten = 0
+
+        def put(buf, fileBytes=0):
+            """writes buf and keeps track of the stream, fileBytes of it are file contents"""
+            fdst.write(buf)
+            if digest is not None:
+                digest.update(buf)
+            self.bytesWritten += len(buf)
+            if stream is not None:
+                stream.wrote(len(buf), fileBytes)
+            elif callback and fileBytes:
+                callback(fileBytes)
+
+        def pad(length):
+            """writes length zero bytes"""
+            while length > 0:
+                put(zeroes[:min(length, len(zeroes))])
+                length -= len(zeroes)
+
+        put(self.reservedRegion())
+        fat = self.fatTable()
+        for i in range(NUM_FATS):
+            put(fat)
+            pad(self.fatSectors * SECTOR_SIZE - len(fat))
+
+        for relPath, isDir, count in self.layout:
+            if isDir:
+                put(self.directoryData(relPath))
+                continue
+            written = 0
+            for buf in readChunks(relPath):
+                written += len(buf)
+                if written > self.sizes[relPath]:
+                    raise FatError('\'{0}\' changed size while it was written'.format(relPath))
+                put(buf, len(buf))
+            if written != self.sizes[relPath]:
+                raise FatError('\'{0}\' changed size while it was written'.format(relPath))
+            pad(count * self.clusterSize - written)
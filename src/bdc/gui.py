@@ -4,70 +4,90 @@
 File name: gui.py
 Author: Adam Jenkins
 Date created: 10/19/2018
-Date last modified: 10/29/18
+Date last modified: 10/18/2026
 Python Version: 3.6.5
 """
 
 import sys
 from pathlib import Path
 from argparse import Namespace
-from time import sleep
-from threading import Lock
+from threading import Event
 from PyQt5 import QtCore, QtGui, QtWidgets
 from bdc.bootableDiskCreator import BootableDiskCreator
-from bdc.dependencyChecker import DependencyChecker
+from bdc.progressModel import formatEta
 
 class BDCThread(QtCore.QThread):
-    """subclass of QThread to call the BootableDiskCreator start method"""
-    def __init__(self, bdc, selectedPartition, iso, parent=None):
+    """subclass of QThread to run a BootableDiskCreator job and report on it through signals
+
+    The thread sleeps until the BootableDiskCreator stores log events or its job finishes,
+    and then emits at most one log and progress update per interval, so the GUI doesn't
+    have to poll it.
+    """
+    log = QtCore.pyqtSignal(str)
+    progress = QtCore.pyqtSignal(float)
+    status = QtCore.pyqtSignal(object)
+    completed = QtCore.pyqtSignal(str)
+
+    def __init__(self, bdc, selectedPartition, iso, parent=None, interval=0.1):
         """calls parent class constructor and initializes member variables"""
         QtCore.QThread.__init__(self, parent)
         self.bdc = bdc
         self.selectedPartition = selectedPartition
         self.iso = iso
-        self.running = False
-        self.mutex = Lock()
-
-    def isRunning(self):
-        """returns if the thread is running or not"""
-        ret = False
-        self.mutex.acquire()
-        ret = self.running
-        self.mutex.release()
-        return ret
-
-    def getBuffer(self):
-        """fetches the BootableDiskCreator's string buffer and returns it"""
-        ret = ''
-        self.mutex.acquire()
-        ret = self.bdc.getStringBuffer()
-        self.mutex.release()
-        return ret
+        self.interval = interval
+        self.changed = Event()
+
+    def update(self):
+        """emits the unread log text, the current progress and a snapshot of the throughput"""
+        logOutput = self.bdc.getStringBuffer()
+        if logOutput:
+            self.log.emit(logOutput)
+        self.progress.emit(self.bdc.copyProgress)
+        self.status.emit(self.bdc.progress.snapshot())
 
     def run(self):
-        """calls BootableDiskCreator start method when thread is started"""
-        self.mutex.acquire()
-        if not self.running:
+        """calls BootableDiskCreator start method and emits updates until its job has finished"""
+        self.bdc.listener = self.changed.set
+        try:
             self.bdc.start(Namespace(device=self.selectedPartition, image=self.iso,
-                                     image_mount=None, device_mount=None, silent=True))
-            self.running = True
-        self.mutex.release()
-
-        while self.isRunning():
-            self.mutex.acquire()
-            if self.bdc.done:
-                self.running = False
+                                     image_mount=None, device_mount=None, workers=None,
+                                     raw=False, verify=False, incremental=False,
+                                     build_fs=False, no_cache=False, write_window=None,
+                                     keep_page_cache=False, buffers=None,
+                                     buffer_size=None, stats=None,
+                                     stats_textfile=None, silent=True))
+        except SystemExit as err:
+            self.bdc.listener = None
+            message = str(err.code)
+            self.log.emit(message + '\n')
+            self.completed.emit(message)
+            return
 
-            self.mutex.release()
-            sleep(0.01)
+        while True:
+            self.changed.wait()
+            self.changed.clear()
+            # done is set before the last notification, so nothing is missed after it
+            done = self.bdc.done
+            self.update()
+            if done:
+                break
+            # throttle updates without delaying the one that reports completion
+            self.bdc.job.finished.wait(self.interval)
+
+        self.bdc.listener = None
+        error = self.bdc.error
+        self.completed.emit('' if error is None else str(error))
 
 class LogDialog(QtWidgets.QDialog):
     """subclass of QDialog to display log output from the BootableDiskCreator class"""
-    def __init__(self):
+    def __init__(self, title='Log Output'):
         """calls parent class constructor and initializes member variables"""
         super().__init__()
+        self.title = title
         self.gridLayout = QtWidgets.QGridLayout(self)
         self.textEdit = QtWidgets.QTextEdit(self)
+        self.progressBar = QtWidgets.QProgressBar(self)
+        self.statusLabel = QtWidgets.QLabel(self)
         self.setupUI()
         self.retranslateUI()
         QtCore.QMetaObject.connectSlotsByName(self)
@@ -82,11 +102,17 @@ class LogDialog(QtWidgets.QDialog):
         self.textEdit.setObjectName('textEdit')
         self.textEdit.setTextInteractionFlags(QtCore.Qt.NoTextInteraction)
         self.gridLayout.addWidget(self.textEdit, 0, 0, 1, 1)
+        self.progressBar.setRange(0, 1000)
+        self.progressBar.setFormat('{0:.2f}%'.format(0.0))
+        self.progressBar.setObjectName('progressBar')
+        self.gridLayout.addWidget(self.progressBar, 1, 0, 1, 1)
+        self.statusLabel.setObjectName('statusLabel')
+        self.gridLayout.addWidget(self.statusLabel, 2, 0, 1, 1)
 
     def retranslateUI(self):
         """allows Qt to translate the window title"""
         _translate = QtCore.QCoreApplication.translate
-        self.setWindowTitle(_translate('Dialog', 'Log Output'))
+        self.setWindowTitle(_translate('Dialog', self.title))
 
     def append(self, string):
         """adds line of text to QTextEdit member variable and moves scrollbar to bottom"""
@@ -94,6 +120,20 @@ class LogDialog(QtWidgets.QDialog):
         scrollBar = self.textEdit.verticalScrollBar()
         scrollBar.setValue(scrollBar.maximum())
 
+    def setProgress(self, percent):
+        """shows the percentage of the image that has been copied"""
+        self.progressBar.setValue(int(percent * 10))
+        self.progressBar.setFormat('{0:.2f}%'.format(percent))
+
+    def setStatus(self, snapshot):
+        """shows the throughput and ETA of the job and of its running stage"""
+        text = '{0:.1f} MB/s now, {1:.1f} MB/s average, {2} left'.format(
+            snapshot['mbPerSecond'], snapshot['averageMbPerSecond'], formatEta(snapshot['eta']))
+        running = [stage for stage in snapshot['stages'] if stage['state'] == 'running']
+        if running:
+            text += ' ({0}: {1} left)'.format(running[-1]['name'], formatEta(running[-1]['eta']))
+        self.statusLabel.setText(text)
+
 class GUI(QtWidgets.QMainWindow):
     """subclass of QMainWindow to act as main interface"""
     def __init__(self):
@@ -112,8 +152,8 @@ class GUI(QtWidgets.QMainWindow):
         self.partitionsInstructions = QtWidgets.QLabel(self.centralwidget)
         self.refreshPartitionsButton = QtWidgets.QPushButton(self.centralwidget)
         self.goButton = QtWidgets.QPushButton(self.centralwidget)
-        self.bdcThread = object()
-        self.logView = LogDialog()
+        self.jobs = []
+        self.logViews = []
         self.critMessageBox = QtWidgets.QMessageBox()
 
         self.setupUI()
@@ -127,8 +167,9 @@ class GUI(QtWidgets.QMainWindow):
     def displayConfirmation(self):
         """checks if both iso and partition have been selected and displays confirmation dialogue
 
-        If the yes button is clicked, a BDCThread instance is created and the thread is started.
-        After the thread has started, the logging view is displayed.
+        If the yes button is clicked, a BDCThread instance is created along with a logging
+        view fed by its signals and the thread is started. Several drives can be created
+        at once, each job gets its own BootableDiskCreator and logging view.
         """
         if not self.validISO() or self.selectedPartition == '':
             self.critMessageBox.setText(('You must select an ISO image AND '
@@ -147,22 +188,46 @@ class GUI(QtWidgets.QMainWindow):
                                               QtWidgets.QMessageBox.No)
 
         if conf == QtWidgets.QMessageBox.Yes:
-            self.bdcThread = BDCThread(self.bdc, self.selectedPartition, self.iso)
-            self.bdcThread.start()
-            self.logView.textEdit.clear()
-            self.logView.show()
-
-            while not self.bdcThread.isRunning():
-                QtCore.QCoreApplication.processEvents()
-                sleep(0.05)
-
-            while self.bdcThread.isRunning():
-                logOutput = self.bdcThread.getBuffer()
-                if logOutput:
-                    self.logView.append(logOutput)
+            if any(thread.selectedPartition == self.selectedPartition
+                   for thread, logView in self.jobs):
+                self.critMessageBox.setText('{0} is already being written to'
+                                            .format(self.selectedPartition))
+                self.critMessageBox.exec()
+                return
+
+            bdc = BootableDiskCreator()
+            bdc.verbose = False
+            # every job shares one event loop and pool of stage workers
+            bdc.jobs = self.bdc.jobs
+            bdcThread = BDCThread(bdc, self.selectedPartition, self.iso)
+            logView = LogDialog('Log Output - {0}'.format(self.selectedPartition))
+            bdcThread.log.connect(logView.append)
+            bdcThread.progress.connect(logView.setProgress)
+            bdcThread.status.connect(logView.setStatus)
+            bdcThread.completed.connect(lambda error: self.jobCompleted(bdcThread, error))
+            logView.finished.connect(lambda result: self.logViewClosed(logView))
+            self.jobs.append((bdcThread, logView))
+            self.logViews.append(logView)
+            logView.show()
+            bdcThread.start()
+
+    def jobCompleted(self, bdcThread, error):
+        """forgets a finished job once its thread has returned and shows its error if it failed
+
+        The job's logging view is kept in self.logViews until the user closes it.
+        """
+        bdcThread.wait()
+        self.jobs = [(thread, logView) for thread, logView in self.jobs if thread is not bdcThread]
+        if error:
+            self.critMessageBox.setText('Creating {0} failed:\n{1}'
+                                        .format(bdcThread.selectedPartition, error))
+            self.critMessageBox.exec()
 
-                QtCore.QCoreApplication.processEvents()
-                sleep(0.005)
+    def logViewClosed(self, logView):
+        """forgets a logging view once the user has closed it"""
+        if logView in self.logViews:
+            self.logViews.remove(logView)
+        logView.deleteLater()
 
     def checkRoot(self):
         """checks if the script was executed with root privilages"""
@@ -267,16 +332,10 @@ class GUI(QtWidgets.QMainWindow):
         Partitions on primary disk are filtered out.
         """
         partitions = self.bdc.getAvailablePartitions(False)
+        primary = self.bdc.topology.systemDisks()
 
-        primary = ''
-        for key, val in partitions.items():
-            if val == '/' or '/boot' in val:
-                primary = key[:-1]
-
-        if primary != '':
-            partitions = {key:val for (key, val) in partitions.items() if primary not in key}
-
-        return partitions
+        return {key:val for (key, val) in partitions.items()
+                if self.bdc.topology.diskOf(key) not in primary}
 
     def retranslateUI(self):
         """allows Qt to translate the plain text"""
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Contains class to cache the metadata of images between runs
+
+Writing the same image over and over used to parse (or mount and walk) it every time.
+The file list, sizes, extents and hashes found the first time are stored in a small
+JSON file keyed by the image's path, size, mtime and a hash of its first and last
+blocks, so later runs can plan and verify the copy without looking at the tree again.
+Least recently used entries are evicted once the cache grows past its size cap.
+
+File name: imageCache.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+DEFAULT_DIRECTORY = '/var/cache/bdc'
+CACHE_VERSION = 1
+
+class ImageCache:
+    """class that stores metadata of images in a directory with LRU eviction"""
+    def __init__(self, directory=DEFAULT_DIRECTORY, maxBytes=(64*1024**2), fingerprint=True):
+        """initializes member variables
+
+        maxBytes caps the total size of the cache files. If fingerprint is set, the
+        first and last blocks of the image are hashed into the key so an image that was
+        replaced without changing its size or mtime isn't mistaken for the old one.
+        """
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.fingerprint = fingerprint
+        self.fingerprintLength = 64*1024
+
+    def contentHash(self, image):
+        """returns the hex digest of the first and last blocks of the image"""
+        digest = hashlib.sha256()
+        with open(image, 'rb') as f:
+            digest.update(f.read(self.fingerprintLength))
+            size = os.fstat(f.fileno()).st_size
+            f.seek(max(0, size - self.fingerprintLength))
+            digest.update(f.read(self.fingerprintLength))
+        return digest.hexdigest()
+
+    def key(self, image):
+        """returns the cache key of an image"""
+        stats = os.stat(image)
+        parts = [os.path.abspath(image), str(stats.st_size), str(stats.st_mtime_ns)]
+        if self.fingerprint:
+            parts.append(self.contentHash(image))
+        return hashlib.sha256('\0'.join(parts).encode()).hexdigest()
+
+    def entryPath(self, key):
+        """returns the path of the cache file for key"""
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, image):
+        """returns the cached metadata of an image or None if there isn't any
+
+        A hit marks the entry as recently used.
+        """
+        try:
+            path = self.entryPath(self.key(image))
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get('version') != CACHE_VERSION:
+            return None
+        return entry
+
+    def put(self, image, entry):
+        """stores the metadata of an image and evicts old entries, returns if it was stored
+
+        The cache is only an optimization, so failing to write it is not an error. Every
+        writer has its own temporary file, so concurrent jobs never install a mix of both.
+        """
+        entry = dict(entry, version=CACHE_VERSION, image=os.path.abspath(image))
+        tmpPath = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self.entryPath(self.key(image))
+            tmpPath = '{0}.{1}.{2}.tmp'.format(path, os.getpid(), threading.get_ident())
+            with open(tmpPath, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmpPath, path)
+            self.evict()
+        except OSError:
+            if tmpPath is not None:
+                try:
+                    os.remove(tmpPath)
+                except OSError:
+                    pass
+            return False
+        return True
+
+    def evict(self):
+        """deletes least recently used entries until the cache fits in maxBytes
+
+        Entries removed by another process in the meantime are skipped.
+        """
+        entries = []
+        with os.scandir(self.directory) as dirEntries:
+            for dirEntry in dirEntries:
+                if dirEntry.name.endswith('.json') and dirEntry.is_file():
+                    try:
+                        stats = dirEntry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stats.st_mtime, stats.st_size, dirEntry.path))
+
+        entries.sort()
+        total = sum(entry[1] for entry in entries)
+        for mtime, size, path in entries:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
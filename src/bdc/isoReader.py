@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""Contains class to read ISO9660 images in-process without mounting them
+
+The image is memory-mapped, the directories are enumerated from the path table and
+file extents are streamed straight out of the mapping, so no loop device, mount or
+root privileges are needed. Rock Ridge names are preferred over Joliet names, which
+are preferred over plain ISO9660 names, the same way the Linux kernel picks them.
+
+File name: isoReader.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import calendar
+import mmap
+import os
+import stat
+import struct
+from bdc.pageCache import advise, FADV_DONTNEED, FADV_SEQUENTIAL
+
+SECTOR_SIZE = 2048
+JOLIET_ESCAPES = (b'%/@', b'%/C', b'%/E')
+UDF_IDENTIFIERS = (b'NSR02', b'NSR03')
+# continuation areas followed per record before the image is considered corrupt
+MAX_CONTINUATIONS = 32
+
+class IsoError(Exception):
+    """raised when an image is not a readable ISO9660 image"""
+
+class IsoEntry:
+    """file or directory found in an ISO9660 image"""
+    def __init__(self, path, size=0, extents=None, isDir=False, mtime=0):
+        """initializes member variables, extents is a list of (offset, length) tuples"""
+        self.path = path
+        self.size = size
+        self.extents = extents if extents is not None else []
+        self.isDir = isDir
+        self.mtime = mtime
+
+class DirectoryRecord:
+    """parsed ISO9660 directory record along with its Rock Ridge entries"""
+    def __init__(self, data, offset, susp):
+        """parses the record starting at offset, susp is the Rock Ridge skip length or None"""
+        length = data[offset]
+        self.extent = struct.unpack_from('<I', data, offset + 2)[0]
+        self.size = struct.unpack_from('<I', data, offset + 10)[0]
+        self.mtime = self.recordTime(data[offset + 18:offset + 25])
+        self.flags = data[offset + 25]
+        nameLength = data[offset + 32]
+        self.identifier = bytes(data[offset + 33:offset + 33 + nameLength])
+        systemUse = offset + 33 + nameLength + (1 - nameLength % 2)
+        self.systemUse = bytes(data[systemUse:offset + length])
+        self.rrName = None
+        self.mode = None
+        self.symlink = False
+        self.childLink = None
+        self.relocated = False
+        self.continuation = None
+        if susp is not None:
+            self.parseSusp(self.systemUse[susp:])
+
+    @staticmethod
+    def recordTime(date):
+        """converts a 7 byte recording date to seconds since the epoch, 0 if it isn't set"""
+        year, month, day, hour, minute, second = date[:6]
+        if not month or not day:
+            return 0
+        offset = struct.unpack('b', bytes(date[6:7]))[0] * 15 * 60
+        return calendar.timegm((1900 + year, month, day, hour, minute, second)) - offset
+
+    def isDir(self):
+        """returns if the record describes a directory"""
+        return bool(self.flags & 0x02)
+
+    def isSpecial(self):
+        """returns if the record is the '.' or '..' entry of a directory"""
+        return self.identifier in (b'\x00', b'\x01')
+
+    def parseSusp(self, area):
+        """parses System Use Sharing Protocol entries used by Rock Ridge"""
+        offset = 0
+        while offset + 4 <= len(area):
+            signature = area[offset:offset + 2]
+            length = area[offset + 2]
+            if length < 4:
+                break
+            body = area[offset + 4:offset + length]
+            if signature == b'NM':
+                if not body[0] & 0x06:
+                    self.rrName = (self.rrName or b'') + body[1:]
+            elif signature == b'PX':
+                self.mode = struct.unpack_from('<I', body, 0)[0]
+            elif signature == b'SL':
+                self.symlink = True
+            elif signature == b'CL':
+                self.childLink = struct.unpack_from('<I', body, 0)[0]
+            elif signature == b'RE':
+                self.relocated = True
+            elif signature == b'CE':
+                self.continuation = struct.unpack_from('<I4xI4xI', body, 0)
+            elif signature == b'ST':
+                break
+            offset += length
+
+    def isSymlink(self):
+        """returns if Rock Ridge marks the record as a symbolic link"""
+        return self.symlink or (self.mode is not None and stat.S_ISLNK(self.mode))
+
+class IsoReader:
+    """class that lists and streams the contents of an ISO9660 image"""
+    def __init__(self, path, dropCache=False):
+        """initializes member variables, dropCache drops file data from the page cache once read"""
+        self.path = path
+        self.dropCache = dropCache
+        self.file = None
+        self.mmap = None
+        self.blockSize = SECTOR_SIZE
+        self.joliet = False
+        self.rockRidge = False
+        self.suspSkip = None
+        self.pathTable = (0, 0)
+        self.root = None
+        self.entries = []
+        self.index = {}
+        self.totalBytes = 0
+
+    def __enter__(self):
+        """opens the image when used as a context manager"""
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        """closes the image when leaving the context manager"""
+        self.close()
+
+    def open(self, entries=None):
+        """memory-maps the image and reads its volume descriptors and directory tree
+
+        If entries is given (from the image cache), the metadata isn't parsed again.
+        Metadata that is truncated or doesn't make sense raises IsoError.
+        """
+        self.file = open(self.path, 'rb')
+        try:
+            if os.fstat(self.file.fileno()).st_size < 17 * SECTOR_SIZE:
+                raise IsoError('\'{0}\' is too small to be an ISO image'.format(self.path))
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.dropCache:
+                advise(self.file.fileno(), 0, 0, FADV_SEQUENTIAL)
+            if entries is not None:
+                self.setEntries(entries)
+            else:
+                try:
+                    self.readVolumeDescriptors()
+                    self.readTree()
+                except (struct.error, IndexError, ValueError, RecursionError) as err:
+                    raise IsoError('\'{0}\' is corrupt: {1}'.format(self.path, err))
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        """unmaps and closes the image"""
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def readVolumeDescriptors(self):
+        """finds the primary and Joliet volume descriptors
+
+        Images carrying a UDF filesystem are rejected since their ISO9660 tree is often
+        only a placeholder, those have to be mounted instead.
+        """
+        primary = None
+        joliet = None
+        sector = 16
+        while (sector + 1) * SECTOR_SIZE <= len(self.mmap):
+            offset = sector * SECTOR_SIZE
+            descriptor = self.mmap[offset:offset + SECTOR_SIZE]
+            identifier = descriptor[1:6]
+            if identifier in UDF_IDENTIFIERS:
+                raise IsoError('\'{0}\' contains a UDF filesystem'.format(self.path))
+            if identifier == b'CD001':
+                if descriptor[0] == 1 and primary is None:
+                    primary = descriptor
+                elif descriptor[0] == 2:
+                    if descriptor[88:120].rstrip(b'\x00 ') in JOLIET_ESCAPES:
+                        joliet = descriptor
+            elif identifier not in (b'BEA01', b'TEA01', b'BOOT2', b'CDW02'):
+                break
+            sector += 1
+
+        if primary is None:
+            raise IsoError('\'{0}\' is not an ISO9660 image'.format(self.path))
+
+        self.blockSize = struct.unpack_from('<H', primary, 128)[0]
+        rootRecord = DirectoryRecord(primary, 156, None)
+        root = DirectoryRecord(self.mmap, rootRecord.extent * self.blockSize, None)
+        if root.systemUse[:2] == b'SP' and root.systemUse[4:6] == b'\xbe\xef':
+            self.rockRidge = True
+            self.suspSkip = root.systemUse[6]
+
+        descriptor = primary
+        if joliet is not None and not self.rockRidge:
+            self.joliet = True
+            descriptor = joliet
+
+        self.pathTable = struct.unpack_from('<I4xI', descriptor, 132)
+        self.root = DirectoryRecord(descriptor, 156, None)
+
+    def readPathTable(self):
+        """returns the extent of every directory listed in the L-type path table"""
+        size, location = self.pathTable
+        offset = location * self.blockSize
+        end = offset + size
+        extents = []
+        while offset < end:
+            nameLength = self.mmap[offset]
+            if nameLength == 0:
+                break
+            extents.append(struct.unpack_from('<I', self.mmap, offset + 2)[0])
+            offset += 8 + nameLength + nameLength % 2
+        return extents
+
+    def readDirectory(self, extent):
+        """returns the records of the directory stored at extent, including continuations
+
+        At most MAX_CONTINUATIONS continuation areas are followed for a single record.
+        """
+        start = extent * self.blockSize
+        size = DirectoryRecord(self.mmap, start, None).size
+        records = []
+        offset = start
+        end = start + size
+        while offset < end:
+            length = self.mmap[offset]
+            if length == 0:
+                offset = (offset // self.blockSize + 1) * self.blockSize
+                continue
+            record = DirectoryRecord(self.mmap, offset, self.suspSkip)
+            hops = 0
+            while record.continuation is not None:
+                hops += 1
+                if hops > MAX_CONTINUATIONS:
+                    raise IsoError('\'{0}\' has a loop of Rock Ridge continuation entries'
+                                   .format(self.path))
+                block, ceOffset, ceLength = record.continuation
+                ceStart = block * self.blockSize + ceOffset
+                record.continuation = None
+                record.parseSusp(self.mmap[ceStart:ceStart + ceLength])
+            records.append(record)
+            offset += length
+        return records
+
+    def recordName(self, record):
+        """returns the name of a record the way the Linux kernel would show it"""
+        if record.rrName is not None:
+            return record.rrName.decode('utf-8', 'replace')
+        if self.joliet:
+            name = record.identifier.decode('utf-16-be', 'replace')
+            return name.split(';')[0]
+        name = record.identifier.decode('ascii', 'replace').split(';')[0]
+        if name.endswith('.'):
+            name = name[:-1]
+        return name.lower()
+
+    def readTree(self):
+        """builds the list of entries and the total size of all files
+
+        Directories are enumerated from the path table, names and parents come from the
+        directory records so Rock Ridge names and relocated directories are honoured.
+        """
+        rootExtent = self.root.extent
+        extents = self.readPathTable() or [rootExtent]
+        known = set(extents)
+        names = {rootExtent: ''}
+        parents = {rootExtent: None}
+        files = []
+
+        for extent in extents:
+            for record in self.readDirectory(extent):
+                if record.isSpecial() or record.relocated or record.isSymlink():
+                    continue
+                if record.isDir() or record.childLink is not None:
+                    child = record.childLink if record.childLink is not None else record.extent
+                    names[child] = self.recordName(record)
+                    parents[child] = extent
+                    if child not in known:
+                        known.add(child)
+                        extents.append(child)
+                    continue
+                files.append((extent, record))
+
+        paths = {}
+        def dirPath(extent):
+            """returns the relative path of the directory at extent"""
+            if extent not in paths:
+                parent = parents.get(extent)
+                if parent is None:
+                    paths[extent] = ''
+                else:
+                    paths[extent] = os.path.join(dirPath(parent), names[extent])
+            return paths[extent]
+
+        entries = []
+        for extent in extents:
+            if extent != rootExtent and extent in names:
+                entries.append(IsoEntry(dirPath(extent), isDir=True))
+
+        fileEntries = {}
+        for extent, record in files:
+            path = os.path.join(dirPath(extent), self.recordName(record))
+            entry = fileEntries.get(path)
+            if entry is None:
+                entry = IsoEntry(path, mtime=record.mtime)
+                fileEntries[path] = entry
+                entries.append(entry)
+            if record.size:
+                entry.extents.append((record.extent * self.blockSize, record.size))
+            entry.size += record.size
+
+        self.setEntries(entries)
+
+    def setEntries(self, entries):
+        """replaces the list of entries and rebuilds the index and total size"""
+        self.entries = entries
+        self.index = {entry.path: entry for entry in entries if not entry.isDir}
+        self.totalBytes = sum(entry.size for entry in self.index.values())
+
+    def directories(self):
+        """returns the relative paths of all directories"""
+        return [entry.path for entry in self.entries if entry.isDir]
+
+    def files(self):
+        """returns all file entries"""
+        return [entry for entry in self.entries if not entry.isDir]
+
+    def entry(self, path):
+        """returns the file entry at the given relative path"""
+        return self.index[os.path.normpath(path)]
+
+    def release(self, offset, length):
+        """drops a range of the image that has been read from the page cache
+
+        Mapped pages aren't dropped by posix_fadvise, so they are unmapped first.
+        """
+        if not self.dropCache:
+            return
+        if hasattr(self.mmap, 'madvise'):
+            start = offset - offset % mmap.PAGESIZE
+            end = min(offset + length, len(self.mmap))
+            if end > start:
+                self.mmap.madvise(mmap.MADV_DONTNEED, start, end - start)
+        advise(self.file.fileno(), offset, length, FADV_DONTNEED)
+
+    def readChunks(self, entry, length=(4*1024**2)):
+        """yields the contents of entry as bytes objects of at most length bytes"""
+        for offset, size in entry.extents:
+            end = offset + size
+            while offset < end:
+                count = min(length, end - offset)
+                buf = self.mmap[offset:offset + count]
+                self.release(offset, count)
+                yield buf
+                offset += count
+
+    def readinto(self, entry, buf):
+        """copies the contents of entry into buf, returns the number of bytes copied"""
+        view = memoryview(self.mmap)
+        filled = 0
+        try:
+            for offset, size in entry.extents:
+                size = min(size, len(buf) - filled)
+                if offset + size > len(self.mmap):
+                    raise IsoError('\'{0}\' extends past the end of the image'
+                                   .format(entry.path))
+                buf[filled:filled + size] = view[offset:offset + size]
+                self.release(offset, size)
+                filled += size
+        finally:
+            view.release()
+        return filled
+
+    def copyFile(self, entry, fdst, callback=None, length=(8*1024**2), digest=None):
+        """streams the extents of entry from the mapping into the file object fdst
+
+        If digest is given, everything written is also added to it.
+        """
+        view = memoryview(self.mmap)
+        try:
+            for offset, size in entry.extents:
+                end = offset + size
+                if end > len(self.mmap):
+                    raise IsoError('\'{0}\' extends past the end of the image'
+                                   .format(entry.path))
+                while offset < end:
+                    count = min(length, end - offset)
+                    fdst.write(view[offset:offset + count])
+                    if digest is not None:
+                        digest.update(view[offset:offset + count])
+                    self.release(offset, count)
+                    offset += count
+                    if callback:
+                        callback(count)
+        finally:
+            view.release()
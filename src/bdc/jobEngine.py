@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""Contains classes to run drive creation jobs as cancellable stages on an event loop
+
+A job is an ordered list of stages (mount, size, format, copy, cleanup). Stages run
+on a shared pool of worker threads and are awaited by an asyncio event loop, so one
+process can drive many jobs without a thread and a polling loop per job. A stage can
+have a timeout, a hook to interrupt it and a rollback. If a stage fails, times out or
+the job is cancelled, the stages started so far are rolled back in reverse order.
+asyncio is only imported once a job runs, it is the largest part of importing bdc.
+
+File name: jobEngine.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class JobError(Exception):
+    """raised when a stage of a job fails"""
+
+class CommandError(JobError):
+    """raised when a command run by a stage returns a non-zero exit status"""
+    def __init__(self, message, returncode):
+        """initializes member variables"""
+        super().__init__(message)
+        self.returncode = returncode
+
+class JobCancelled(JobError):
+    """raised when a job was cancelled before it finished"""
+
+class Stage:
+    """step of a job along with its rollback, interrupt hook and timeout in seconds"""
+    def __init__(self, name, run, rollback=None, cancel=None, timeout=None):
+        """initializes member variables, run, rollback and cancel are blocking callables"""
+        self.name = name
+        self.run = run
+        self.rollback = rollback
+        self.cancel = cancel
+        self.timeout = timeout
+
+class Job:
+    """ordered list of stages that are rolled back in reverse order if one of them fails"""
+    def __init__(self, stages, name='', callback=None):
+        """initializes member variables
+
+        callback is called with the error the job ended with (None on success) once
+        it has finished and been rolled back if needed.
+        """
+        self.stages = stages
+        self.name = name
+        self.callback = callback
+        self.started = []
+        self.current = None
+        self.state = 'pending'
+        self.error = None
+        self.cancelled = False
+        self.finished = threading.Event()
+        self.mutex = threading.Lock()
+
+    def cancel(self):
+        """asks the job to stop, the running stage is interrupted and then rolled back"""
+        self.mutex.acquire()
+        self.cancelled = True
+        stage = self.current
+        self.mutex.release()
+        if stage is not None and stage.cancel is not None:
+            stage.cancel()
+
+    async def run(self, loop, executor):
+        """runs every stage in order on executor and rolls back if one of them fails"""
+        import asyncio
+        self.state = 'running'
+        try:
+            for stage in self.stages:
+                self.mutex.acquire()
+                cancelled = self.cancelled
+                if not cancelled:
+                    self.current = stage
+                    self.started.append(stage)
+                self.mutex.release()
+                if cancelled:
+                    raise JobCancelled('cancelled')
+                await self.runStage(stage, loop, executor)
+            if self.cancelled:
+                raise JobCancelled('cancelled')
+            self.state = 'done'
+        except (Exception, asyncio.CancelledError) as err:
+            if self.cancelled and not isinstance(err, JobCancelled):
+                err = JobCancelled('cancelled')
+            self.state = 'cancelled' if isinstance(err, (JobCancelled, asyncio.CancelledError)) \
+                         else 'failed'
+            self.error = err
+            await self.rollback(loop, executor)
+            raise err
+        finally:
+            self.current = None
+            if self.callback is not None:
+                self.callback(self.error)
+            self.finished.set()
+
+    async def runStage(self, stage, loop, executor):
+        """runs a stage on executor, interrupting it if it takes longer than its timeout"""
+        import asyncio
+        task = loop.run_in_executor(executor, stage.run)
+        try:
+            await asyncio.wait_for(asyncio.shield(task), stage.timeout)
+        except asyncio.TimeoutError:
+            await self.interrupt(stage, task)
+            raise JobError('{0} timed out after {1} seconds'.format(stage.name, stage.timeout))
+        except asyncio.CancelledError:
+            self.cancelled = True
+            await self.interrupt(stage, task)
+            raise
+
+    async def interrupt(self, stage, task):
+        """interrupts a running stage and waits for its thread to return"""
+        import asyncio
+        if stage.cancel is not None:
+            stage.cancel()
+        await asyncio.wait([task])
+        if not task.cancelled():
+            task.exception()
+
+    async def rollback(self, loop, executor):
+        """rolls back every stage that was started, the last one first
+
+        A rollback that fails doesn't stop the others from running.
+        """
+        for stage in reversed(self.started):
+            if stage.rollback is None:
+                continue
+            try:
+                await loop.run_in_executor(executor, stage.rollback)
+            except Exception:
+                pass
+
+class JobEngine:
+    """class that runs jobs on one event loop thread with a shared pool of stage workers"""
+    def __init__(self, workers=8):
+        """initializes member variables, the event loop is started with the first job"""
+        self.executor = ThreadPoolExecutor(workers)
+        self.loop = None
+        self.thread = None
+        self.mutex = threading.Lock()
+
+    def startLoop(self):
+        """starts the event loop on a background thread if it isn't running yet"""
+        import asyncio
+        self.mutex.acquire()
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.runLoop, daemon=True)
+            self.thread.start()
+        self.mutex.release()
+
+    def runLoop(self):
+        """runs the event loop until the process exits"""
+        import asyncio
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, job):
+        """starts a job on the event loop and returns a future completed when it finishes"""
+        import asyncio
+        self.startLoop()
+        return asyncio.run_coroutine_threadsafe(job.run(self.loop, self.executor), self.loop)
+
+    def run(self, job):
+        """runs a job on a private event loop in the calling thread until it finishes"""
+        import asyncio
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(job.run(loop, self.executor))
+        finally:
+            loop.close()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""Contains class to record what was written to a partition so it can be re-flashed incrementally
+
+The manifest is stored as a small JSON file in the root of the partition. It lists the
+size and modification time of every file as found in the image, plus its hash if the
+copy was verified, so a later run with a point release of the same image only has to
+copy the files that changed.
+
+File name: manifest.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import json
+import os
+
+MANIFEST_NAME = '.bdc-manifest.json'
+MANIFEST_VERSION = 1
+
+class Manifest:
+    """class that maps relative paths to the size, mtime and optional hash they were copied with"""
+    def __init__(self, files=None, image=''):
+        """initializes member variables"""
+        self.files = files if files is not None else {}
+        self.image = image
+
+    @staticmethod
+    def path(root):
+        """returns the path of the manifest on a partition mounted at root"""
+        return os.path.join(root, MANIFEST_NAME)
+
+    @staticmethod
+    def isSafePath(root, relPath):
+        """returns if relPath names something inside root
+
+        The manifest comes from a removable drive and files it lists are deleted as root,
+        so absolute paths, '..' components, NUL bytes and anything that resolves outside
+        root (through a symlink for example) are refused.
+        """
+        if not isinstance(relPath, str) or not relPath or '\0' in relPath:
+            return False
+        if os.path.isabs(relPath) or '..' in relPath.replace('\\', '/').split('/'):
+            return False
+        realRoot = os.path.realpath(root)
+        try:
+            return os.path.commonpath([realRoot, os.path.realpath(os.path.join(root, relPath))]) \
+                == realRoot
+        except ValueError:
+            return False
+
+    @classmethod
+    def load(cls, root):
+        """returns the manifest of a partition mounted at root, or None if there isn't a valid one
+
+        A manifest whose files aren't a dictionary of dictionaries or that lists a path
+        outside root is invalid, the partition is then formatted and copied in full.
+        """
+        try:
+            with open(cls.path(root)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or data.get('version') != MANIFEST_VERSION:
+            return None
+        files = data.get('files', {})
+        image = data.get('image', '')
+        if not isinstance(files, dict) or not isinstance(image, str):
+            return None
+        for relPath, entry in files.items():
+            if not isinstance(entry, dict) or not cls.isSafePath(root, relPath):
+                return None
+        return cls(files, image)
+
+    def data(self):
+        """returns the manifest serialized as JSON"""
+        return json.dumps({'version': MANIFEST_VERSION, 'image': self.image,
+                           'files': self.files}).encode()
+
+    def save(self, root):
+        """writes the manifest atomically so an interrupted run never leaves a partial one"""
+        tmp = self.path(root) + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.data())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path(root))
+
+    @classmethod
+    def invalidate(cls, root):
+        """deletes the manifest of a partition mounted at root before its contents are changed
+
+        The deletion is synced first, so a run interrupted while files are being updated
+        never leaves the old manifest next to partly updated files.
+        """
+        try:
+            os.remove(cls.path(root))
+        except FileNotFoundError:
+            return
+        fd = os.open(root, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def add(self, relPath, size, mtime, digest=None):
+        """records a file that is present on the partition"""
+        entry = {'size': size, 'mtime': mtime}
+        if digest is not None:
+            entry['hash'] = digest
+        self.files[relPath] = entry
+
+    def unchanged(self, root, relPath, size, mtime):
+        """returns if a file was copied with the same size and mtime and is still on the partition"""
+        entry = self.files.get(relPath)
+        if entry is None or entry.get('size') != size or entry.get('mtime') != mtime:
+            return False
+        try:
+            return os.path.getsize(os.path.join(root, relPath)) == size
+        except OSError:
+            return False
+
+    def removeStale(self, root, keep):
+        """deletes files listed in the manifest that aren't in keep along with emptied directories
+
+        Returns the list of relative paths that were deleted.
+        """
+        removed = []
+        for relPath in sorted(set(self.files) - set(keep)):
+            if not self.isSafePath(root, relPath):
+                continue
+            path = os.path.join(root, relPath)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            removed.append(relPath)
+
+            parent = os.path.dirname(relPath)
+            while parent:
+                try:
+                    os.rmdir(os.path.join(root, parent))
+                except OSError:
+                    break
+                parent = os.path.dirname(parent)
+        return removed
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""Contains classes to mount and unmount file systems and set up loop devices
+
+Mounting used to fork a shell running mount or umount for every step, which adds up
+across batches of drives and broke on paths with spaces. NativeMounts calls mount(2)
+and umount2(2) through ctypes and attaches loop devices with the loop-control and
+LOOP_CONFIGURE ioctls (LOOP_SET_FD on kernels older than 5.8). ShellMounts runs the
+mount and umount programs without a shell and is used wherever the syscalls can't be,
+BootableDiskCreator only talks to the interface so tests can replace it with a fake.
+The C library is only loaded once something is mounted.
+
+File name: mounts.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import errno
+import fcntl
+import os
+import struct
+from functools import lru_cache
+from subprocess import Popen, PIPE
+from bdc.pageCache import loadLibc
+
+MS_RDONLY = 1
+
+LOOP_CONTROL = '/dev/loop-control'
+LOOP_SET_FD = 0x4C00
+LOOP_CLR_FD = 0x4C01
+LOOP_SET_STATUS64 = 0x4C04
+LOOP_CONFIGURE = 0x4C0A
+LOOP_CTL_GET_FREE = 0x4C82
+LO_FLAGS_READ_ONLY = 1
+LO_FLAGS_AUTOCLEAR = 4
+
+# struct loop_info64: device, inode, rdevice, offset, sizelimit, number, encrypt type,
+# encrypt key size, flags, file name, crypt name, encrypt key and init
+LOOP_INFO64 = '=5Q4I64s64s32s2Q'
+
+# file system types tried in order when loop mounting an image
+IMAGE_TYPES = ['udf', 'iso9660']
+
+# default of NativeMounts, loads the C library the first time it is needed
+UNLOADED = object()
+
+class MountError(Exception):
+    """raised when mounting or unmounting fails"""
+    def __init__(self, message, code=1):
+        """initializes member variables, code is the errno or exit status"""
+        super().__init__(message)
+        self.code = code
+
+@lru_cache(maxsize=None)
+def loadSyscalls():
+    """returns the C library with mount and umount2 set up, or None"""
+    import ctypes
+    libc = loadLibc()
+    try:
+        libc.mount.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p,
+                               ctypes.c_ulong, ctypes.c_char_p]
+        libc.mount.restype = ctypes.c_int
+        libc.umount2.argtypes = [ctypes.c_char_p, ctypes.c_int]
+        libc.umount2.restype = ctypes.c_int
+    except AttributeError:
+        return None
+    return libc
+
+class ShellMounts:
+    """class that mounts and unmounts by running the mount and umount programs"""
+    def mount(self, source, target, fsType=None, readOnly=False):
+        """mounts source on target, fsType is detected by mount if not given"""
+        command = ['mount']
+        if fsType:
+            command += ['-t', fsType]
+        if readOnly:
+            command += ['-o', 'ro']
+        self.run(command + [source, target])
+
+    def mountImage(self, image, target):
+        """mounts an image file read only through a loop device"""
+        self.run(['mount', '-o', 'loop,ro', image, target])
+
+    def unmount(self, target):
+        """unmounts the file system mounted on target"""
+        self.run(['umount', target])
+
+    @staticmethod
+    def run(command):
+        """runs a command without a shell and raises MountError if it fails"""
+        try:
+            process = Popen(command, stdout=PIPE, stderr=PIPE)
+        except OSError as err:
+            raise MountError('can\'t run {0}: {1}'.format(command[0], err.strerror), err.errno)
+        err = process.communicate()[1].decode(errors='replace').strip()
+        if process.returncode:
+            raise MountError(err or '{0} failed'.format(command[0]), process.returncode)
+
+class NativeMounts(ShellMounts):
+    """class that mounts and unmounts through syscalls, falling back to the programs"""
+    def __init__(self, libc=UNLOADED):
+        """initializes member variables, libc is None where the syscalls aren't available"""
+        self.library = libc
+
+    def syscalls(self):
+        """returns the C library, loading it the first time, or None"""
+        if self.library is UNLOADED:
+            self.library = loadSyscalls()
+        return self.library
+
+    @staticmethod
+    def error(err, action, path):
+        """returns a MountError for an errno"""
+        return MountError('can\'t {0} \'{1}\': {2}'.format(action, path, os.strerror(err)), err)
+
+    def mount(self, source, target, fsType=None, readOnly=False):
+        """mounts source on target, falls back to mount if fsType isn't given"""
+        libc = self.syscalls()
+        if libc is None or not fsType:
+            return super().mount(source, target, fsType, readOnly)
+        if libc.mount(os.fsencode(source), os.fsencode(target), fsType.encode(),
+                      MS_RDONLY if readOnly else 0, None) != 0:
+            import ctypes
+            raise self.error(ctypes.get_errno(), 'mount', source)
+
+    def unmount(self, target):
+        """unmounts the file system mounted on target"""
+        libc = self.syscalls()
+        if libc is None:
+            return super().unmount(target)
+        if libc.umount2(os.fsencode(target), 0) != 0:
+            import ctypes
+            raise self.error(ctypes.get_errno(), 'unmount', target)
+
+    def mountImage(self, image, target):
+        """attaches an image to a free loop device and mounts it read only
+
+        The loop device is set to clear itself, so it is detached again once the image
+        is unmounted or if mounting fails.
+        """
+        if self.syscalls() is None or not os.path.exists(LOOP_CONTROL):
+            return super().mountImage(image, target)
+        device, fd = self.attachLoop(image)
+        try:
+            for fsType in IMAGE_TYPES:
+                try:
+                    self.mount(device, target, fsType, readOnly=True)
+                    return
+                except MountError as err:
+                    error = err
+                    if err.code not in (errno.EINVAL, errno.ENODEV):
+                        break
+            raise error
+        finally:
+            # the device has to stay open until it is mounted or it clears itself
+            os.close(fd)
+
+    @staticmethod
+    def loopInfo(path, flags):
+        """packs a struct loop_info64"""
+        return struct.pack(LOOP_INFO64, 0, 0, 0, 0, 0, 0, 0, 0, flags,
+                           os.fsencode(path)[:63], b'', b'', 0, 0)
+
+    def attachLoop(self, path, attempts=5):
+        """attaches path read only to a free loop device, returns its path and an open fd"""
+        flags = LO_FLAGS_READ_ONLY | LO_FLAGS_AUTOCLEAR
+        info = self.loopInfo(path, flags)
+        backing = os.open(path, os.O_RDONLY)
+        try:
+            for attempt in range(attempts):
+                control = os.open(LOOP_CONTROL, os.O_RDWR)
+                try:
+                    number = fcntl.ioctl(control, LOOP_CTL_GET_FREE)
+                finally:
+                    os.close(control)
+                device = '/dev/loop{0}'.format(number)
+                fd = os.open(device, os.O_RDONLY)
+                try:
+                    self.configureLoop(fd, backing, info)
+                    return device, fd
+                except OSError as err:
+                    os.close(fd)
+                    # another process took the same device first
+                    if err.errno != errno.EBUSY or attempt == attempts - 1:
+                        raise self.error(err.errno, 'set up a loop device for', path)
+        finally:
+            os.close(backing)
+
+    @staticmethod
+    def configureLoop(fd, backing, info):
+        """attaches backing to the loop device fd, in one ioctl where the kernel supports it"""
+        try:
+            fcntl.ioctl(fd, LOOP_CONFIGURE, struct.pack('=II', backing, 0) + info + bytes(64))
+            return
+        except OSError as err:
+            if err.errno not in (errno.EINVAL, errno.ENOTTY):
+                raise
+        fcntl.ioctl(fd, LOOP_SET_FD, backing)
+        try:
+            fcntl.ioctl(fd, LOOP_SET_STATUS64, info)
+        except OSError:
+            fcntl.ioctl(fd, LOOP_CLR_FD)
+            raise
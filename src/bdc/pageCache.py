@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Contains class to keep the image from crowding everything else out of the page cache
+
+Every byte read from a multi-GB image used to stay cached, evicting the working set of
+whatever else runs on the host. Sources are declared sequential with posix_fadvise so
+the kernel reads ahead aggressively, and pages are dropped with POSIX_FADV_DONTNEED as
+soon as they have been consumed. Written pages are dropped by WriteBack once they are
+on the device. residentBytes measures what a file still has in the page cache.
+ctypes and the C library are only loaded the first time a syscall needs them.
+
+File name: pageCache.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import mmap
+import os
+from functools import lru_cache
+
+PROT_READ = 1
+MAP_SHARED = 1
+FADV_SEQUENTIAL = getattr(os, 'POSIX_FADV_SEQUENTIAL', 2)
+FADV_DONTNEED = getattr(os, 'POSIX_FADV_DONTNEED', 4)
+
+def advise(fd, offset, length, advice):
+    """calls posix_fadvise, returns False if it isn't available or fd doesn't support it
+
+    A length of 0 means up to the end of the file.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        # pipes and some file systems don't support it, which only costs cache
+        return False
+    return True
+
+@lru_cache(maxsize=None)
+def loadLibc():
+    """returns the C library with errno tracking, or None if it can't be loaded"""
+    try:
+        import ctypes
+        import ctypes.util
+        return ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except (ImportError, OSError, TypeError):
+        return None
+
+@lru_cache(maxsize=None)
+def loadMincore():
+    """returns the C library with mmap, mincore and munmap set up, or None"""
+    import ctypes
+    libc = loadLibc()
+    try:
+        libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int,
+                              ctypes.c_int, ctypes.c_int64]
+        libc.mmap.restype = ctypes.c_void_p
+        libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_char_p]
+        libc.mincore.restype = ctypes.c_int
+        libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        libc.munmap.restype = ctypes.c_int
+    except AttributeError:
+        return None
+    return libc
+
+def residentBytes(path):
+    """returns how many bytes of a file are in the page cache, or None if unknown"""
+    size = os.path.getsize(path)
+    if not size:
+        return 0
+    libc = loadMincore()
+    if libc is None:
+        return None
+    import ctypes
+    with open(path, 'rb') as f:
+        address = libc.mmap(None, size, PROT_READ, MAP_SHARED, f.fileno(), 0)
+        if address is None or address == ctypes.c_void_p(-1).value:
+            return None
+        try:
+            pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+            vector = ctypes.create_string_buffer(pages)
+            if libc.mincore(address, size, vector) != 0:
+                return None
+            resident = sum(byte & 1 for byte in vector.raw)
+        finally:
+            libc.munmap(address, size)
+    return min(size, resident * mmap.PAGESIZE)
+
+class DropBehind:
+    """class that drops pages of a file read or written sequentially once they are done with
+
+    Pages are dropped every chunk bytes and once more on close. If enabled is False,
+    nothing is advised at all.
+    """
+    def __init__(self, fd, enabled=True, offset=0, chunk=(8*1024**2), sequential=True):
+        """initializes member variables, sequential declares fd as read sequentially"""
+        self.fd = fd
+        self.enabled = enabled
+        self.start = offset
+        self.end = offset
+        self.chunk = chunk
+        if enabled and sequential:
+            advise(fd, 0, 0, FADV_SEQUENTIAL)
+
+    def advance(self, length):
+        """records that length more bytes were consumed"""
+        self.end += length
+        if self.enabled and self.end - self.start >= self.chunk:
+            self.drop()
+
+    def drop(self):
+        """drops the pages consumed since the last drop"""
+        if self.end > self.start:
+            advise(self.fd, self.start, self.end - self.start, FADV_DONTNEED)
+        self.start = self.end
+
+    def close(self):
+        """drops whatever is left, the file may be closed afterwards"""
+        if self.enabled:
+            self.drop()
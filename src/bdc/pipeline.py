@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Contains classes to overlap reading the source with writing the target
+
+Copying in userspace used to read a chunk and then write it, so the source sat idle
+while the device was written and the other way round. A Pipeline reads on its own
+thread into buffers taken from a BufferPool and hands them to the caller's thread
+through a bounded queue, the caller writes them out and returns them to the pool. The
+buffers are allocated once, page aligned so they also work with O_DIRECT, and are
+filled with readinto, so nothing is allocated per chunk.
+
+File name: pipeline.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import mmap
+import queue
+import threading
+
+class BufferPool:
+    """fixed set of reusable page aligned buffers shared by any number of pipelines"""
+    def __init__(self, count=4, size=(4*1024**2)):
+        """initializes member variables, count buffers of size bytes are allocated up front"""
+        self.count = max(1, count)
+        self.size = size
+        self.buffers = [mmap.mmap(-1, size) for i in range(self.count)]
+        self.views = [memoryview(buf) for buf in self.buffers]
+        self.free = queue.Queue()
+        for view in self.views:
+            self.free.put(view)
+
+    def get(self):
+        """returns a free buffer as a memoryview, waits until one is returned if needed"""
+        return self.free.get()
+
+    def put(self, view):
+        """returns a buffer to the pool"""
+        self.free.put(view)
+
+    def close(self):
+        """releases the buffers, none of them may be in use"""
+        for view in self.views:
+            view.release()
+        for buf in self.buffers:
+            buf.close()
+        self.views = []
+        self.buffers = []
+
+class Pipeline:
+    """reads into pooled buffers on a thread while the calling thread writes them out"""
+    def __init__(self, pool, read, write, depth=None):
+        """initializes member variables
+
+        read(view) fills as much of view as it can and returns the number of bytes
+        read, 0 at the end. write(view) is called in order with every filled part and
+        has to be done with it when it returns. At most depth filled buffers (the pool
+        size by default) wait to be written.
+        """
+        self.pool = pool
+        self.read = read
+        self.write = write
+        self.queue = queue.Queue(max(1, depth or pool.count))
+        self.stopped = threading.Event()
+
+    def reader(self):
+        """fills buffers until the end of the source, an error or stop
+
+        The queue always ends with None or the exception, so the writer never waits
+        forever.
+        """
+        end = None
+        try:
+            while not self.stopped.is_set():
+                view = self.pool.get()
+                try:
+                    count = self.read(view)
+                except Exception:
+                    self.pool.put(view)
+                    raise
+                if not count or self.stopped.is_set():
+                    self.pool.put(view)
+                    break
+                self.queue.put((view, count))
+        except Exception as err:
+            end = err
+        finally:
+            self.queue.put((end, 0))
+
+    def run(self):
+        """copies everything and returns the number of bytes written
+
+        If reading or writing fails, the reader is stopped, its buffers are returned
+        to the pool and the error is raised.
+        """
+        thread = threading.Thread(target=self.reader)
+        thread.start()
+        total = 0
+        done = False
+        try:
+            while True:
+                view, count = self.queue.get()
+                if not count:
+                    done = True
+                    if view is not None:
+                        raise view
+                    return total
+                try:
+                    # released right away so nothing holds on to a buffer that is reused
+                    with view[:count] as part:
+                        self.write(part)
+                finally:
+                    self.pool.put(view)
+                total += count
+        finally:
+            self.stopped.set()
+            while not done:
+                view, count = self.queue.get()
+                if count:
+                    self.pool.put(view)
+                else:
+                    done = True
+            thread.join()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""Contains class to track the progress of a job with smoothed throughput and an ETA
+
+progressCallback used to know nothing but a percentage. ProgressModel counts bytes and
+files per stage and keeps an exponentially weighted moving average of the throughput,
+so the rate shown follows the device without jumping around on every update. Updates
+only add to counters, the rates, ETAs and the snapshot readers see are recomputed at
+most once per interval. The snapshot is a new dictionary every time and replaces the
+old one in a single assignment, so it can be read from any thread without a lock.
+
+File name: progressModel.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import threading
+from time import monotonic
+
+def formatEta(seconds):
+    """returns an ETA as h:mm:ss or m:ss, or --:-- if it isn't known"""
+    if seconds is None:
+        return '--:--'
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '{0}:{1:02d}:{2:02d}'.format(hours, minutes, seconds)
+    return '{0}:{1:02d}'.format(minutes, seconds)
+
+class ProgressModel:
+    """class that tracks bytes, files, throughput and ETA of a job and each of its stages
+
+    Writers take a lock, snapshot() never does.
+    """
+    def __init__(self, halfLife=3.0, interval=0.25):
+        """initializes member variables
+
+        halfLife is the number of seconds after which a throughput sample only counts
+        half as much, interval the minimum number of seconds between two samples.
+        """
+        self.halfLife = halfLife
+        self.interval = interval
+        self.startTime = monotonic()
+        self.bytes = 0
+        self.files = 0
+        self.totalBytes = 0
+        self.totalFiles = 0
+        self.rate = 0.0
+        self.sampleTime = self.startTime
+        self.sampleBytes = 0
+        self.stages = []
+        self.current = None
+        self.mutex = threading.Lock()
+        self.latest = None
+        self.publish(self.startTime)
+
+    @staticmethod
+    def smooth(rate, count, seconds, halfLife):
+        """returns rate updated with count bytes moved over seconds"""
+        instant = count / seconds
+        if rate <= 0.0:
+            return instant
+        weight = 1.0 - 0.5 ** (seconds / halfLife)
+        return rate + weight * (instant - rate)
+
+    @staticmethod
+    def eta(done, total, rate):
+        """returns the seconds left at rate bytes per second, or None if it can't be told"""
+        if not total:
+            return None
+        if done >= total:
+            return 0.0
+        return (total - done) / rate if rate > 0.0 else None
+
+    def stageStarted(self, name):
+        """starts counting bytes and files against a new stage"""
+        now = monotonic()
+        self.mutex.acquire()
+        stage = {'name': name, 'state': 'running', 'start': now, 'end': None,
+                 'startBytes': self.bytes, 'bytes': 0, 'files': 0, 'totalBytes': 0,
+                 'rate': 0.0, 'sampleTime': now, 'sampleBytes': 0}
+        self.stages.append(stage)
+        self.current = stage
+        # time spent in stages that don't move bytes isn't held against the throughput
+        self.sampleTime = now
+        self.sampleBytes = self.bytes
+        self.setTotals(self.totalBytes, self.totalFiles)
+        self.publish(now)
+        self.mutex.release()
+
+    def stageFinished(self, name, state='done'):
+        """records the end of the latest stage called name"""
+        now = monotonic()
+        self.mutex.acquire()
+        for stage in reversed(self.stages):
+            if stage['name'] == name and stage['state'] == 'running':
+                stage['state'] = state
+                stage['end'] = now
+                break
+        if self.current is not None and self.current['state'] != 'running':
+            self.current = None
+        self.publish(now)
+        self.mutex.release()
+
+    def timed(self, name, run):
+        """returns a callable that runs run and tracks it as the stage called name"""
+        def stage():
+            """runs the stage and records how it ended"""
+            self.stageStarted(name)
+            try:
+                run()
+            except BaseException:
+                self.stageFinished(name, 'failed')
+                raise
+            self.stageFinished(name)
+        return stage
+
+    def setTotals(self, totalBytes=None, totalFiles=None):
+        """sets the bytes and files the job is expected to move, the mutex has to be held
+
+        Whatever is left of the job is expected of the running stage.
+        """
+        if totalBytes is not None:
+            self.totalBytes = totalBytes
+        if totalFiles is not None:
+            self.totalFiles = totalFiles
+        if self.current is not None:
+            self.current['totalBytes'] = max(0, self.totalBytes - self.current['startBytes'])
+
+    def add(self, count=0, files=0, totalBytes=None, totalFiles=None):
+        """counts bytes and files moved, optionally along with new totals
+
+        This is called from the copy loops, so it only samples the throughput once
+        interval seconds have passed since the last sample.
+        """
+        now = monotonic()
+        self.mutex.acquire()
+        self.bytes += count
+        self.files += files
+        stage = self.current
+        if stage is not None:
+            stage['bytes'] += count
+            stage['files'] += files
+        if totalBytes is not None or totalFiles is not None:
+            self.setTotals(totalBytes, totalFiles)
+        if now - self.sampleTime >= self.interval:
+            self.sample(now)
+            self.publish(now)
+        self.mutex.release()
+
+    def sample(self, now):
+        """updates the smoothed throughput of the job and the running stage"""
+        self.rate = self.smooth(self.rate, self.bytes - self.sampleBytes, now - self.sampleTime,
+                                self.halfLife)
+        self.sampleTime = now
+        self.sampleBytes = self.bytes
+        stage = self.current
+        if stage is not None and now > stage['sampleTime']:
+            stage['rate'] = self.smooth(stage['rate'], stage['bytes'] - stage['sampleBytes'],
+                                        now - stage['sampleTime'], self.halfLife)
+            stage['sampleTime'] = now
+            stage['sampleBytes'] = stage['bytes']
+
+    def stageData(self, stage, now):
+        """returns what is known about a stage as a dictionary"""
+        seconds = (stage['end'] or now) - stage['start']
+        return {'name': stage['name'], 'state': stage['state'], 'seconds': seconds,
+                'bytes': stage['bytes'], 'totalBytes': stage['totalBytes'],
+                'files': stage['files'], 'mbPerSecond': stage['rate'] / 1024**2,
+                'averageMbPerSecond': stage['bytes'] / 1024**2 / seconds if seconds > 0 else 0.0,
+                'eta': (self.eta(stage['bytes'], stage['totalBytes'], stage['rate'])
+                        if stage['state'] == 'running' else 0.0)}
+
+    def publish(self, now):
+        """replaces the snapshot, the mutex has to be held"""
+        seconds = now - self.startTime
+        stage = self.current
+        self.latest = {'stage': stage['name'] if stage is not None else None,
+                       'seconds': seconds, 'bytes': self.bytes, 'totalBytes': self.totalBytes,
+                       'files': self.files, 'totalFiles': self.totalFiles,
+                       'percent': (min(100.0, self.bytes / self.totalBytes * 100)
+                                   if self.totalBytes else 0.0),
+                       'mbPerSecond': self.rate / 1024**2,
+                       'averageMbPerSecond': (self.bytes / 1024**2 / seconds
+                                              if seconds > 0 else 0.0),
+                       'eta': self.eta(self.bytes, self.totalBytes, self.rate),
+                       'stages': [self.stageData(entry, now) for entry in self.stages]}
+
+    def snapshot(self):
+        """returns the latest snapshot without locking, it must not be modified
+
+        Rates and ETAs are at most interval seconds old. mbPerSecond is the smoothed
+        current throughput and averageMbPerSecond the average since the start. An ETA
+        is None while there is no throughput to estimate it from, the job's ETA only
+        covers the bytes it has left to move.
+        """
+        return self.latest
+
+    def flush(self):
+        """samples the throughput and publishes a new snapshot right away"""
+        now = monotonic()
+        self.mutex.acquire()
+        if now > self.sampleTime:
+            self.sample(now)
+        self.publish(now)
+        self.mutex.release()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""Contains class to write an image byte for byte onto a whole block device
+
+This is the fast path for isohybrid images, which boot fine when written to the
+whole device. Data is moved through large page aligned buffers with O_DIRECT so it
+bypasses the page cache, and all-zero regions are skipped where the target allows it.
+Compressed images are decompressed as they are read, without a temporary file. The
+image is read on its own thread into a pool of buffers while the last one is written.
+
+File name: rawWriter.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import errno
+import fcntl
+import os
+import stat
+import struct
+from bdc.pageCache import DropBehind
+from bdc.pipeline import BufferPool, Pipeline
+from bdc.writeBack import WriteBack
+
+# ioctl asking a block device to zero a byte range, _IO(0x12, 127)
+BLKZEROOUT = 0x127f
+
+class RawWriter:
+    """class that streams an image onto a block device (or a regular file)"""
+    def __init__(self, image, target, callback=None, bufferSize=(4*1024**2), direct=True,
+                 skipZeroes=True, digest=None, writeWindow=None, dropCache=False, source=None,
+                 bufferCount=4):
+        """initializes member variables
+
+        callback is called with the number of bytes handled after every buffer,
+        bufferSize has to be a multiple of the page size for O_DIRECT to work and
+        digest, if given, is updated with every byte read from the image. writeWindow
+        bounds the bytes left waiting for the device when the target can't be opened
+        with O_DIRECT, callback is then only called once they are committed. dropCache
+        drops pages of the image once they are written, and of the target once committed.
+        Compressed images are decompressed as they are read, source can be an open
+        CompressedImage (or any file object with readinto) to read instead of image.
+        Up to bufferCount buffers are read ahead of the one being written.
+        """
+        self.image = image
+        self.target = target
+        self.callback = callback
+        self.bufferSize = bufferSize
+        self.direct = direct
+        self.skipZeroes = skipZeroes
+        self.digest = digest
+        self.writeWindow = writeWindow
+        self.dropCache = dropCache
+        self.source = source
+        self.bufferCount = max(2, bufferCount)
+        self.alignment = 4096
+        self.totalBytes = 0
+        self.bytesWritten = 0
+        self.bytesSkipped = 0
+
+    def openImage(self):
+        """returns the open image and a DropBehind for it
+
+        Compressed images drop their own pages, as only the decompressor knows how much
+        of them has been consumed.
+        """
+        from bdc.compressedImage import CompressedImage, compression
+        if self.source is not None:
+            return self.source, DropBehind(None, False)
+        if compression(self.image) is not None:
+            image = CompressedImage(self.image, self.dropCache)
+            image.open()
+            return image, DropBehind(None, False)
+        image = open(self.image, 'rb', buffering=0)
+        return image, DropBehind(image.fileno(), self.dropCache)
+
+    def openTarget(self):
+        """opens the target for writing, with O_DIRECT if the target supports it"""
+        flags = os.O_WRONLY
+        if not stat.S_ISBLK(os.stat(self.target).st_mode):
+            flags |= os.O_TRUNC
+        if self.direct and hasattr(os, 'O_DIRECT'):
+            try:
+                return os.open(self.target, flags | os.O_DIRECT)
+            except OSError as err:
+                if err.errno != errno.EINVAL:
+                    raise
+        return os.open(self.target, flags)
+
+    def disableDirect(self, fd):
+        """clears O_DIRECT on fd so an unaligned tail can be written"""
+        if hasattr(os, 'O_DIRECT'):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_DIRECT)
+
+    def zeroRange(self, fd, offset, length, isBlock):
+        """makes sure a range of the target reads back as zeroes without writing it
+
+        Regular files are left sparse, block devices are asked to zero the range with
+        BLKZEROOUT. Returns False if the target can't do either, in which case the
+        zeroes have to be written out.
+        """
+        if not isBlock:
+            return True
+        try:
+            fcntl.ioctl(fd, BLKZEROOUT, struct.pack('QQ', offset, length))
+        except OSError:
+            return False
+        return True
+
+    def writeAll(self, fd, view):
+        """writes the whole view, retrying on short writes"""
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+
+    def run(self):
+        """copies the image onto the target and flushes it to the device"""
+        if self.source is not None:
+            self.totalBytes = self.source.size or 0
+        else:
+            from bdc.compressedImage import imageSize
+            self.totalBytes = imageSize(self.image) or 0
+        self.bytesWritten = 0
+        self.bytesSkipped = 0
+        zeroes = bytes(self.bufferSize)
+        pool = BufferPool(self.bufferCount, self.bufferSize)
+        fd = self.openTarget()
+        # O_DIRECT writes are on the device when they return, so only buffered ones are tracked
+        direct = hasattr(os, 'O_DIRECT') and fcntl.fcntl(fd, fcntl.F_GETFL) & os.O_DIRECT
+        writeBack = WriteBack(self.callback, None if direct else self.writeWindow,
+                              dropCache=self.dropCache)
+        stream = writeBack.stream(fd)
+        try:
+            isBlock = stat.S_ISBLK(os.fstat(fd).st_mode)
+            skipZeroes = self.skipZeroes
+            offset = 0
+            src, source = self.openImage()
+
+            def read(view):
+                """fills a buffer from the image, runs on the reader thread"""
+                length = src.readinto(view)
+                source.advance(length)
+                if self.digest is not None and length:
+                    self.digest.update(view[:length])
+                return length
+
+            def write(view):
+                """writes a buffer to the target, skipping it if it is all zeroes"""
+                nonlocal offset, skipZeroes
+                length = len(view)
+                # startswith compares the buffer with memcmp without copying it, comparing
+                # memoryviews goes item by item and slicing the mmap copies the buffer
+                if skipZeroes and length == self.bufferSize and zeroes.startswith(view):
+                    if self.zeroRange(fd, offset, length, isBlock):
+                        offset += length
+                        os.lseek(fd, offset, os.SEEK_SET)
+                        self.bytesSkipped += length
+                        stream.wrote(length)
+                        return
+                    skipZeroes = False
+
+                if length % self.alignment:
+                    self.disableDirect(fd)
+                self.writeAll(fd, view)
+                offset += length
+                self.bytesWritten += length
+                stream.wrote(length)
+
+            try:
+                Pipeline(pool, read, write, self.bufferCount).run()
+                source.close()
+            finally:
+                if src is not self.source:
+                    src.close()
+            self.totalBytes = offset
+
+            if not isBlock:
+                os.ftruncate(fd, offset)
+            stream.close()
+            writeBack.drain()
+            os.fsync(fd)
+        finally:
+            writeBack.abort()
+            os.close(fd)
+            pool.close()
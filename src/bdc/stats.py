@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""Contains class to record how long each stage and command of a job took and what it moved
+
+Every stage of a job and every command it runs is timed, bytes and files are counted
+against the stage that was running when they were written, and the slowest files are
+kept. The result can be dumped as JSON (--stats) or as a Prometheus textfile
+(--stats-textfile) for node_exporter's textfile collector.
+
+File name: stats.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import heapq
+import json
+import os
+import threading
+from time import monotonic, time
+from bdc.jobEngine import JobCancelled
+
+class Stats:
+    """class that collects timing and throughput metrics of a single job"""
+    def __init__(self, image='', devices=None, slowestFiles=10):
+        """initializes member variables, slowestFiles is the number of slowest files kept"""
+        self.image = image
+        self.devices = devices if devices is not None else []
+        self.slowestFiles = slowestFiles
+        self.started = time()
+        self.startTime = monotonic()
+        self.seconds = 0.0
+        self.state = 'running'
+        self.error = None
+        self.stages = []
+        self.current = None
+        self.commands = []
+        self.slowest = []
+        self.bytes = 0
+        self.files = 0
+        self.results = {}
+        self.mutex = threading.Lock()
+
+    @staticmethod
+    def rate(byteCount, seconds):
+        """returns throughput in MB/s"""
+        return byteCount / 1024**2 / seconds if seconds > 0 else 0.0
+
+    def stageStarted(self, name):
+        """records the start of a stage, bytes and files are counted against it until it ends"""
+        stage = {'name': name, 'state': 'running', 'seconds': 0.0, 'bytes': 0, 'files': 0,
+                 'start': monotonic()}
+        self.mutex.acquire()
+        self.stages.append(stage)
+        self.current = stage
+        self.mutex.release()
+
+    def stageFinished(self, name, state='done'):
+        """records the end of the latest stage called name"""
+        self.mutex.acquire()
+        for stage in reversed(self.stages):
+            if stage['name'] == name and stage['state'] == 'running':
+                stage['seconds'] = monotonic() - stage['start']
+                stage['state'] = state
+                break
+        if self.current is not None and self.current['state'] != 'running':
+            self.current = None
+        self.mutex.release()
+
+    def timed(self, name, run):
+        """returns a callable that runs run and records it as the stage called name"""
+        def stage():
+            """runs the stage and records how long it took and how it ended"""
+            self.stageStarted(name)
+            try:
+                run()
+            except BaseException:
+                self.stageFinished(name, 'failed')
+                raise
+            self.stageFinished(name)
+        return stage
+
+    def command(self, description, command, seconds, returncode):
+        """records a command that was run along with how long it took"""
+        self.mutex.acquire()
+        self.commands.append({'description': description, 'command': command,
+                              'stage': self.current['name'] if self.current else None,
+                              'seconds': seconds, 'returncode': returncode})
+        self.mutex.release()
+
+    def addBytes(self, count):
+        """counts bytes written against the job and the running stage"""
+        self.mutex.acquire()
+        self.bytes += count
+        if self.current is not None:
+            self.current['bytes'] += count
+        self.mutex.release()
+
+    def fileDone(self, path, size, seconds, count=1):
+        """counts copied files and keeps a single file if it is one of the slowest
+
+        A batch of count small files is counted but never kept as a slow file.
+        """
+        self.mutex.acquire()
+        self.files += count
+        if self.current is not None:
+            self.current['files'] += count
+        entry = (seconds, path, size)
+        if count == 1 and len(self.slowest) < self.slowestFiles:
+            heapq.heappush(self.slowest, entry)
+        elif count == 1 and self.slowest and entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+        self.mutex.release()
+
+    def deviceFinished(self, device, byteCount, seconds, error=None):
+        """records what one of several devices written at once got and how it ended
+
+        The bytes are counted against the stage that was running.
+        """
+        self.mutex.acquire()
+        self.results[device] = {'stage': self.current['name'] if self.current else None,
+                                'state': 'done' if error is None else 'failed',
+                                'error': str(error) if error is not None else None,
+                                'bytes': byteCount, 'seconds': seconds,
+                                'mbPerSecond': self.rate(byteCount, seconds)}
+        self.mutex.release()
+
+    def finish(self, error=None):
+        """records how long the whole job took and how it ended"""
+        self.seconds = monotonic() - self.startTime
+        self.error = error
+        if error is None:
+            self.state = 'done'
+        else:
+            self.state = 'cancelled' if isinstance(error, JobCancelled) else 'failed'
+
+    def data(self):
+        """returns the metrics as a dictionary that can be serialized as JSON"""
+        self.mutex.acquire()
+        stages = [{'name': stage['name'], 'state': stage['state'],
+                   'seconds': stage['seconds'], 'bytes': stage['bytes'],
+                   'files': stage['files'],
+                   'mbPerSecond': self.rate(stage['bytes'], stage['seconds'])}
+                  for stage in self.stages]
+        slowest = [{'path': path, 'size': size, 'seconds': seconds,
+                    'mbPerSecond': self.rate(size, seconds)}
+                   for seconds, path, size in sorted(self.slowest, reverse=True)]
+        ret = {'image': self.image, 'devices': self.devices, 'started': self.started,
+               'seconds': self.seconds, 'state': self.state,
+               'error': str(self.error) if self.error is not None else None,
+               'bytes': self.bytes, 'files': self.files,
+               'mbPerSecond': self.rate(self.bytes, self.seconds), 'stages': stages,
+               'deviceResults': {device: dict(result) for device, result in self.results.items()},
+               'commands': list(self.commands), 'slowestFiles': slowest}
+        self.mutex.release()
+        return ret
+
+    def json(self):
+        """returns the metrics serialized as JSON"""
+        return json.dumps(self.data(), indent=2)
+
+    @staticmethod
+    def label(value):
+        """escapes a Prometheus label value"""
+        return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+    def prometheus(self):
+        """returns the metrics in the Prometheus text exposition format
+
+        Every sample is labelled with the device it was written to. Devices written at
+        once report what they got and whether they failed themselves, a device without a
+        result of its own reports the job's bytes if it was the only one, and nothing
+        written otherwise. Commands are summed by program name.
+        """
+        data = self.data()
+        devices = data['devices'] or ['']
+        results = data['deviceResults']
+        single = len(devices) == 1
+        metrics = []
+
+        def add(name, kind, description, samples):
+            """adds a metric along with its help and type lines"""
+            metrics.append('# HELP bdc_{0} {1}'.format(name, description))
+            metrics.append('# TYPE bdc_{0} {1}'.format(name, kind))
+            for labels, value in samples:
+                text = ','.join('{0}="{1}"'.format(key, self.label(val)) for key, val in labels)
+                metrics.append('bdc_{0}{{{1}}} {2}'.format(name, text, float(value)))
+
+        def perDevice(value, **labels):
+            """returns one sample per device"""
+            return [([('device', device)] + sorted(labels.items()), value) for device in devices]
+
+        def byDevice(value, **labels):
+            """returns one sample per device, value is called with the device's result"""
+            return [([('device', device)] + sorted(labels.items()), value(results.get(device)))
+                    for device in devices]
+
+        def success(result):
+            """returns whether a device got everything it was supposed to get
+
+            A device that finished counts as a success even if others failed the job.
+            """
+            if result is None or data['state'] != 'failed':
+                return 1 if data['state'] == 'done' else 0
+            failed = any(other['state'] == 'failed' for other in results.values())
+            return 1 if result['state'] == 'done' and failed else 0
+
+        def written(result):
+            """returns the bytes written to a device"""
+            if result is not None:
+                return result['bytes']
+            return data['bytes'] if single else 0
+
+        def throughput(result):
+            """returns the average bytes per second written to a device"""
+            if result is not None:
+                return result['bytes'] / result['seconds'] if result['seconds'] else 0
+            return written(result) / data['seconds'] if data['seconds'] else 0
+
+        def stageWritten(stage):
+            """returns a function giving the bytes a stage wrote to a device"""
+            def value(result):
+                """returns the bytes the stage wrote to the device of result"""
+                if result is not None:
+                    return result['bytes'] if result['stage'] == stage['name'] else 0
+                return stage['bytes'] if single else 0
+            return value
+
+        add('job_last_run_timestamp_seconds', 'gauge', 'When the last job started.',
+            perDevice(data['started']))
+        add('job_duration_seconds', 'gauge', 'Wall time of the last job.',
+            perDevice(data['seconds']))
+        add('job_success', 'gauge', 'Whether the last job succeeded on the device.',
+            byDevice(success))
+        add('job_bytes', 'gauge', 'Bytes written to the device by the last job.',
+            byDevice(written))
+        add('job_files', 'gauge', 'Files copied by the last job.', perDevice(data['files']))
+        add('job_throughput_bytes_per_second', 'gauge',
+            'Average throughput of the device in the last job.', byDevice(throughput))
+        if results:
+            add('device_write_duration_seconds', 'gauge',
+                'Time spent writing the device in the last job.',
+                [([('device', device)], result['seconds'])
+                 for device, result in sorted(results.items())])
+
+        add('stage_duration_seconds', 'gauge', 'Wall time of each stage of the last job.',
+            [sample for stage in data['stages']
+             for sample in perDevice(stage['seconds'], stage=stage['name'])])
+        add('stage_bytes', 'gauge', 'Bytes written to the device by each stage of the last job.',
+            [sample for stage in data['stages']
+             for sample in byDevice(stageWritten(stage), stage=stage['name'])])
+
+        commands = {}
+        for command in data['commands']:
+            program = command['command'].split()[0] if command['command'].split() else ''
+            commands[program] = commands.get(program, 0.0) + command['seconds']
+        add('command_duration_seconds', 'gauge', 'Wall time of the commands run by the last job.',
+            [sample for program, seconds in sorted(commands.items())
+             for sample in perDevice(seconds, command=program)])
+        return '\n'.join(metrics) + '\n'
+
+    def writeJson(self, path):
+        """writes the metrics as JSON to path, or to stdout if path is '-'"""
+        if path == '-':
+            print(self.json())
+            return
+        with open(path, 'w') as f:
+            f.write(self.json() + '\n')
+
+    def writeTextfile(self, path):
+        """writes the Prometheus metrics atomically so the collector never reads a partial file"""
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(tmp, path)
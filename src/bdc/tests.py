@@ -8,34 +8,344 @@ Date last modified: 10/27/2018
 Python Version: 3.6.5
 """
 
+import bz2
+import gzip
+import errno
+import io
+import json
+import lzma
+import mmap
 import pwd
 import os
+import re
+import resource
 import threading
 import shutil
 import sys
+import struct
+import tempfile
 from contextlib import redirect_stderr, redirect_stdout
 from io import StringIO
-from unittest import TestCase, mock
+from subprocess import Popen, PIPE
+from unittest import TestCase, mock, skipUnless
 from unittest.mock import MagicMock
+from bdc.benchmarks import Benchmark
+from bdc.blockDevices import BlockTopology
+from bdc.daemon import Daemon, DaemonClient
 from bdc.bootableDiskCreator import BootableDiskCreator
 from bdc.dependencyChecker import DependencyChecker
+from bdc.compressedImage import CompressedImage, CompressionError, imageSize
+from bdc.copyEngine import CopyEngine
+from bdc.fanOut import FanOutWriter, RawSink
+from bdc.fatImage import FatImageBuilder, FatError
+from bdc.imageCache import ImageCache
+from bdc.eventBuffer import EventBuffer, STAGE_START, BYTES_COPIED, ERROR
+from bdc.isoReader import DirectoryRecord, IsoReader, IsoError
+from bdc.jobEngine import CommandError, Job, JobCancelled, JobEngine, JobError, Stage
+from bdc.manifest import Manifest, MANIFEST_NAME
+from bdc.mounts import (MountError, NativeMounts, ShellMounts, IMAGE_TYPES, LOOP_INFO64,
+                        MS_RDONLY)
+from bdc.pageCache import DropBehind, residentBytes, FADV_DONTNEED, FADV_SEQUENTIAL
+from bdc.pipeline import BufferPool, Pipeline
+from bdc.progressModel import ProgressModel, formatEta
+from bdc.rawWriter import RawWriter
+from bdc.stats import Stats
+from bdc.verifier import Verifier
+from bdc.writeBack import WriteBack
+
+def createTree(root, files):
+    """creates files under root from dictionary of relative paths and sizes"""
+    for relPath, size in files.items():
+        path = os.path.join(root, relPath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+
+def cliArgs(device, image, **options):
+    """returns mock of parsed command line arguments with every optional mode turned off"""
+    args = dict(raw=False, verify=False, incremental=False, no_cache=True, build_fs=False,
+                write_window=None, keep_page_cache=False, buffers=None, buffer_size=None,
+                stats=None, stats_textfile=None)
+    args.update(options)
+    return MagicMock(device=device, image=image, **args)
+
+def fakeTopology(root, partitions, sizes=None):
+    """creates fake sysfs tree and mountinfo under root and returns BlockTopology reading them
+
+    partitions uses the same format lsblk output used to be parsed in, one 'name,mountpoint'
+    line per partition, and the disk of each partition is derived from its name
+    """
+    sysfs = os.path.join(root, 'sys', 'class', 'block')
+    mountinfo = os.path.join(root, 'mountinfo')
+    os.makedirs(sysfs, exist_ok=True)
+    mounts = []
+    for minor, line in enumerate(partitions.split('\n')):
+        name, mountpoint = line.split(',')
+        disk = re.sub(r'p?\d+$', '', name)
+        partition = os.path.join(sysfs, disk, name)
+        os.makedirs(partition, exist_ok=True)
+        os.makedirs(os.path.join(sysfs, name), exist_ok=True)
+        for entry in (partition, os.path.join(sysfs, name)):
+            for fileName, contents in (('partition', '1'), ('dev', '8:{0}'.format(minor + 1)),
+                                       ('size', str((sizes or {}).get(name, 2048)))):
+                with open(os.path.join(entry, fileName), 'w') as f:
+                    f.write(contents + '\n')
+        with open(os.path.join(sysfs, disk, 'size'), 'w') as f:
+            f.write('4096\n')
+        if mountpoint:
+            mounts.append('{0} 1 8:{1} / {2} rw - vfat /dev/{3} rw'
+                          .format(30 + minor, minor + 1, mountpoint.replace(' ', '\\040'), name))
+    with open(mountinfo, 'w') as f:
+        f.write('\n'.join(mounts) + '\n')
+    return BlockTopology(sysfs, mountinfo)
+
+class FakeMounts:
+    """records mount operations instead of running them, fails those listed in errors"""
+    def __init__(self, errors=None):
+        """initializes member variables"""
+        self.calls = []
+        self.errors = errors or {}
+
+    def record(self, *call):
+        """records a call and raises the error given for it"""
+        self.calls.append(call)
+        if call[0] in self.errors:
+            raise self.errors[call[0]]
+
+    def mount(self, source, target, fsType=None, readOnly=False):
+        """records mounting source on target"""
+        self.record('mount', source, target)
+
+    def mountImage(self, image, target):
+        """records loop mounting image on target"""
+        self.record('mountImage', image, target)
+
+    def unmount(self, target):
+        """records unmounting target"""
+        self.record('unmount', target)
+
+def bothEndian(value, size):
+    """packs value in both little and big endian byte order as used by ISO9660"""
+    fmt = 'H' if size == 2 else 'I'
+    return struct.pack('<' + fmt, value) + struct.pack('>' + fmt, value)
+
+def isoRecord(extent, size, isDir, identifier, systemUse=b''):
+    """returns an ISO9660 directory record"""
+    record = (bytes([0, 0]) + bothEndian(extent, 4) + bothEndian(size, 4) + bytes(7) +
+              bytes([2 if isDir else 0, 0, 0]) + bothEndian(1, 2) +
+              bytes([len(identifier)]) + identifier)
+    if len(identifier) % 2 == 0:
+        record += b'\x00'
+    record += systemUse
+    record += b'\x00' * (len(record) % 2)
+    return bytes([len(record)]) + record[1:]
+
+def buildIso(path, files, rockRidge=False, joliet=False, symlinks=(), udf=False):
+    """writes a minimal ISO9660 image from a dictionary of relative paths and contents
+
+    Every directory has to fit in a single sector, which is plenty for test fixtures.
+    """
+    dirs = ['']
+    for relPath in list(files) + list(symlinks):
+        parts = relPath.split('/')
+        for i in range(1, len(parts)):
+            if '/'.join(parts[:i]) not in dirs:
+                dirs.append('/'.join(parts[:i]))
+    dirs.sort(key=lambda d: (d.count('/') + bool(d), d))
+
+    namespaces = [False, True] if joliet else [False]
+    sector = 17 + len(namespaces) + (3 if udf else 0)
+    pathTables = {}
+    for namespace in namespaces:
+        pathTables[namespace] = sector
+        sector += 1
+    dirExtents = {}
+    for namespace in namespaces:
+        for d in dirs:
+            dirExtents[(namespace, d)] = sector
+            sector += 1
+    fileExtents = {}
+    for relPath, data in sorted(files.items()):
+        fileExtents[relPath] = sector if data else 0
+        sector += (len(data) + 2047) // 2048
+
+    def identifier(name, isDir, namespace):
+        """returns the on-disc identifier of name"""
+        if namespace:
+            return (name if isDir else name + ';1').encode('utf-16-be')
+        return (name.upper() if isDir else name.upper() + ';1').encode()
+
+    def nm(name):
+        """returns a Rock Ridge NM entry"""
+        return b'NM' + bytes([5 + len(name), 1, 0]) + name.encode() if rockRidge else b''
+
+    image = bytearray(sector * 2048)
+    descriptors = []
+    for namespace in namespaces:
+        table = b''
+        for d in dirs:
+            ident = identifier(d.split('/')[-1], True, namespace) if d else b'\x00'
+            parent = dirs.index(d.rsplit('/', 1)[0] if '/' in d else '') + 1
+            table += (bytes([len(ident), 0]) + struct.pack('<IH', dirExtents[(namespace, d)],
+                                                          parent) + ident)
+            table += b'\x00' * (len(ident) % 2)
+        image[pathTables[namespace] * 2048:pathTables[namespace] * 2048 + len(table)] = table
+
+        for d in dirs:
+            parent = d.rsplit('/', 1)[0] if '/' in d else ''
+            sp = b'SP\x07\x01\xbe\xef\x00' if rockRidge and not d and not namespace else b''
+            data = (isoRecord(dirExtents[(namespace, d)], 2048, True, b'\x00', sp) +
+                    isoRecord(dirExtents[(namespace, parent)], 2048, True, b'\x01'))
+            children = []
+            for child in dirs:
+                if child and (child.rsplit('/', 1)[0] if '/' in child else '') == d:
+                    name = child.split('/')[-1]
+                    children.append(isoRecord(dirExtents[(namespace, child)], 2048, True,
+                                              identifier(name, True, namespace),
+                                              b'' if namespace else nm(name)))
+            for relPath in sorted(files):
+                if (relPath.rsplit('/', 1)[0] if '/' in relPath else '') == d:
+                    name = relPath.split('/')[-1]
+                    children.append(isoRecord(fileExtents[relPath], len(files[relPath]), False,
+                                              identifier(name, False, namespace),
+                                              b'' if namespace else nm(name)))
+            for relPath in symlinks:
+                if rockRidge and not namespace and \
+                   (relPath.rsplit('/', 1)[0] if '/' in relPath else '') == d:
+                    name = relPath.split('/')[-1]
+                    children.append(isoRecord(0, 0, False, identifier(name, False, namespace),
+                                              nm(name) + b'SL\x05\x01\x00'))
+            data += b''.join(children)
+            assert len(data) <= 2048
+            offset = dirExtents[(namespace, d)] * 2048
+            image[offset:offset + len(data)] = data
+
+        descriptor = bytearray(2048)
+        descriptor[0:7] = bytes([2 if namespace else 1]) + b'CD001\x01'
+        descriptor[80:88] = bothEndian(sector, 4)
+        if namespace:
+            descriptor[88:91] = b'%/E'
+        descriptor[120:132] = bothEndian(1, 2) + bothEndian(1, 2) + bothEndian(2048, 2)
+        descriptor[132:140] = bothEndian(len(table), 4)
+        descriptor[140:144] = struct.pack('<I', pathTables[namespace])
+        descriptor[156:190] = isoRecord(dirExtents[(namespace, '')], 2048, True, b'\x00')
+        descriptor[881] = 1
+        descriptors.append(bytes(descriptor))
+
+    descriptors.append(b'\xffCD001\x01'.ljust(2048, b'\x00'))
+    if udf:
+        descriptors += [b'\x00' + ident + b'\x01' for ident in (b'BEA01', b'NSR02', b'TEA01')]
+    for i, descriptor in enumerate(descriptors):
+        image[(16 + i) * 2048:(16 + i) * 2048 + len(descriptor)] = descriptor
+    for relPath, data in files.items():
+        image[fileExtents[relPath] * 2048:fileExtents[relPath] * 2048 + len(data)] = data
+
+    with open(path, 'wb') as f:
+        f.write(image)
+
+def readFat32(path):
+    """parses a FAT32 image the way fsck.fat checks it and returns its files and directories
+
+    Both FATs have to match, every cluster has to belong to exactly one chain of the
+    right length, long names have to match their short entries and the FSInfo free
+    count has to be right.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert data[510:512] == b'\x55\xaa' and data[82:90] == b'FAT32   '
+    assert data[:512] == data[6 * 512:7 * 512]
+    sectorSize, sectorsPerCluster, reserved, numFats = struct.unpack_from('<HBHB', data, 11)
+    totalSectors, fatSectors, extFlags, version, rootCluster = struct.unpack_from('<IIHHI',
+                                                                                 data, 32)
+    fatStart = reserved * sectorSize
+    fatBytes = fatSectors * sectorSize
+    fats = [data[fatStart + i * fatBytes:fatStart + (i + 1) * fatBytes] for i in range(numFats)]
+    assert all(fat == fats[0] for fat in fats)
+    fat = struct.unpack('<{0}I'.format(fatBytes // 4), fats[0])
+    clusterSize = sectorsPerCluster * sectorSize
+    dataStart = fatStart + numFats * fatBytes
+    clusterCount = (totalSectors - reserved - numFats * fatSectors) // sectorsPerCluster
+    used = set()
+
+    def readChain(cluster, length=None):
+        """returns the contents of a cluster chain"""
+        clusters = []
+        while cluster < 0x0FFFFFF8:
+            assert 2 <= cluster < clusterCount + 2 and cluster not in used
+            used.add(cluster)
+            clusters.append(cluster)
+            cluster = fat[cluster]
+        if length is not None:
+            assert len(clusters) == -(-length // clusterSize)
+        return b''.join(data[dataStart + (c - 2) * clusterSize:dataStart + (c - 1) * clusterSize]
+                        for c in clusters)
+
+    files = {}
+    directories = []
+    def walk(cluster, relDir, parent):
+        """adds the contents of a directory to files and directories"""
+        entries = readChain(cluster)
+        longParts = []
+        shortNames = set()
+        for offset in range(0, len(entries), 32):
+            entry = entries[offset:offset + 32]
+            if entry[0] == 0:
+                break
+            if entry[11] == 0x0F:
+                longParts.append(entry)
+                continue
+            if entry[11] & 0x08:
+                continue
+            short = entry[:11]
+            first = struct.unpack_from('<H', entry, 20)[0] << 16 | \
+                    struct.unpack_from('<H', entry, 26)[0]
+            if short in (b'.'.ljust(11), b'..'.ljust(11)):
+                assert first == (cluster if short == b'.'.ljust(11) else parent)
+                continue
+            assert short not in shortNames
+            shortNames.add(short)
+            if longParts:
+                assert all(part[13] == FatImageBuilder.checksum(short) for part in longParts)
+                units = b''.join(part[1:11] + part[14:26] + part[28:32]
+                                 for part in reversed(longParts))
+                name = units.decode('utf-16-le', 'surrogatepass').split('\x00')[0]
+                longParts = []
+            else:
+                base, ext = short[:8].decode().rstrip(), short[8:].decode().rstrip()
+                name = base + '.' + ext if ext else base
+            relPath = os.path.join(relDir, name)
+            size = struct.unpack_from('<I', entry, 28)[0]
+            if entry[11] & 0x10:
+                directories.append(relPath)
+                walk(first, relPath, cluster if relDir else 0)
+            else:
+                files[relPath] = readChain(first, size)[:size] if first else b''
+
+    walk(rootCluster, '', 0)
+    free = struct.unpack_from('<I', data, 512 + 488)[0]
+    assert free == clusterCount - len(used)
+    assert free == fat[2:clusterCount + 2].count(0)
+    return files, directories
 
 class BootableDiskCreatorTests(TestCase):
     """test class that inherits from unittest.TestCase class"""
     def setUp(self):
         """function to create new BootableDiskCreator object before each test"""
         self.obj = BootableDiskCreator()
+        self.obj.mounts = FakeMounts()
+        self.tmp = tempfile.TemporaryDirectory()
 
     def tearDown(self):
         """function to delete BootableDiskCreator object after test finishes"""
         del self.obj
+        self.tmp.cleanup()
 
     @mock.patch('pwd.getpwnam')
     def test_root_user(self, mockPwd):
         """tests whether or not script was executed as root"""
         mockPwd.return_value = MagicMock(pw_uid=1)
         with self.assertRaises(SystemExit) as err:
-            self.obj.start(MagicMock(device='/dev/sdb1', image='image.iso'))
+            self.obj.start(cliArgs('/dev/sdb1', 'image.iso'))
         self.assertEqual(err.exception.code, 'Error: must run as root')
 
     @mock.patch('pwd.getpwnam')
@@ -43,7 +353,7 @@ class BootableDiskCreatorTests(TestCase):
         """tests if the provided image exists"""
         mockPwd.return_value = MagicMock(pw_uid=0)
         with self.assertRaises(SystemExit) as err:
-            self.obj.start(MagicMock(device='/dev/sdb1', image='image.asdf'))
+            self.obj.start(cliArgs('/dev/sdb1', 'image.asdf'))
         self.assertEqual(err.exception.code, 'Error: \'image.asdf\' is not an ISO image')
 
     @mock.patch('pwd.getpwnam')
@@ -51,7 +361,7 @@ class BootableDiskCreatorTests(TestCase):
         """tests if the provided image exists"""
         mockPwd.return_value = MagicMock(pw_uid=0)
         with self.assertRaises(SystemExit) as err:
-            self.obj.start(MagicMock(device='/dev/sdb1', image='image.iso'))
+            self.obj.start(cliArgs('/dev/sdb1', 'image.iso'))
         self.assertEqual(err.exception.code, 'Error: image \'image.iso\' does not exist')
 
     @mock.patch('os.path.isfile')
@@ -60,10 +370,10 @@ class BootableDiskCreatorTests(TestCase):
     def test_partition_exists(self, mockPwd, mockExecute, mockFile):
         """tests if the given partition exists"""
         mockPwd.return_value = MagicMock(pw_uid=0)
-        mockExecute.return_value = 'sda1,/'
+        self.obj.topology = fakeTopology(self.tmp.name, 'sda1,/')
         mockFile.return_value = True
         with self.assertRaises(SystemExit) as err:
-            self.obj.start(MagicMock(device='/dev/sdb1', image='image.iso'))
+            self.obj.start(cliArgs('/dev/sdb1', 'image.iso'))
         self.assertEqual(err.exception.code, 'Error: partition \'/dev/sdb1\' does not exist')
 
     @mock.patch('os.statvfs')
@@ -74,12 +384,12 @@ class BootableDiskCreatorTests(TestCase):
     def test_partition_too_small(self, mockPwd, mockExecute, mockFile, mockImageSize, mockStats):
         """tests if the given partition exists"""
         mockPwd.return_value = MagicMock(pw_uid=0)
-        mockExecute.return_value = 'sdb1,'
+        self.obj.topology = fakeTopology(self.tmp.name, 'sdb1,')
         mockFile.return_value = True
         mockImageSize.return_value = 1024**2
         mockStats.return_value = MagicMock(f_bsize=1024, f_blocks=1)
         with self.assertRaises(SystemExit) as err:
-            self.obj.start(MagicMock(device='/dev/sdb1', image='image.iso'))
+            self.obj.start(cliArgs('/dev/sdb1', 'image.iso'))
         self.assertEqual(err.exception.code, ('Error: not enough space to copy \'image.iso\' '
                                               'onto \'/dev/sdb1\''))
 
@@ -92,18 +402,18 @@ class BootableDiskCreatorTests(TestCase):
                                                  mockImageSize, mockStats):
         """tests if then given partition is mounted as something important"""
         mockPwd.return_value = MagicMock(pw_uid=0)
-        mockExecute.return_value = 'sda1,/'
+        self.obj.topology = fakeTopology(self.tmp.name, 'sda1,/')
         mockFile.return_value = True
         mockImageSize.return_value = 1024**2
         mockStats.return_value = MagicMock(f_bsize=1024, f_blocks=1024)
         with self.assertRaises(SystemExit) as err:
-            self.obj.start(MagicMock(device='/dev/sda1', image='image.iso'))
+            self.obj.start(cliArgs('/dev/sda1', 'image.iso'))
         self.assertEqual(err.exception.code,
                          'Error: partition \'/dev/sda1\' currently mounted as \'/\'')
 
-        mockExecute.return_value = 'sda1,/boot'
+        self.obj.topology = fakeTopology(self.tmp.name, 'sda1,/boot')
         with self.assertRaises(SystemExit) as err:
-            self.obj.start(MagicMock(device='/dev/sda1', image='image.iso'))
+            self.obj.start(cliArgs('/dev/sda1', 'image.iso'))
         self.assertEqual(err.exception.code,
                          'Error: partition \'/dev/sda1\' currently mounted as \'/boot\'')
 
@@ -117,7 +427,7 @@ class BootableDiskCreatorTests(TestCase):
                                        mockImageSize, mockStats):
         """tests that warning is provided if given partition is on main disk"""
         mockPwd.return_value = MagicMock(pw_uid=0)
-        mockExecute.return_value = 'sda1,/\nsda2,'
+        self.obj.topology = fakeTopology(self.tmp.name, 'sda1,/\nsda2,')
         mockFile.return_value = True
         mockInput.side_effect = ['asdf', 'no']
         mockImageSize.return_value = 1024**2
@@ -125,41 +435,1850 @@ class BootableDiskCreatorTests(TestCase):
 
         with self.assertRaises(SystemExit) as err:
             with redirect_stdout(StringIO()):
-                self.obj.start(MagicMock(device='/dev/sda2', image='image.iso'))
+                self.obj.start(cliArgs('/dev/sda2', 'image.iso'))
         self.assertEqual(err.exception.code, 0)
 
     @mock.patch('os.statvfs')
     @mock.patch('os.path.getsize')
-    @mock.patch('threading.Thread')
+    @mock.patch('bdc.jobEngine.JobEngine.submit')
+    @mock.patch('bdc.copyEngine.CopyEngine.buildWorkList')
     @mock.patch('bdc.bootableDiskCreator.BootableDiskCreator.copyImage')
     @mock.patch('os.path.ismount')
     @mock.patch('os.path.isdir')
     @mock.patch('os.path.isfile')
     @mock.patch('bdc.bootableDiskCreator.BootableDiskCreator.executeCommand')
     @mock.patch('pwd.getpwnam')
-    def test_create_bootable_drive(self, mockPwd, mockExecute, mockFile, mockDir,
-                                   mockMount, mockCopy, mockThread, mockImageSize, mockStats):
+    def test_create_bootable_drive(self, mockPwd, mockExecute, mockFile, mockDir, mockMount,
+                                   mockCopy, mockPlan, mockSubmit, mockImageSize, mockStats):
         """tests functionality of creating a bootable drive"""
-        mockThread.start = self.obj.main()
+        self.obj.main()
+        self.assertIsNone(self.obj.error)
         mockPwd.return_value = MagicMock(pw_uid=0)
-        mockExecute.side_effect = ['sda1,/\nsdb1,/mnt/fakemount', '', '', '', 5000, '', '', '', '']
+        mockExecute.side_effect = ['', '', '', '', '', '', '', '']
+        self.obj.topology = fakeTopology(self.tmp.name, 'sda1,/\nsdb1,/mnt/fakemount')
         mockFile.return_value = True
         mockDir.return_value = True
         mockMount.return_value = True
         mockImageSize.return_value = 1024**2
         mockStats.return_value = MagicMock(f_bsize=1024, f_blocks=1024)
 
-        self.assertEqual(self.obj.start(MagicMock(device='/dev/sdb1', image='image.iso')), None)
+        self.assertEqual(self.obj.start(cliArgs('/dev/sdb1', 'image.iso')), None)
+        mockSubmit.assert_called_once_with(self.obj.job)
+        self.assertEqual(self.obj.mounts.calls[-1], ('unmount', '/mnt/fakemount'))
+
+    def test_failed_mount(self):
+        """tests that a failed mount is logged and raised like a failed command"""
+        self.obj.verbose = False
+        self.obj.mounts = FakeMounts({'mount': MountError('can\'t mount \'/dev/sdb1\': '
+                                                          'No such device', errno.ENODEV)})
+        with mock.patch('bdc.bootableDiskCreator.stderr', new_callable=StringIO):
+            with self.assertRaises(CommandError) as err:
+                self.obj.mount('mounting...', '/dev/sdb1', '/mnt/my target')
+        self.assertEqual(err.exception.args[0], '\'mount /dev/sdb1 \'/mnt/my target\'\' failed')
+        self.assertIn('No such device', self.obj.getStringBuffer())
+        self.assertEqual(self.obj.stats.commands[-1]['returncode'], errno.ENODEV)
+
+class FanOutTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create temporary image and source tree before each test"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.iso = os.path.join(self.tmp.name, 'image.iso')
+        self.data = os.urandom(300000)
+        with open(self.iso, 'wb') as f:
+            f.write(self.data)
+        self.source = os.path.join(self.tmp.name, 'iso')
+        self.files = {'EFI/BOOT/BOOTX64.EFI': 3000, 'casper/vmlinuz': 200000, 'md5sum.txt': 0}
+        createTree(self.source, self.files)
+
+    def tearDown(self):
+        """function to remove temporary directory after test finishes"""
+        self.tmp.cleanup()
+
+    def test_raw_fan_out(self):
+        """tests that one failing device doesn't affect the others"""
+        targets = [os.path.join(self.tmp.name, name) for name in ('sdb', 'missing/sdc', 'sdd')]
+        written = {}
+        def callback(writer, n):
+            written[writer.device] = written.get(writer.device, 0) + n
+        fanOut = FanOutWriter([RawSink(target) for target in targets], callback, depth=2,
+                              length=4096)
+        with open(self.iso, 'rb') as fsrc:
+            writers = fanOut.run(lambda fanOut: fanOut.writeStream(fsrc))
+
+        self.assertIsInstance(writers[1].error, FileNotFoundError)
+        for writer in (writers[0], writers[2]):
+            self.assertIsNone(writer.error)
+            self.assertEqual(writer.bytesWritten, len(self.data))
+            self.assertEqual(written[writer.device], len(self.data))
+            with open(writer.device, 'rb') as f:
+                self.assertEqual(f.read(), self.data)
+
+    def test_tree_fan_out(self):
+        """tests that BootableDiskCreator copies the image onto every mounted device"""
+        bdc = BootableDiskCreator()
+        bdc.verbose = False
+        bdc.isoMount = self.source
+        bdc.target = os.path.join(self.tmp.name, 'target')
+        bdc.devices = ['/dev/sdb1', '/dev/sdc1', '/dev/sdd1']
+        for device in bdc.devices[:2]:
+            os.makedirs(bdc.targetFor(device))
+        with open(bdc.targetFor('/dev/sdd1'), 'w') as f:
+            f.write('not a directory')
+
+        bdc.planCopy()
+        self.assertEqual(bdc.totalBytes, 3 * sum(self.files.values()))
+        with mock.patch('bdc.bootableDiskCreator.stderr', new_callable=StringIO):
+            with self.assertRaises(JobError) as err:
+                bdc.copyImage()
+        self.assertEqual(str(err.exception), 'writing failed on /dev/sdd1')
+        self.assertEqual(bdc.failedDevices, ['/dev/sdd1'])
+        # the failed device's share is dropped, so the devices that finished reach 100%
+        self.assertEqual(bdc.totalBytes, 2 * sum(self.files.values()))
+        self.assertEqual(bdc.copyProgress, 100.0)
+        progress = bdc.deviceProgress()
+        self.assertTrue(progress['/dev/sdd1']['failed'])
+        self.assertEqual(progress['/dev/sdd1']['bytes'], 0)
+        for device in bdc.devices[:2]:
+            self.assertEqual(progress[device], {'bytes': sum(self.files.values()),
+                                                'progress': 100.0, 'failed': False})
+        self.assertIn('copying image... 100.00% (sdb1 100%, sdc1 100%, sdd1 failed)',
+                      bdc.getStringBuffer())
+        for device in bdc.devices[:2]:
+            for relPath in self.files:
+                with open(os.path.join(self.source, relPath), 'rb') as src, \
+                     open(os.path.join(bdc.targetFor(device), relPath), 'rb') as dst:
+                    self.assertEqual(src.read(), dst.read())
+
+    def test_failed_devices_exit(self):
+        """tests that the job fails and exits non-zero when devices couldn't be written"""
+        bdc = BootableDiskCreator()
+        bdc.verbose = False
+        bdc.raw = True
+        bdc.iso = self.iso
+        bdc.devices = [os.path.join(self.tmp.name, 'missing', name) for name in ('sdb', 'sdc')]
+        with mock.patch('bdc.bootableDiskCreator.stderr', new_callable=StringIO):
+            bdc.main()
+            with self.assertRaises(SystemExit) as exit:
+                bdc.wait()
+        self.assertIsInstance(bdc.error, JobError)
+        self.assertEqual(bdc.failedDevices, bdc.devices)
+        self.assertNotEqual(exit.exception.code, 0)
+
+class VerifierTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create temporary source and target directories before each test"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, 'iso')
+        self.target = os.path.join(self.tmp.name, 'target')
+        os.mkdir(self.target)
+        self.files = {'EFI/BOOT/BOOTX64.EFI': 3000, 'casper/vmlinuz': 200000, 'md5sum.txt': 10}
+        createTree(self.source, self.files)
+
+    def tearDown(self):
+        """function to remove temporary directory after test finishes"""
+        self.tmp.cleanup()
+
+    def test_verify(self):
+        """tests that hashes taken while copying match and corrupted files are reported"""
+        engine = CopyEngine(self.source, self.target, workers=2, algorithm='sha256')
+        engine.run()
+        self.assertEqual(sorted(engine.hashes), sorted(self.files))
+        self.assertEqual(Verifier(self.target, engine.hashes).run(), [])
+
+        os.remove(os.path.join(self.target, 'md5sum.txt'))
+        with open(os.path.join(self.target, 'casper/vmlinuz'), 'r+b') as f:
+            f.write(b'corrupt')
+        self.assertEqual(Verifier(self.target, engine.hashes, workers=3).run(),
+                         [('casper/vmlinuz', 'hash mismatch'), ('md5sum.txt', 'missing')])
+
+    def test_verify_image(self):
+        """tests that BootableDiskCreator verifies files streamed out of an image"""
+        iso = os.path.join(self.tmp.name, 'image.iso')
+        contents = {'EFI/BOOT/BOOTX64.EFI': os.urandom(3000), 'README.txt': b'hello'}
+        buildIso(iso, contents, rockRidge=True)
+        bdc = BootableDiskCreator()
+        bdc.verbose = False
+        bdc.verify = True
+        bdc.iso = iso
+        bdc.target = self.target
+        bdc.devices = ['/dev/sdb1']
+        bdc.reader = bdc.openImage()
+        bdc.planCopy()
+        bdc.copyImage()
+        bdc.reader.close()
+        bdc.verifyImage()
+        self.assertEqual(bdc.mismatches, [])
+
+        with open(os.path.join(self.target, 'README.txt'), 'wb') as f:
+            f.write(b'hellO')
+        with mock.patch('bdc.bootableDiskCreator.stderr', new_callable=StringIO) as err:
+            with self.assertRaises(JobError) as failed:
+                bdc.verifyImage()
+        self.assertEqual(bdc.mismatches, [('/dev/sdb1', 'README.txt', 'hash mismatch')])
+        self.assertEqual(err.getvalue(), 'Error: /dev/sdb1/README.txt: hash mismatch\n')
+        self.assertEqual(str(failed.exception), 'verification failed: /dev/sdb1/README.txt')
+
+    def test_verify_raw(self):
+        """tests that an image written in raw mode is read back and compared"""
+        iso = os.path.join(self.tmp.name, 'image.iso')
+        device = os.path.join(self.tmp.name, 'sdb')
+        with open(iso, 'wb') as f:
+            f.write(os.urandom(100000))
+        with open(device, 'wb') as f:
+            f.write(bytes(200000))
+        bdc = BootableDiskCreator()
+        bdc.verbose = False
+        bdc.raw = True
+        bdc.verify = True
+        bdc.iso = iso
+        bdc.device = device
+        bdc.main()
+        self.assertEqual(bdc.mismatches, [])
+
+    def test_verify_mismatch_exit(self):
+        """tests that a corrupt write fails the job and exits non-zero"""
+        iso = os.path.join(self.tmp.name, 'image.iso')
+        device = os.path.join(self.tmp.name, 'sdb')
+        with open(iso, 'wb') as f:
+            f.write(os.urandom(100000))
+        with open(device, 'wb') as f:
+            f.write(bytes(200000))
+        bdc = BootableDiskCreator()
+        bdc.verbose = False
+        bdc.raw = True
+        bdc.verify = True
+        bdc.iso = iso
+        bdc.device = device
+        bdc.hashes = {'': '0' * 64}
+        with mock.patch.object(bdc, 'writeImage'), \
+             mock.patch('bdc.bootableDiskCreator.stderr', new_callable=StringIO):
+            bdc.streamSize = 100000
+            bdc.main()
+            with self.assertRaises(SystemExit) as exit:
+                bdc.wait()
+        self.assertEqual(bdc.mismatches, [(device, '', 'hash mismatch')])
+        self.assertIsInstance(bdc.error, JobError)
+        self.assertNotEqual(exit.exception.code, 0)
+
+class ManifestTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create temporary source and target directories before each test"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, 'iso')
+        self.target = os.path.join(self.tmp.name, 'target')
+        os.mkdir(self.target)
+        self.files = {'EFI/BOOT/BOOTX64.EFI': 3000, 'casper/vmlinuz': 200000,
+                      'casper/initrd': 5000, 'md5sum.txt': 10}
+        createTree(self.source, self.files)
+
+    def tearDown(self):
+        """function to remove temporary directory after test finishes"""
+        self.tmp.cleanup()
+
+    def flash(self, verify=False):
+        """copies the source tree onto the target like main does and returns the creator"""
+        bdc = BootableDiskCreator()
+        bdc.verbose = False
+        bdc.verify = verify
+        bdc.isoMount = self.source
+        bdc.target = self.target
+        bdc.devices = ['/dev/sdb1']
+        bdc.planCopy()
+        previous = Manifest.load(self.target)
+        if previous is not None:
+            bdc.planIncremental(previous)
+        bdc.copyImage()
+        bdc.writeManifest()
+        return bdc
+
+    def test_manifest(self):
+        """tests that manifests round trip and invalid ones are ignored"""
+        self.assertIsNone(Manifest.load(self.target))
+        manifest = Manifest(image='image.iso')
+        manifest.add('md5sum.txt', 10, 1000, 'abc')
+        manifest.save(self.target)
+        loaded = Manifest.load(self.target)
+        self.assertEqual(loaded.image, 'image.iso')
+        self.assertEqual(loaded.files, {'md5sum.txt': {'size': 10, 'mtime': 1000, 'hash': 'abc'}})
+        self.assertFalse(loaded.unchanged(self.target, 'md5sum.txt', 10, 1000))
+
+        with open(Manifest.path(self.target), 'w') as f:
+            f.write('{"version": 1, "files":')
+        self.assertIsNone(Manifest.load(self.target))
+
+    def test_hostile_manifest(self):
+        """tests that manifests listing paths outside the partition are refused"""
+        victim = os.path.join(self.tmp.name, 'victim')
+        with open(victim, 'w') as f:
+            f.write('keep me')
+        os.symlink(self.tmp.name, os.path.join(self.target, 'escape'))
+        for files in (['md5sum.txt'], {'md5sum.txt': 10}, {'../victim': {'size': 7}},
+                      {victim: {'size': 7}}, {'a/../../victim': {}}, {'md5\0sum.txt': {}},
+                      {'escape/victim': {}}):
+            with open(Manifest.path(self.target), 'w') as f:
+                json.dump({'version': 1, 'files': files}, f)
+            self.assertIsNone(Manifest.load(self.target), files)
+
+        self.assertEqual(Manifest({'../victim': {}}).removeStale(self.target, {}), [])
+        self.assertTrue(os.path.exists(victim))
+
+    def test_incremental(self):
+        """tests that only changed files are copied and removed files are deleted"""
+        bdc = self.flash()
+        self.assertEqual(sorted(Manifest.load(self.target).files), sorted(self.files))
+
+        # same size and mtime, so the target copy must be left alone
+        with open(os.path.join(self.target, 'md5sum.txt'), 'wb') as f:
+            f.write(b'untouched!')
+        with open(os.path.join(self.source, 'casper/vmlinuz'), 'wb') as f:
+            f.write(os.urandom(1000))
+        shutil.rmtree(os.path.join(self.source, 'EFI'))
+        createTree(self.source, {'boot/grub/grub.cfg': 50})
+
+        bdc = self.flash()
+        self.assertEqual(bdc.totalBytes, 1050)
+        self.assertEqual(bdc.totalBytesWritten, 1050)
+        self.assertFalse(os.path.exists(os.path.join(self.target, 'EFI')))
+        with open(os.path.join(self.target, 'md5sum.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'untouched!')
+        for relPath in ('casper/vmlinuz', 'casper/initrd', 'boot/grub/grub.cfg'):
+            with open(os.path.join(self.source, relPath), 'rb') as src, \
+                 open(os.path.join(self.target, relPath), 'rb') as dst:
+                self.assertEqual(src.read(), dst.read())
+        self.assertEqual(sorted(Manifest.load(self.target).files),
+                         ['boot/grub/grub.cfg', 'casper/initrd', 'casper/vmlinuz', 'md5sum.txt'])
+
+    def test_interrupted(self):
+        """tests that an interrupted update leaves no manifest so the next run copies everything"""
+        self.flash()
+        with open(os.path.join(self.source, 'casper/vmlinuz'), 'wb') as f:
+            f.write(os.urandom(200000))
+        with open(os.path.join(self.target, 'casper/vmlinuz'), 'r+b') as f:
+            f.write(b'partly updated')
+        os.utime(os.path.join(self.source, 'casper/vmlinuz'), (0, 0))
+        with mock.patch.object(CopyEngine, 'copyFile', side_effect=OSError(errno.EIO, 'I/O')):
+            with self.assertRaises(OSError):
+                self.flash()
+        self.assertIsNone(Manifest.load(self.target))
+
+        bdc = self.flash()
+        self.assertEqual(bdc.totalBytes, sum(self.files.values()))
+        for relPath in self.files:
+            with open(os.path.join(self.source, relPath), 'rb') as src, \
+                 open(os.path.join(self.target, relPath), 'rb') as dst:
+                self.assertEqual(src.read(), dst.read())
+        self.assertEqual(sorted(Manifest.load(self.target).files), sorted(self.files))
+
+    def test_incremental_hash(self):
+        """tests that a file changed without changing size or mtime is caught by its hash"""
+        self.flash(verify=True)
+        self.assertIn('hash', Manifest.load(self.target).files['md5sum.txt'])
+
+        path = os.path.join(self.source, 'md5sum.txt')
+        stats = os.stat(path)
+        with open(path, 'wb') as f:
+            f.write(b'0123456789')
+        os.utime(path, (stats.st_atime, stats.st_mtime))
+
+        bdc = self.flash(verify=True)
+        self.assertEqual(bdc.totalBytes, 10)
+        self.assertEqual(bdc.mismatches, [])
+        with open(os.path.join(self.target, 'md5sum.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'0123456789')
+
+    def test_mount_existing(self):
+        """tests that partitions without a FAT32 file system are formatted"""
+        bdc = BootableDiskCreator()
+        bdc.verbose = False
+        bdc.mounts = FakeMounts()
+        bdc.device = os.path.join(self.tmp.name, 'sdb1')
+        bdc.target = self.target
+        with open(bdc.device, 'wb') as f:
+            f.write(bytes(1024))
+        self.assertIsNone(bdc.mountExisting())
+        self.assertEqual(bdc.mounts.calls, [])
+
+        with open(bdc.device, 'r+b') as f:
+            f.seek(82)
+            f.write(b'FAT32   ')
+            f.seek(510)
+            f.write(b'\x55\xaa')
+        self.assertIsNone(bdc.mountExisting())
+        self.assertEqual(bdc.mounts.calls, [('mount', bdc.device, self.target),
+                                            ('unmount', self.target)])
+
+        Manifest().save(self.target)
+        self.assertIsNotNone(bdc.mountExisting())
+        self.assertEqual(len(bdc.mounts.calls), 3)
+
+class ImageCacheTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create temporary image and cache directory before each test"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.iso = os.path.join(self.tmp.name, 'image.iso')
+        self.files = {'EFI/BOOT/BOOTX64.EFI': os.urandom(3000), 'README.txt': b'hello'}
+        buildIso(self.iso, self.files, rockRidge=True)
+        self.cache = ImageCache(os.path.join(self.tmp.name, 'cache'))
+
+    def tearDown(self):
+        """function to remove temporary directory after test finishes"""
+        self.tmp.cleanup()
+
+    def flash(self, target):
+        """copies the image onto target with verification like main does"""
+        os.makedirs(target)
+        bdc = BootableDiskCreator()
+        bdc.verbose = False
+        bdc.verify = True
+        bdc.iso = self.iso
+        bdc.target = target
+        bdc.devices = ['/dev/sdb1']
+        bdc.cache = self.cache
+        bdc.loadCache()
+        bdc.reader = bdc.openImage()
+        bdc.planCopy()
+        bdc.copyImage()
+        bdc.reader.close()
+        bdc.verifyImage()
+        bdc.saveCache()
+        return bdc
+
+    def test_cache(self):
+        """tests that entries are keyed by image identity and evicted least recently used first"""
+        self.assertIsNone(self.cache.get(self.iso))
+        self.assertTrue(self.cache.put(self.iso, {'hashes': {}}))
+        self.assertEqual(self.cache.get(self.iso)['hashes'], {})
+
+        other = os.path.join(self.tmp.name, 'other.iso')
+        shutil.copy(self.iso, other)
+        self.assertIsNone(self.cache.get(other))
+        self.cache.put(other, {'files': [['a' * 100, 1, 0, []]]})
+
+        stats = os.stat(self.iso)
+        os.utime(self.iso, ns=(stats.st_atime_ns, stats.st_mtime_ns + 1))
+        self.assertIsNone(self.cache.get(self.iso))
+
+        # the entry that wasn't used for the longest time goes first
+        entries = sorted(os.listdir(self.cache.directory))
+        for age, name in enumerate(entries):
+            os.utime(os.path.join(self.cache.directory, name), (1000 + age, 1000 + age))
+        newest = os.path.getsize(os.path.join(self.cache.directory, entries[-1]))
+        self.cache.maxBytes = newest
+        self.cache.evict()
+        self.assertEqual(os.listdir(self.cache.directory), entries[-1:])
+
+        self.assertFalse(ImageCache(os.path.join(self.iso, 'cache')).put(self.iso, {}))
+
+    def test_concurrent_eviction(self):
+        """tests that entries removed by another job while evicting are skipped"""
+        self.cache.put(self.iso, {'hashes': {}})
+        other = os.path.join(self.tmp.name, 'other.iso')
+        shutil.copy(self.iso, other)
+        self.cache.put(other, {'hashes': {}})
+        self.cache.maxBytes = 0
+
+        remove = os.remove
+        def removeTwice(path):
+            remove(path)
+            remove(path)
+        with mock.patch('os.remove', side_effect=removeTwice):
+            self.cache.evict()
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+        gone = mock.Mock(path=os.path.join(self.cache.directory, 'gone.json'))
+        gone.name = 'gone.json'
+        gone.is_file.return_value = True
+        gone.stat.side_effect = FileNotFoundError
+        with mock.patch('os.scandir') as mockScandir:
+            mockScandir.return_value.__enter__.return_value = [gone]
+            self.cache.evict()
+        gone.stat.assert_called_once_with()
+
+    def test_cached_copy(self):
+        """tests that a cached image is neither parsed nor hashed again"""
+        first = self.flash(os.path.join(self.tmp.name, 'first'))
+        self.assertEqual(first.mismatches, [])
+        self.assertEqual(sorted(self.cache.get(self.iso)['hashes']['sha256']), sorted(self.files))
+
+        with mock.patch('bdc.isoReader.IsoReader.readTree') as mockTree, \
+             mock.patch('bdc.copyEngine.CopyEngine.buildWorkList') as mockBuild, \
+             mock.patch('bdc.copyEngine.hashlib') as mockHash:
+            second = self.flash(os.path.join(self.tmp.name, 'second'))
+        mockTree.assert_not_called()
+        mockBuild.assert_not_called()
+        mockHash.new.assert_not_called()
+        self.assertEqual(second.mismatches, [])
+        self.assertEqual(second.hashes, first.hashes)
+        for relPath, data in self.files.items():
+            with open(os.path.join(self.tmp.name, 'second', relPath), 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+class BlockTopologyTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create temporary directory for the fake sysfs tree before each test"""
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        """function to remove temporary directory after test finishes"""
+        self.tmp.cleanup()
+
+    def test_topology(self):
+        """tests that disks, partitions, sizes and mount points are indexed"""
+        topology = fakeTopology(self.tmp.name, ('nvme0n1p1,/boot/efi\nnvme0n1p2,/\n'
+                                                'mmcblk0p1,/media/SD CARD\nsdb1,'),
+                                sizes={'sdb1': 8})
+        partitions = topology.getPartitions()
+        self.assertEqual(sorted(partitions), ['/dev/mmcblk0p1', '/dev/nvme0n1p1',
+                                              '/dev/nvme0n1p2', '/dev/sdb1'])
+        self.assertEqual(partitions['/dev/mmcblk0p1'].mountpoint(), '/media/SD CARD')
+        self.assertEqual(partitions['/dev/sdb1'].mountpoint(), '')
+        self.assertEqual(partitions['/dev/sdb1'].size, 4096)
+        self.assertEqual(topology.diskOf('/dev/nvme0n1p2'), '/dev/nvme0n1')
+        self.assertEqual([p.path for p in topology.partitionsOf('/dev/nvme0n1')],
+                         ['/dev/nvme0n1p1', '/dev/nvme0n1p2'])
+        self.assertEqual(topology.systemDisks(), {'/dev/nvme0n1'})
+
+    def test_anonymous_device_numbers(self):
+        """tests that btrfs mounts with anonymous device numbers are found by their source"""
+        topology = fakeTopology(self.tmp.name, 'nvme0n1p1,/boot/efi\nnvme0n1p2,\nsdb1,')
+        with open(topology.mountinfo, 'a') as f:
+            f.write('40 1 0:33 /@ / rw,relatime shared:1 - btrfs /dev/nvme0n1p2 rw\n'
+                    '41 40 0:33 /@home /home rw,relatime shared:2 - btrfs /dev/nvme0n1p2 rw\n'
+                    '42 1 0:34 / /mnt/my\\040stick rw - btrfs /dev/sdb1 rw\n'
+                    '43 1 0:35 / /tmp rw - tmpfs tmpfs rw\n')
+        partitions = topology.getPartitions()
+        self.assertEqual(partitions['/dev/nvme0n1p2'].mountpoints, ['/', '/home'])
+        self.assertEqual(partitions['/dev/sdb1'].mountpoint(), '/mnt/my stick')
+        self.assertEqual(topology.systemDisks(), {'/dev/nvme0n1'})
+
+    def test_cache(self):
+        """tests that the index is only rebuilt once devices or mounts change"""
+        topology = fakeTopology(self.tmp.name, 'sdb1,')
+        partitions = topology.getPartitions()
+        self.assertIs(topology.getPartitions(), partitions)
+
+        fakeTopology(self.tmp.name, 'sdb1,/mnt/target')
+        self.assertEqual(topology.getPartitions()['/dev/sdb1'].mountpoint(), '/mnt/target')
+
+        partitions = topology.getPartitions()
+        topology.invalidate()
+        self.assertIsNot(topology.getPartitions(), partitions)
+
+class CopyEngineTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create temporary source and target directories before each test"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, 'iso')
+        self.target = os.path.join(self.tmp.name, 'target')
+        os.mkdir(self.source)
+        os.mkdir(self.target)
+        self.files = {'EFI/BOOT/BOOTX64.EFI': 3000, 'casper/filesystem.squashfs': 300000,
+                      'pool/main/a/a.deb': 10, 'pool/main/b/b.deb': 0, 'md5sum.txt': 100}
+        createTree(self.source, self.files)
+        os.makedirs(os.path.join(self.source, 'empty', 'dir'))
+        os.symlink('md5sum.txt', os.path.join(self.source, 'link'))
+
+    def tearDown(self):
+        """function to remove temporary directories after test finishes"""
+        self.tmp.cleanup()
+
+    def assertTreeCopied(self):
+        """asserts every file was copied to the target and symlinks were skipped"""
+        for relPath in self.files:
+            with open(os.path.join(self.source, relPath), 'rb') as src, \
+                 open(os.path.join(self.target, relPath), 'rb') as dst:
+                self.assertEqual(src.read(), dst.read())
+        self.assertTrue(os.path.isdir(os.path.join(self.target, 'empty', 'dir')))
+        self.assertFalse(os.path.lexists(os.path.join(self.target, 'link')))
+
+    def test_build_work_list(self):
+        """tests that the work list covers the whole tree and splits files by size"""
+        engine = CopyEngine(self.source, self.target, largeFileSize=1000)
+        engine.buildWorkList()
+        self.assertEqual(engine.totalBytes, sum(self.files.values()))
+        self.assertEqual(engine.totalFiles, len(self.files))
+        self.assertEqual([entry[0] for entry in engine.largeFiles],
+                         ['casper/filesystem.squashfs', 'EFI/BOOT/BOOTX64.EFI'])
+        self.assertIn(os.path.join('empty', 'dir'), engine.directories)
+
+    def test_parallel_copy(self):
+        """tests that all workers together report every byte exactly once"""
+        written = []
+        lock = threading.Lock()
+        def callback(n):
+            with lock:
+                written.append(n)
+        engine = CopyEngine(self.source, self.target, callback, workers=8, largeFileSize=1000)
+        engine.run()
+        self.assertEqual(sum(written), sum(self.files.values()))
+        self.assertTreeCopied()
+
+    def test_worker_error(self):
+        """tests that an error raised by a worker is raised by run"""
+        engine = CopyEngine(self.source, self.target, workers=2)
+        engine.buildWorkList()
+        os.remove(os.path.join(self.source, 'md5sum.txt'))
+        with self.assertRaises(FileNotFoundError):
+            engine.run()
+
+    def test_userspace_fallback(self):
+        """tests that files are copied in userspace when no kernel copy is available"""
+        written = []
+        engine = CopyEngine(self.source, self.target, written.append, workers=1)
+        engine.strategies = []
+        engine.bufferSize = 1000
+        engine.progressInterval = 1024**2
+        engine.run()
+        self.assertEqual(sum(written), sum(self.files.values()))
+        self.assertEqual(sorted(written), [10, 100, 3000, 300000])
+        self.assertTreeCopied()
+
+    @mock.patch('shutil.copymode')
+    def test_small_file_batches(self, mockCopymode):
+        """tests that small files are batched by directory with progress once per batch"""
+        files = {'pool/main/{0}.deb'.format(i): 100 + i for i in range(5)}
+        files.update({'dists/Release': 50, 'dists/InRelease': 60})
+        createTree(self.source, files)
+        self.files.update(files)
+        written = []
+        copied = []
+        engine = CopyEngine(self.source, self.target, written.append, workers=1,
+                            algorithm='sha256', writeWindow=(64*1024**2),
+                            fileCallback=lambda *args: copied.append(args))
+        engine.batchFiles = 3
+        engine.buildWorkList()
+        batches = [[entry[0] for entry in batch] for batch in engine.batches]
+        self.assertIn(['pool/main/0.deb', 'pool/main/1.deb', 'pool/main/2.deb'], batches)
+        self.assertIn(['pool/main/3.deb', 'pool/main/4.deb'], batches)
+        self.assertIn(['dists/InRelease', 'dists/Release'], batches)
+        self.assertEqual(engine.totalFiles, len(self.files))
+
+        engine.run()
+        self.assertIn(sum(size for name, size in files.items() if name.startswith('pool/')
+                          and name < 'pool/main/3'), written)
+        self.assertEqual(sum(written), sum(self.files.values()))
+        self.assertEqual(len(engine.hashes), len(self.files))
+        self.assertIn(('pool/main', sum(files['pool/main/{0}.deb'.format(i)] for i in range(3)),
+                       mock.ANY, 3), copied)
+        self.assertEqual(sum(args[3] for args in copied), len(self.files))
+        self.assertEqual(engine.writeBack.descriptors, set())
+        mockCopymode.assert_called_once_with(os.path.join(self.source,
+                                                          'casper/filesystem.squashfs'),
+                                             os.path.join(self.target,
+                                                          'casper/filesystem.squashfs'))
+        self.assertTreeCopied()
+
+    def test_batch_committed(self):
+        """tests that a batch is only reported once every one of its files is on the device"""
+        files = {'pool/main/{0}.deb'.format(i): 100 + i for i in range(5)}
+        createTree(self.source, files)
+        self.files.update(files)
+        settled = []
+        reported = []
+        engine = CopyEngine(self.source, self.target, lambda n: reported.append((n, len(settled))),
+                            workers=1, writeWindow=(64*1024**2))
+        engine.batchDescriptors = 2
+        settle = engine.writeBack.settle
+        def record(fd, length, offset=0):
+            settled.append(length)
+            settle(fd, length, offset)
+        engine.writeBack.settle = record
+        engine.buildWorkList()
+        batch = [entry for entry in engine.batches if entry[0][0].startswith('pool/main/')][0]
+        os.makedirs(os.path.join(self.target, 'pool', 'main'))
+        engine.copyBatch(batch)
+
+        self.assertEqual(sorted(settled), sorted(size for relPath, size in batch))
+        self.assertEqual(reported, [(sum(size for relPath, size in batch), len(batch))])
+
+    @mock.patch('os.copy_file_range', create=True)
+    def test_kernel_copy_fallback(self, mockCopyRange):
+        """tests that an unsupported copy_file_range is disabled in favour of sendfile"""
+        mockCopyRange.side_effect = OSError(18, 'Invalid cross-device link')
+        engine = CopyEngine(self.source, self.target, workers=2)
+        engine.strategies = ['copy_file_range', 'sendfile']
+        engine.run()
+        self.assertEqual(engine.strategies, ['sendfile'])
+        self.assertTreeCopied()
+
+    def test_plan_copy(self):
+        """tests that the size comes from the work list walk and the list is reused"""
+        bdc = BootableDiskCreator()
+        bdc.verbose = False
+        bdc.isoMount = self.source
+        bdc.target = self.target
+        bdc.planCopy()
+        self.assertEqual(bdc.totalBytes, sum(self.files.values()))
+        createTree(self.source, {'late.txt': 10})
+        bdc.copyImage()
+        self.assertEqual(bdc.totalBytesWritten, bdc.totalBytes)
+        self.assertFalse(os.path.exists(os.path.join(self.target, 'late.txt')))
+        self.assertTreeCopied()
+
+    def test_copy_image(self):
+        """tests that BootableDiskCreator.copyImage copies the tree with progress"""
+        bdc = BootableDiskCreator()
+        bdc.verbose = False
+        bdc.isoMount = self.source
+        bdc.target = self.target
+        bdc.totalBytes = sum(self.files.values())
+        bdc.copyImage()
+        self.assertEqual(bdc.totalBytesWritten, bdc.totalBytes)
+        self.assertAlmostEqual(bdc.copyProgress, 100.0)
+        self.assertTreeCopied()
+
+class EventBufferTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create new EventBuffer object before each test"""
+        self.obj = EventBuffer(capacity=4, progressRate=1000000.0)
+
+    def tearDown(self):
+        """function to delete EventBuffer object after test finishes"""
+        del self.obj
+
+    def test_render(self):
+        """tests that events are rendered as the same log text StringBuffer used to hold"""
+        self.obj = EventBuffer()
+        self.obj.stageStart('mounting image...')
+        self.obj.stageEnd()
+        self.obj.progress(50, 200)
+        self.obj.fileDone('casper/vmlinuz', 50)
+        self.obj.error('Error: fail')
+        self.assertEqual(self.obj.read(), ('mounting image...done\ncopying image... 25.00%\n'
+                                           'Error: fail\n'))
+        self.assertEqual(self.obj.read(), '')
+
+    def test_progress_coalesced(self):
+        """tests that unread progress updates are merged into a single event"""
+        for i in range(1, 101):
+            self.obj.progress(i, 100)
+        self.assertEqual(self.obj.events(), [(BYTES_COPIED, 100, 100, '', 0)])
+
+    def test_progress_rate(self):
+        """tests that progress is held back by the rate limit without losing the last value"""
+        self.obj.progressRate = 0.001
+        self.obj.progress(1, 100)
+        self.obj.read()
+        self.obj.progress(2, 100)
+        self.obj.progress(3, 100)
+        self.assertEqual(self.obj.head, 1)
+        self.obj.stageStart('unmounting image...')
+        self.assertEqual(self.obj.events(), [(BYTES_COPIED, 3, 100, '', 0),
+                                             (STAGE_START, 0, 0, 'unmounting image...', 0)])
+
+    def test_bounded(self):
+        """tests that the oldest events are overwritten once the buffer is full"""
+        for i in range(6):
+            self.obj.stageStart(str(i))
+        self.assertEqual(self.obj.dropped, 2)
+        self.assertEqual([event[3] for event in self.obj.events()], ['2', '3', '4', '5'])
+        self.assertEqual(len(self.obj.kinds), 4)
+
+    def test_listener(self):
+        """tests that the listener is told about every stored or updated event"""
+        kinds = []
+        self.obj.listener = kinds.append
+        self.obj.stageStart('mounting image...')
+        self.obj.progress(1, 100)
+        self.obj.progress(2, 100)
+        self.obj.error('Error: fail')
+        self.assertEqual(kinds, [STAGE_START, BYTES_COPIED, BYTES_COPIED, ERROR])
+
+    def test_files_counted(self):
+        """tests that copied files are carried by progress events and never evict anything"""
+        kinds = []
+        self.obj.listener = kinds.append
+        self.obj.stageStart('copying image...')
+        self.obj.progress(0, 5000)
+        for i in range(5000):
+            self.obj.fileDone(str(i), 1)
+            self.obj.progress(i + 1, 5000)
+        for i in range(10):
+            self.obj.progressRate = 0.001
+            self.obj.progress(5000, 5000)
+        self.obj.error('Error: fail')
+        self.assertEqual(self.obj.dropped, 0)
+        self.assertEqual(kinds.count(STAGE_START) + kinds.count(ERROR), 2)
+        self.assertEqual(self.obj.events(), [(STAGE_START, 0, 0, 'copying image...', 0),
+                                             (BYTES_COPIED, 5000, 5000, '', 5000),
+                                             (ERROR, 0, 0, 'Error: fail', 5000)])
+
+class IsoReaderTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create temporary directory and image contents before each test"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.iso = os.path.join(self.tmp.name, 'image.iso')
+        self.files = {'EFI/BOOT/BOOTx64.efi': os.urandom(3000), 'README.txt': b'hello',
+                      'casper/vmlinuz': os.urandom(5000), 'empty.cfg': b''}
+
+    def tearDown(self):
+        """function to remove temporary directory after test finishes"""
+        self.tmp.cleanup()
+
+    def readAll(self, reader):
+        """returns dictionary of relative paths and contents read through reader"""
+        contents = {}
+        for entry in reader.files():
+            data = bytearray()
+            reader.copyFile(entry, MagicMock(write=data.extend), length=1000)
+            contents[entry.path] = bytes(data)
+        return contents
+
+    def test_plain_iso9660(self):
+        """tests that plain ISO9660 names are mapped to lower case like the kernel does"""
+        buildIso(self.iso, self.files)
+        with IsoReader(self.iso) as reader:
+            self.assertFalse(reader.rockRidge or reader.joliet)
+            self.assertEqual(reader.totalBytes, 8005)
+            self.assertEqual(sorted(reader.directories()), ['casper', 'efi', 'efi/boot'])
+            self.assertEqual(self.readAll(reader),
+                             {key.lower(): value for key, value in self.files.items()})
+
+    def test_rock_ridge(self):
+        """tests that Rock Ridge names are used and symlinks are skipped"""
+        buildIso(self.iso, self.files, rockRidge=True, joliet=True, symlinks=['casper/link'])
+        with IsoReader(self.iso) as reader:
+            self.assertTrue(reader.rockRidge)
+            self.assertEqual(sorted(reader.directories()), ['EFI', 'EFI/BOOT', 'casper'])
+            self.assertEqual(self.readAll(reader), self.files)
+
+    def test_joliet(self):
+        """tests that Joliet names are used when there is no Rock Ridge"""
+        buildIso(self.iso, self.files, joliet=True)
+        with IsoReader(self.iso) as reader:
+            self.assertTrue(reader.joliet)
+            self.assertEqual(self.readAll(reader), self.files)
+
+    def test_not_an_iso(self):
+        """tests that files that aren't ISO9660 images or carry UDF are rejected"""
+        with open(self.iso, 'wb') as f:
+            f.write(bytes(20 * 2048))
+        with self.assertRaises(IsoError):
+            IsoReader(self.iso).open()
+
+        buildIso(self.iso, self.files, udf=True)
+        with self.assertRaises(IsoError):
+            IsoReader(self.iso).open()
+
+    def test_corrupt(self):
+        """tests that truncated images and continuation loops raise IsoError"""
+        buildIso(self.iso, self.files, rockRidge=True)
+        with open(self.iso, 'r+b') as f:
+            f.truncate(18 * 2048)
+        with self.assertRaises(IsoError):
+            IsoReader(self.iso).open()
+
+        name = 'a_very_long_file_name.tx'
+        buildIso(self.iso, {name: b'hello'}, rockRidge=True)
+        with open(self.iso, 'r+b') as f:
+            image = f.read()
+            offset = image.index(b'NM' + bytes([5 + len(name)]))
+            f.seek(offset)
+            f.write(b'CE\x1c\x01' + bothEndian(offset // 2048, 4) +
+                    bothEndian(offset % 2048, 4) + bothEndian(28, 4))
+        with self.assertRaises(IsoError):
+            IsoReader(self.iso).open()
+
+    def test_record_time(self):
+        """tests that recording dates are converted to UTC and unset dates are 0"""
+        self.assertEqual(DirectoryRecord.recordTime(bytes([126, 10, 18, 12, 30, 0, 4])),
+                         1792326600 - 3600)
+        self.assertEqual(DirectoryRecord.recordTime(bytes(7)), 0)
+
+    def test_copy_from_image(self):
+        """tests that BootableDiskCreator copies files straight out of the image"""
+        buildIso(self.iso, self.files, rockRidge=True)
+        target = os.path.join(self.tmp.name, 'target')
+        os.mkdir(target)
+        bdc = BootableDiskCreator()
+        bdc.verbose = False
+        bdc.iso = self.iso
+        bdc.target = target
+        bdc.reader = bdc.openImage()
+        bdc.totalBytes = bdc.reader.totalBytes
+        bdc.copyImage()
+        bdc.reader.close()
+        self.assertEqual(bdc.totalBytesWritten, 8005)
+        for relPath, data in self.files.items():
+            with open(os.path.join(target, relPath), 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+class FatImageTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create temporary partition image before each test"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.partition = os.path.join(self.tmp.name, 'sdb1')
+        with open(self.partition, 'wb') as f:
+            f.truncate(40 * 1024**2)
+        self.files = {'EFI/BOOT/BOOTX64.EFI': os.urandom(3000), 'casper/vmlinuz': b'k' * 513,
+                      'casper/filesystem.squashfs': os.urandom(100000), 'empty': b'',
+                      'LongFileName1.txt': b'1', 'LongFileName2.txt': b'2',
+                      'caf\u00e9 menu.cfg': b'c', 'a' * 200: b'a'}
+
+    def tearDown(self):
+        """function to remove temporary directory after test finishes"""
+        self.tmp.cleanup()
+
+    def test_build_image(self):
+        """tests that the file system holds every file and directory and passes the checks"""
+        builder = FatImageBuilder(40 * 1024**2, ['EFI', 'EFI/BOOT', 'casper', 'boot/grub'],
+                                  [(relPath, len(data), 1500000000)
+                                   for relPath, data in self.files.items()])
+        written = []
+        with open(self.partition, 'r+b') as f:
+            builder.write(f, lambda relPath: [self.files[relPath]], written.append)
+        self.assertEqual(sum(written), sum(len(data) for data in self.files.values()))
+        self.assertLess(builder.bytesWritten, 2 * 1024**2)
+
+        files, directories = readFat32(self.partition)
+        self.assertEqual(files, self.files)
+        self.assertEqual(sorted(directories), ['EFI', 'EFI/BOOT', 'boot', 'boot/grub', 'casper'])
+
+    @skipUnless(shutil.which('fsck.fat'), 'fsck.fat is not installed')
+    def test_fsck(self):
+        """tests that fsck.fat finds nothing to fix"""
+        builder = FatImageBuilder(40 * 1024**2, [], [(relPath, len(data), 1500000000)
+                                                     for relPath, data in self.files.items()])
+        with open(self.partition, 'r+b') as f:
+            builder.write(f, lambda relPath: [self.files[relPath]])
+        process = Popen(['fsck.fat', '-n', self.partition], stdout=PIPE, stderr=PIPE)
+        process.communicate()
+        self.assertEqual(process.returncode, 0)
+
+    def test_short_names(self):
+        """tests that short names follow the Windows rules"""
+        builder = FatImageBuilder(40 * 1024**2, [], [])
+        used = set()
+        self.assertEqual(builder.shortName('BOOTX64.EFI', used), (b'BOOTX64 EFI', False))
+        self.assertEqual(builder.shortName('vmlinuz', used), (b'VMLINUZ    ', True))
+        self.assertEqual(builder.shortName('filesystem.squashfs', used), (b'FILESY~1SQU', True))
+        used.add(b'FILESY~1SQU')
+        self.assertEqual(builder.shortName('filesystem.squashfs', used), (b'FILESY~2SQU', True))
+        self.assertEqual(builder.shortName('.disk', used), (b'DISK~1     ', True))
+        self.assertEqual(builder.shortName('md5 sum+.txt', used), (b'MD5SUM~1TXT', True))
+
+    def test_does_not_fit(self):
+        """tests that partitions too small for FAT32 or for the files are rejected"""
+        with self.assertRaises(FatError):
+            FatImageBuilder(16 * 1024**2, [], [])
+        with self.assertRaises(FatError):
+            FatImageBuilder(40 * 1024**2, [], [('big', 50 * 1024**2, 0)])
+        with self.assertRaises(FatError):
+            FatImageBuilder(40 * 1024**2, [], [('huge', 5 * 1024**3, 0)])
+
+    def test_build_fs(self):
+        """tests that BootableDiskCreator streams the image into a file system and verifies it"""
+        iso = os.path.join(self.tmp.name, 'image.iso')
+        buildIso(iso, {'EFI/BOOT/BOOTX64.EFI': self.files['EFI/BOOT/BOOTX64.EFI'],
+                       'README.txt': b'hello'}, rockRidge=True)
+        bdc = BootableDiskCreator()
+        bdc.verbose = False
+        bdc.verify = True
+        bdc.buildFs = True
+        bdc.iso = iso
+        bdc.device = self.partition
+        bdc.devices = [self.partition]
+        bdc.topology = fakeTopology(self.tmp.name, 'sda1,/')
+        bdc.reader = bdc.openImage()
+        bdc.planCopy()
+        bdc.buildImage()
+        bdc.reader.close()
+        bdc.verifyImage()
+        self.assertEqual(bdc.mismatches, [])
+        self.assertEqual(bdc.totalBytesWritten, bdc.totalBytes)
+
+        files, directories = readFat32(self.partition)
+        self.assertEqual(files['README.txt'], b'hello')
+        manifest = json.loads(files[MANIFEST_NAME].decode())
+        self.assertEqual(sorted(manifest['files']), ['EFI/BOOT/BOOTX64.EFI', 'README.txt'])
+
+        with open(self.partition, 'r+b') as f:
+            f.seek(100)
+            f.write(b'x')
+        with mock.patch('bdc.bootableDiskCreator.stderr', new_callable=StringIO):
+            with self.assertRaises(JobError):
+                bdc.verifyImage()
+        self.assertEqual(bdc.mismatches, [(self.partition, '', 'hash mismatch')])
+
+class JobEngineTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create job engine and list of calls before each test"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = JobEngine(workers=2)
+        self.calls = []
+
+    def tearDown(self):
+        """function to remove temporary directory after test finishes"""
+        self.tmp.cleanup()
+
+    def record(self, call):
+        """returns function that appends call to the list of calls"""
+        return lambda: self.calls.append(call)
+
+    def failStage(self):
+        """stage that fails"""
+        raise JobError('format failed')
+
+    def test_rollback(self):
+        """tests that a failing stage rolls back every started stage in reverse order"""
+        errors = []
+        job = Job([Stage('mount', self.record('mount'), self.record('unmount')),
+                   Stage('size', self.record('size')),
+                   Stage('format', self.failStage, self.record('unformat')),
+                   Stage('copy', self.record('copy'), self.record('uncopy'))],
+                  callback=errors.append)
+        with self.assertRaises(JobError):
+            self.engine.run(job)
+        self.assertEqual(self.calls, ['mount', 'size', 'unformat', 'unmount'])
+        self.assertEqual(job.state, 'failed')
+        self.assertEqual(str(errors[0]), 'format failed')
+        self.assertTrue(job.finished.is_set())
+
+    def test_timeout(self):
+        """tests that a stage running past its timeout is interrupted and rolled back"""
+        stop = threading.Event()
+        job = Job([Stage('copy', stop.wait, self.record('rollback'), stop.set, timeout=0.05)])
+        with self.assertRaises(JobError) as err:
+            self.engine.run(job)
+        self.assertEqual(str(err.exception), 'copy timed out after 0.05 seconds')
+        self.assertEqual(self.calls, ['rollback'])
+
+    def test_cancel(self):
+        """tests that a job submitted to the engine can be cancelled while a stage runs"""
+        started = threading.Event()
+        stop = threading.Event()
+        def copy():
+            started.set()
+            stop.wait()
+        job = Job([Stage('mount', self.record('mount'), self.record('unmount')),
+                   Stage('copy', copy, cancel=stop.set),
+                   Stage('cleanup', self.record('cleanup'))])
+        future = self.engine.submit(job)
+        self.assertTrue(started.wait(5))
+        job.cancel()
+        self.assertIsInstance(future.exception(5), JobCancelled)
+        self.assertEqual(self.calls, ['mount', 'unmount'])
+        self.assertEqual(job.state, 'cancelled')
+
+    @mock.patch('bdc.bootableDiskCreator.BootableDiskCreator.executeCommand')
+    def test_failed_command(self, mockExecute):
+        """tests that BootableDiskCreator records a failed command and cleans up"""
+        iso = os.path.join(self.tmp.name, 'image.iso')
+        buildIso(iso, {'README.txt': b'hello'})
+        mockExecute.side_effect = CommandError('\'mkfs.fat\' failed', 2)
+        bdc = BootableDiskCreator()
+        bdc.verbose = False
+        bdc.iso = iso
+        bdc.target = self.tmp.name
+        bdc.statsPath = os.path.join(self.tmp.name, 'stats.json')
+        bdc.statsTextfile = os.path.join(self.tmp.name, 'bdc.prom')
+        notified = []
+        bdc.listener = lambda: notified.append(bdc.done)
+        bdc.main()
+        self.assertTrue(bdc.done)
+        self.assertTrue(notified[-1])
+        self.assertIs(bdc.error, mockExecute.side_effect)
+        with open(bdc.statsPath) as f:
+            stats = json.load(f)
+        self.assertEqual(stats['state'], 'failed')
+        self.assertEqual([(stage['name'], stage['state']) for stage in stats['stages']],
+                         [('mount', 'done'), ('size', 'done'), ('format', 'failed')])
+        with open(bdc.statsTextfile) as f:
+            self.assertIn('bdc_job_success{device=""} 0.0\n', f.read())
+        self.assertIsNone(bdc.reader)
+        self.assertEqual(bdc.job.state, 'failed')
+        with self.assertRaises(SystemExit) as err:
+            bdc.wait()
+        self.assertEqual(err.exception.code, 2)
+
+class DaemonTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to start a Daemon on a temporary socket with fake jobs before each test
+
+        Jobs copy nothing, their copy stage waits until the test opens the gate of their image.
+        """
+        self.tmp = tempfile.TemporaryDirectory()
+        self.gates = {}
+        tests = self
+
+        def validateInput(bdc, args):
+            """fake validation that only rejects images called bad.iso"""
+            if args.image == 'bad.iso':
+                sys.exit('Error: image \'bad.iso\' does not exist')
+            bdc.devices = args.device
+            bdc.device = args.device[0]
+            bdc.iso = args.image
+
+        def createJob(bdc):
+            """fake job with a single stage waiting for the gate of its image"""
+            def copy():
+                bdc.stageStart('copying {0}...'.format(bdc.iso))
+                while not tests.gates[bdc.iso].wait(0.01):
+                    if bdc.interrupted.is_set():
+                        raise JobCancelled('cancelled')
+                bdc.stageEnd()
+            bdc.job = Job([Stage('copy', copy, cancel=bdc.interrupt)], bdc.iso, bdc.finish)
+            return bdc.job
+
+        for name, fake in (('validateInput', validateInput), ('createJob', createJob)):
+            patcher = mock.patch.object(BootableDiskCreator, name, autospec=True, side_effect=fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        path = os.path.join(self.tmp.name, 'bdc.sock')
+        self.obj = Daemon(path, maxJobs=2, workers=4, mountRoot=os.path.join(self.tmp.name, 'mnt'),
+                          interval=0.01)
+        self.thread = threading.Thread(target=self.obj.serve)
+        self.thread.start()
+        self.assertTrue(self.obj.ready.wait(5))
+        self.client = DaemonClient(path)
+
+    def tearDown(self):
+        """function to stop the Daemon and remove the temporary directory after test finishes"""
+        for gate in self.gates.values():
+            gate.set()
+        self.obj.stop()
+        self.thread.join(10)
+        self.assertFalse(os.path.exists(self.obj.path))
+        self.tmp.cleanup()
+
+    def submit(self, image, device):
+        """submits a job and returns its id"""
+        self.gates[image] = threading.Event()
+        response = self.client.request('submit', image=image, device=device)
+        self.assertTrue(response['ok'])
+        return response['id']
+
+    def finalState(self, jobId):
+        """waits for a job to finish and returns its last state"""
+        return list(self.client.watch(jobId))[-1]
+
+    def test_device_locking(self):
+        """tests that jobs on the same disk run one after the other and others run alongside"""
+        first = self.submit('a.iso', '/dev/sdx1')
+        second = self.submit('b.iso', ['/dev/sdx1'])
+        third = self.submit('c.iso', '/dev/sdy1')
+        states = {job['id']: job['state'] for job in self.client.request('status')['jobs']}
+        self.assertEqual(states, {first: 'running', second: 'queued', third: 'running'})
+
+        self.gates['a.iso'].set()
+        self.assertEqual(self.finalState(first)['state'], 'done')
+        self.assertEqual(self.client.request('status', id=second)['job']['state'], 'running')
+        self.gates['b.iso'].set()
+        self.gates['c.iso'].set()
+        self.assertEqual(self.finalState(second)['state'], 'done')
+        self.assertEqual(self.finalState(third)['state'], 'done')
+
+    def test_progress_and_cancel(self):
+        """tests that progress streams the log and a cancelled job is reported as cancelled"""
+        jobId = self.submit('a.iso', '/dev/sdx1')
+        queued = self.submit('b.iso', '/dev/sdx1')
+        watch = self.client.watch(jobId)
+        log = ''
+        while 'copying a.iso...' not in log:
+            log += next(watch)['log']
+        self.assertTrue(self.client.request('cancel', id=queued)['ok'])
+        self.assertTrue(self.client.request('cancel', id=jobId)['ok'])
+        states = list(watch)
+        self.assertEqual(states[-1]['state'], 'cancelled')
+        self.assertIn('cancelled, changes were rolled back', ''.join(job['log'] for job in states))
+        self.assertEqual(self.finalState(queued)['state'], 'cancelled')
+        self.assertFalse(self.client.request('cancel', id=jobId)['ok'])
+
+    def test_errors(self):
+        """tests that invalid requests and jobs that don't validate are reported"""
+        self.assertEqual(self.client.request('format')['error'], 'unknown command \'format\'')
+        self.assertEqual(self.client.request('status', id=42)['error'], 'unknown job \'42\'')
+        self.assertFalse(self.client.request('submit', image='a.iso')['ok'])
+
+        jobId = self.submit('bad.iso', '/dev/sdx1')
+        job = self.finalState(jobId)
+        self.assertEqual(job['state'], 'failed')
+        self.assertEqual(job['error'], 'Error: image \'bad.iso\' does not exist')
+
+        sock, responses = self.client.connect()
+        sock.sendall(b'not json\n')
+        self.assertFalse(json.loads(responses.readline().decode())['ok'])
+        responses.close()
+        sock.close()
+
+class MountsTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create NativeMounts with a fake C library before each test"""
+        self.libc = MagicMock()
+        self.libc.mount.return_value = 0
+        self.libc.umount2.return_value = 0
+        self.obj = NativeMounts(self.libc)
+
+    def tearDown(self):
+        """function to delete NativeMounts object after test finishes"""
+        del self.obj
+
+    def test_syscalls(self):
+        """tests that mounting and unmounting call the syscalls with raw paths"""
+        self.obj.mount('/dev/sdb1', '/mnt/my target', 'vfat')
+        self.obj.mount('/dev/loop0', '/mnt/iso', 'iso9660', readOnly=True)
+        self.obj.unmount('/mnt/my target')
+        self.assertEqual(self.libc.mount.call_args_list,
+                         [mock.call(b'/dev/sdb1', b'/mnt/my target', b'vfat', 0, None),
+                          mock.call(b'/dev/loop0', b'/mnt/iso', b'iso9660', MS_RDONLY, None)])
+        self.libc.umount2.assert_called_once_with(b'/mnt/my target', 0)
+
+        self.libc.umount2.return_value = -1
+        with mock.patch('ctypes.get_errno', return_value=errno.EBUSY):
+            with self.assertRaises(MountError) as err:
+                self.obj.unmount('/mnt/iso')
+        self.assertEqual(err.exception.code, errno.EBUSY)
+
+    @mock.patch('bdc.mounts.Popen')
+    def test_shell_fallback(self, mockPopen):
+        """tests that the programs are run without a shell where syscalls can't be used"""
+        mockPopen.return_value.communicate.return_value = (b'', b'')
+        mockPopen.return_value.returncode = 0
+        self.obj = NativeMounts(None)
+        self.obj.mount('/dev/sdb1', '/mnt/my target', 'vfat')
+        self.obj.mountImage('/tmp/my image.iso', '/mnt/iso')
+        self.obj.unmount('/mnt/iso')
+        self.assertEqual([call[0][0] for call in mockPopen.call_args_list],
+                         [['mount', '-t', 'vfat', '/dev/sdb1', '/mnt/my target'],
+                          ['mount', '-o', 'loop,ro', '/tmp/my image.iso', '/mnt/iso'],
+                          ['umount', '/mnt/iso']])
+
+        mockPopen.return_value.communicate.return_value = (b'', b'umount: /mnt/iso: busy\n')
+        mockPopen.return_value.returncode = 32
+        with self.assertRaises(MountError) as err:
+            ShellMounts().unmount('/mnt/iso')
+        self.assertEqual((str(err.exception), err.exception.code),
+                         ('umount: /mnt/iso: busy', 32))
+
+    @mock.patch('os.close')
+    @mock.patch('os.path.exists')
+    def test_mount_image(self, mockExists, mockClose):
+        """tests that every image file system type is tried on the loop device"""
+        mockExists.return_value = True
+        self.obj.attachLoop = MagicMock(return_value=('/dev/loop3', 42))
+        self.libc.mount.side_effect = [-1, 0]
+        with mock.patch('ctypes.get_errno', return_value=errno.EINVAL):
+            self.obj.mountImage('image.iso', '/mnt/iso')
+        self.assertEqual([call[0][2] for call in self.libc.mount.call_args_list],
+                         [fsType.encode() for fsType in IMAGE_TYPES])
+        mockClose.assert_called_once_with(42)
+        self.assertEqual(struct.calcsize(LOOP_INFO64), 232)
+        self.assertEqual(len(self.obj.loopInfo('image.iso', 5)), 232)
+
+class StatsTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create new Stats object before each test"""
+        self.obj = Stats('image.iso', ['/dev/sdb1', '/dev/sdc1'], slowestFiles=2)
+
+    def tearDown(self):
+        """function to delete Stats object after test finishes"""
+        del self.obj
+
+    def failStage(self):
+        """stage that fails after writing some bytes"""
+        self.obj.addBytes(10)
+        raise OSError('no space left')
+
+    def test_stages(self):
+        """tests that bytes and files are counted against the stage that was running"""
+        def copy():
+            self.obj.addBytes(300)
+            for i, seconds in enumerate((0.5, 2.0, 1.0)):
+                self.obj.fileDone('file{0}'.format(i), 100, seconds)
+
+        self.obj.timed('copy', copy)()
+        self.obj.command('unmounting...', 'umount /dev/sdb1', 0.25, 0)
+        with self.assertRaises(OSError):
+            self.obj.timed('cleanup', self.failStage)()
+        self.obj.finish(OSError('no space left'))
+
+        data = json.loads(self.obj.json())
+        self.assertEqual(data['state'], 'failed')
+        self.assertEqual((data['bytes'], data['files']), (310, 3))
+        self.assertEqual([(stage['name'], stage['state'], stage['bytes'], stage['files'])
+                          for stage in data['stages']],
+                         [('copy', 'done', 300, 3), ('cleanup', 'failed', 10, 0)])
+        self.assertEqual(data['commands'][0]['stage'], None)
+        self.assertEqual([entry['path'] for entry in data['slowestFiles']], ['file1', 'file2'])
+
+    def test_prometheus(self):
+        """tests that metrics are labelled per device and commands are summed by program"""
+        self.obj.timed('copy', lambda: self.obj.addBytes(1000))()
+        self.obj.command('mounting...', 'mount /dev/sdb1 /mnt', 1.0, 0)
+        self.obj.command('mounting...', 'mount /dev/sdc1 /mnt2', 2.0, 0)
+        self.obj.finish()
+        text = self.obj.prometheus()
+        self.assertIn('# TYPE bdc_job_duration_seconds gauge\n', text)
+        self.assertIn('bdc_job_success{device="/dev/sdc1"} 1.0\n', text)
+        # bytes of several devices are never made up without a result per device
+        self.assertIn('bdc_job_bytes{device="/dev/sdb1"} 0.0\n', text)
+        self.assertIn('bdc_command_duration_seconds{device="/dev/sdc1",command="mount"} 3.0\n',
+                      text)
+        self.assertEqual(Stats.label('a"b\\c'), 'a\\"b\\\\c')
+
+    def test_device_results(self):
+        """tests that devices written at once export what each of them got"""
+        def copy():
+            self.obj.addBytes(1500)
+            self.obj.deviceFinished('/dev/sdb1', 1000, 2.0)
+            self.obj.deviceFinished('/dev/sdc1', 500, 1.0, OSError('I/O error'))
+        with self.assertRaises(OSError):
+            self.obj.timed('copy', lambda: (copy(), self.failStage()))()
+        self.obj.finish(OSError('writing failed on /dev/sdc1'))
+
+        self.assertEqual(self.obj.data()['deviceResults']['/dev/sdc1']['error'], 'I/O error')
+        text = self.obj.prometheus()
+        self.assertIn('bdc_job_success{device="/dev/sdb1"} 1.0\n', text)
+        self.assertIn('bdc_job_success{device="/dev/sdc1"} 0.0\n', text)
+        self.assertIn('bdc_job_bytes{device="/dev/sdb1"} 1000.0\n', text)
+        self.assertIn('bdc_job_bytes{device="/dev/sdc1"} 500.0\n', text)
+        self.assertIn('bdc_job_throughput_bytes_per_second{device="/dev/sdb1"} 500.0\n', text)
+        self.assertIn('bdc_device_write_duration_seconds{device="/dev/sdc1"} 1.0\n', text)
+        self.assertIn('bdc_stage_bytes{device="/dev/sdb1",stage="copy"} 1000.0\n', text)
+
+        single = Stats('image.iso', ['/dev/sdb'])
+        single.timed('write', lambda: single.addBytes(1000))()
+        single.finish()
+        text = single.prometheus()
+        self.assertIn('bdc_job_bytes{device="/dev/sdb"} 1000.0\n', text)
+        self.assertIn('bdc_stage_bytes{device="/dev/sdb",stage="write"} 1000.0\n', text)
+        self.assertNotIn('bdc_device_write_duration_seconds', text)
+
+class WriteBackTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create a temporary file and a WriteBack with a small window"""
+        self.tmp = tempfile.mkdtemp()
+        self.file = open(os.path.join(self.tmp, 'device'), 'wb')
+        self.reported = []
+        self.obj = WriteBack(self.reported.append, window=8, chunk=4)
+
+    def tearDown(self):
+        """function to delete the temporary file and the WriteBack object"""
+        self.file.close()
+        shutil.rmtree(self.tmp)
+        del self.obj
+
+    def write(self, stream, length, progress=None):
+        """writes length bytes through stream"""
+        self.file.write(b'a' * length)
+        stream.wrote(length, progress)
+
+    def test_window(self):
+        """tests that progress is only reported once ranges are waited on"""
+        stream = self.obj.stream(self.file.fileno(), flush=self.file.flush)
+        self.write(stream, 3)
+        self.assertEqual((self.reported, self.obj.inFlightBytes), ([], 0))
+        self.write(stream, 1)
+        self.write(stream, 4)
+        self.assertEqual((self.reported, self.obj.inFlightBytes), ([], 8))
+        self.write(stream, 4, progress=2)
+        self.assertEqual((self.reported, self.obj.inFlightBytes), ([4], 8))
+        self.write(stream, 1)
+        stream.close()
+        self.obj.drain()
+        self.assertEqual(self.reported, [4, 4, 2, 1])
+        self.assertEqual((self.obj.committed, self.obj.inFlightBytes), (11, 0))
+
+    def test_fdatasync(self):
+        """tests that fdatasync is used to wait if sync_file_range isn't available"""
+        self.obj.syncFileRange = None
+        stream = self.obj.stream(self.file.fileno(), flush=self.file.flush)
+        with mock.patch('os.fdatasync') as fdatasync:
+            self.write(stream, 12)
+            self.obj.drain()
+        self.assertEqual(fdatasync.call_count, 1)
+        self.assertEqual(self.reported, [12])
+
+    def test_disabled(self):
+        """tests that progress is reported right away without a window"""
+        self.obj = WriteBack(self.reported.append, window=0)
+        stream = self.obj.stream(self.file.fileno())
+        with mock.patch('os.dup') as dup:
+            self.write(stream, 5)
+            stream.close()
+        dup.assert_not_called()
+        self.assertEqual(self.reported, [5])
+
+    def test_abort(self):
+        """tests that abort closes duplicated descriptors without reporting anything"""
+        stream = self.obj.stream(self.file.fileno(), flush=self.file.flush)
+        self.write(stream, 4)
+        fd = self.obj.inFlight[0][0].fd
+        self.obj.abort()
+        with self.assertRaises(OSError):
+            os.fstat(fd)
+        self.assertEqual((self.reported, self.obj.inFlightBytes), ([], 0))
+
+    def test_descriptor_shared(self):
+        """tests that a file's ranges share one descriptor and tails are merged"""
+        stream = self.obj.stream(self.file.fileno(), flush=self.file.flush)
+        with mock.patch('os.dup', wraps=os.dup) as dup:
+            self.write(stream, 4)
+            self.write(stream, 1)
+            stream.close()
+            other = self.obj.stream(self.file.fileno(), offset=5, flush=self.file.flush)
+            self.write(other, 2)
+            other.close()
+        self.assertEqual(dup.call_count, 2)
+        self.assertEqual([entry[1:] for entry in self.obj.inFlight], [[0, 4, 4], [4, 1, 1],
+                                                                     [5, 2, 2]])
+        self.obj.drain()
+        self.assertEqual((self.reported, self.obj.descriptors), ([4, 1, 2], set()))
+
+    def test_open_file_limit(self):
+        """tests that thousands of small files can be copied under a low open file limit"""
+        source = os.path.join(self.tmp, 'iso')
+        target = os.path.join(self.tmp, 'target')
+        files = {'pool/{0}/{1}.deb'.format(i % 10, i): 1024 for i in range(3000)}
+        createTree(source, files)
+        os.mkdir(target)
+        written = []
+        lock = threading.Lock()
+        def callback(n):
+            with lock:
+                written.append(n)
+        engine = CopyEngine(source, target, callback, workers=4, writeWindow=(64*1024**2))
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(256, hard), hard))
+        try:
+            engine.run()
+        finally:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+        self.assertEqual(sum(written), sum(files.values()))
+        self.assertEqual(engine.writeBack.descriptors, set())
+
+class PipelineTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create a small buffer pool and some data before each test"""
+        self.pool = BufferPool(3, 4096)
+        self.data = os.urandom(4096 * 10 + 123)
+        self.source = io.BytesIO(self.data)
+        self.written = []
+        self.buffers = set()
+
+    def tearDown(self):
+        """function to release the buffer pool after test finishes"""
+        self.pool.close()
+
+    def write(self, view):
+        """records what is written and which buffer it came from"""
+        self.buffers.add(id(view.obj))
+        self.written.append(bytes(view))
+
+    def test_copy(self):
+        """tests that everything is written in order through the pooled buffers"""
+        total = Pipeline(self.pool, self.source.readinto, self.write, depth=2).run()
+        self.assertEqual(total, len(self.data))
+        self.assertEqual(b''.join(self.written), self.data)
+        self.assertTrue(self.buffers <= set(id(buf) for buf in self.pool.buffers))
+        self.assertEqual(self.pool.free.qsize(), 3)
+
+    def test_errors(self):
+        """tests that read and write errors are raised and every buffer is returned"""
+        def failingRead(view):
+            """reads two buffers and then fails"""
+            if self.source.tell() >= 8192:
+                raise OSError(errno.EIO, 'Input/output error')
+            return self.source.readinto(view)
+
+        with self.assertRaises(OSError):
+            Pipeline(self.pool, failingRead, self.write).run()
+        self.assertEqual(b''.join(self.written), self.data[:8192])
+        self.assertEqual(self.pool.free.qsize(), 3)
+
+        def failingWrite(view):
+            """fails on the first buffer"""
+            raise OSError(errno.ENOSPC, 'No space left on device')
+
+        with self.assertRaises(OSError):
+            Pipeline(self.pool, self.source.readinto, failingWrite).run()
+        self.assertEqual(self.pool.free.qsize(), 3)
+
+class ProgressModelTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create a progress model on a fake clock before each test"""
+        self.now = 0.0
+        patcher = mock.patch('bdc.progressModel.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.obj = ProgressModel(halfLife=1.0, interval=0.5)
+
+    def tearDown(self):
+        """function to delete the progress model after test finishes"""
+        del self.obj
+
+    def test_rate_and_eta(self):
+        """tests the smoothed rate and ETAs of the job and its stages"""
+        MiB = 1024**2
+        self.obj.stageStarted('format')
+        self.now = 10.0
+        self.obj.stageFinished('format')
+        self.obj.stageStarted('copy')
+        self.obj.add(totalBytes=100 * MiB, totalFiles=4)
+        self.now = 11.0
+        self.obj.add(10 * MiB, files=1)
+        snapshot = self.obj.snapshot()
+        # the time spent formatting doesn't count against the throughput
+        self.assertEqual((snapshot['mbPerSecond'], snapshot['eta'], snapshot['percent']),
+                         (10.0, 9.0, 10.0))
+        self.assertAlmostEqual(snapshot['averageMbPerSecond'], 10.0 / 11.0)
+
+        self.now = 12.0
+        self.obj.add(20 * MiB)
+        snapshot = self.obj.snapshot()
+        self.assertEqual(snapshot['mbPerSecond'], 15.0)
+        self.assertAlmostEqual(snapshot['eta'], 70 / 15.0)
+        self.assertEqual([(stage['name'], stage['state'], stage['eta'])
+                          for stage in snapshot['stages']],
+                         [('format', 'done', 0.0), ('copy', 'running', snapshot['eta'])])
+        self.assertEqual(snapshot['stages'][1]['totalBytes'], 100 * MiB)
+
+        # updates within the interval only count, the snapshot is replaced and not changed
+        self.now = 12.1
+        self.obj.add(MiB, files=1)
+        self.assertIs(self.obj.snapshot(), snapshot)
+        self.assertEqual(snapshot['bytes'], 30 * MiB)
+        self.obj.flush()
+        self.assertEqual((self.obj.snapshot()['bytes'], self.obj.snapshot()['files'],
+                          self.obj.snapshot()['totalFiles']), (31 * MiB, 2, 4))
+
+    def test_unknown_eta(self):
+        """tests that there is no ETA without a total or a throughput"""
+        self.assertIsNone(self.obj.snapshot()['eta'])
+        self.obj.add(totalBytes=100)
+        self.obj.flush()
+        self.assertIsNone(self.obj.snapshot()['eta'])
+        self.assertEqual([formatEta(None), formatEta(83.4), formatEta(3725)],
+                         ['--:--', '1:23', '1:02:05'])
+
+    def test_cli_output(self):
+        """tests that progressCallback prints the throughput and ETA"""
+        bdc = BootableDiskCreator()
+        bdc.progress = self.obj
+        bdc.totalBytes = 40 * 1024**2
+        self.now = 1.0
+        with mock.patch('bdc.bootableDiskCreator.stdout', new_callable=StringIO) as output:
+            bdc.progressCallback(10 * 1024**2)
+        self.assertEqual(output.getvalue(), 'copying image... 25.00% (10.0 MB/s, 0:03 left)\r')
+
+class PageCacheTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create a temporary file before each test"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'image.iso')
+        with open(self.path, 'wb') as f:
+            f.write(os.urandom(100000))
+
+    def tearDown(self):
+        """function to delete the temporary file after test finishes"""
+        self.tmp.cleanup()
+
+    def test_drop_behind(self):
+        """tests that consumed ranges are dropped a chunk at a time and the rest on close"""
+        with mock.patch('bdc.pageCache.advise') as advise:
+            obj = DropBehind(7, chunk=10)
+            obj.advance(4)
+            obj.advance(8)
+            obj.advance(3)
+            obj.close()
+            DropBehind(8, enabled=False).close()
+        self.assertEqual(advise.call_args_list,
+                         [mock.call(7, 0, 0, FADV_SEQUENTIAL), mock.call(7, 0, 12, FADV_DONTNEED),
+                          mock.call(7, 12, 3, FADV_DONTNEED)])
+
+    def test_iso_release(self):
+        """tests that the reader only drops what it read when asked to"""
+        with mock.patch('bdc.isoReader.advise') as advise:
+            reader = IsoReader(self.path)
+            reader.file = open(self.path, 'rb')
+            reader.mmap = mmap.mmap(reader.file.fileno(), 0, access=mmap.ACCESS_READ)
+            reader.release(4096, 2048)
+            advise.assert_not_called()
+            reader.dropCache = True
+            reader.release(4096, 2048)
+            reader.close()
+        advise.assert_called_once_with(mock.ANY, 4096, 2048, FADV_DONTNEED)
+
+    def test_resident_bytes(self):
+        """tests that the cached part of a file is measured"""
+        resident = residentBytes(self.path)
+        if resident is None:
+            self.skipTest('mincore is not available')
+        self.assertTrue(0 <= resident <= 100000)
+        open(self.path, 'w').close()
+        self.assertEqual(residentBytes(self.path), 0)
+
+class BenchmarkTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create temporary directory and small Benchmark object before each test"""
+        self.tmp = tempfile.TemporaryDirectory()
+        shape = {'files': 300, 'minSize': 1, 'maxSize': 5000, 'width': 2, 'depth': 3}
+        self.obj = Benchmark(self.tmp.name, {'test': shape}, ['kernel', 'iso'], workers=2,
+                             sync=False, pageCache=['drop', 'keep'])
+
+    def tearDown(self):
+        """function to delete temporary directory and Benchmark object after test finishes"""
+        self.tmp.cleanup()
+        del self.obj
+
+    def test_layout_reproducible(self):
+        """tests that the same seed always generates the same tree"""
+        self.assertEqual(self.obj.layout(self.obj.shapes['test']),
+                         self.obj.layout(self.obj.shapes['test']))
+        directories, files = self.obj.layout(self.obj.shapes['test'])
+        self.assertEqual(len(directories), 6)
+        self.assertEqual(len(files), 300)
+
+    def test_write_iso(self):
+        """tests that generated images, with directories spanning several sectors, read back"""
+        tree = os.path.join(self.tmp.name, 'tree')
+        iso = os.path.join(self.tmp.name, 'image.iso')
+        directories, files = self.obj.createTree(tree, self.obj.shapes['test'])
+        self.obj.writeIso(tree, iso, directories, files)
+        with IsoReader(iso) as reader:
+            self.assertEqual(sorted(reader.directories()), sorted(directories))
+            self.assertEqual(sorted((entry.path, entry.size) for entry in reader.files()),
+                             sorted(files))
+            for relPath, size in files[:20]:
+                with open(os.path.join(tree, relPath), 'rb') as f:
+                    self.assertEqual(b''.join(reader.readChunks(reader.entry(relPath))),
+                                     f.read())
+
+    def test_run(self):
+        """tests that every strategy is measured and reported"""
+        report = self.obj.run()
+        json.dumps(report)
+        self.assertEqual([(result['shape'], result['strategy'], result['pageCache'])
+                          for result in report['results']],
+                         [('test', 'kernel', 'drop'), ('test', 'kernel', 'keep'),
+                          ('test', 'iso', 'drop'), ('test', 'iso', 'keep')])
+        for result in report['results']:
+            self.assertNotIn('error', result)
+            self.assertEqual(result['files'], 300)
+            for key in ('seconds', 'bytes', 'mbPerSecond', 'filesPerSecond', 'cpuUser',
+                        'cpuSystem', 'peakRssKiB', 'cachedKiB'):
+                self.assertIn(key, result)
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+class CompressedImageTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create temporary compressed images before each test"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.data = os.urandom(300000) + bytes(200000) + os.urandom(1234)
+        self.target = os.path.join(self.tmp.name, 'target.img')
+        self.images = {}
+        for fmt, compress in (('gz', gzip.compress), ('xz', lzma.compress),
+                              ('bz2', bz2.compress)):
+            self.images[fmt] = os.path.join(self.tmp.name, 'image.iso.' + fmt)
+            with open(self.images[fmt], 'wb') as f:
+                f.write(compress(self.data))
+        with open(self.target, 'wb') as f:
+            f.write(os.urandom(len(self.data) * 2))
+
+    def tearDown(self):
+        """function to remove temporary directory after test finishes"""
+        self.tmp.cleanup()
+
+    def readAll(self, image):
+        """returns everything read from an image in small chunks"""
+        chunks = []
+        with image:
+            while True:
+                buf = image.read(65536)
+                if not buf:
+                    return b''.join(chunks)
+                chunks.append(buf)
+
+    def test_decompress(self):
+        """tests that every format decompresses with a program or a module"""
+        for fmt, path in sorted(self.images.items()):
+            image = CompressedImage(path)
+            self.assertEqual(self.readAll(image), self.data)
+            self.assertEqual((image.size, image.bytesRead), (len(self.data), len(self.data)))
+            with mock.patch('bdc.compressedImage.decompressor', return_value=None):
+                self.assertEqual(self.readAll(CompressedImage(path)), self.data)
+
+    def test_sizes(self):
+        """tests that the size is known up front for xz and estimated for other formats"""
+        self.assertEqual(imageSize(self.images['gz']), None)
+        if shutil.which('xz'):
+            self.assertEqual(imageSize(self.images['xz']), len(self.data))
+        with CompressedImage(self.images['gz']) as image:
+            self.assertEqual(image.estimatedSize(), image.compressedSize)
+            image.read(100000)
+            self.assertGreaterEqual(image.estimatedSize(), 100000)
+            self.assertLessEqual(image.compressedRead(), image.compressedSize)
+
+    def test_corrupt(self):
+        """tests that a truncated image raises CompressionError"""
+        with open(self.images['gz'], 'r+b') as f:
+            f.truncate(1000)
+        for command in (['gzip', '-d', '-c'], None):
+            with mock.patch('bdc.compressedImage.decompressor', return_value=command):
+                with self.assertRaises(CompressionError):
+                    self.readAll(CompressedImage(self.images['gz']))
+
+    def test_raw_write(self):
+        """tests that RawWriter writes compressed images decompressed"""
+        written = []
+        writer = RawWriter(self.images['bz2'], self.target, written.append, bufferSize=65536)
+        writer.run()
+        with open(self.target, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual((sum(written), writer.totalBytes), (len(self.data), len(self.data)))
+
+    def test_write_image(self):
+        """tests that BootableDiskCreator.main writes compressed images and verifies them"""
+        bdc = BootableDiskCreator()
+        bdc.verbose = False
+        bdc.raw = True
+        bdc.verify = True
+        bdc.iso = self.images['gz']
+        bdc.device = self.target
+        bdc.main()
+        self.assertIsNone(bdc.error)
+        self.assertEqual(bdc.mismatches, [])
+        self.assertAlmostEqual(bdc.copyProgress, 100.0)
+        self.assertEqual(bdc.totalBytes, len(self.data))
+        with open(self.target, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    @mock.patch('os.path.isfile')
+    @mock.patch('pwd.getpwnam')
+    def test_requires_raw(self, mockPwd, mockFile):
+        """tests that compressed images are only accepted in raw mode"""
+        mockPwd.return_value = MagicMock(pw_uid=0)
+        mockFile.return_value = True
+        bdc = BootableDiskCreator()
+        with self.assertRaises(SystemExit) as err:
+            bdc.start(cliArgs('/dev/sdb1', 'image.iso.xz'))
+        self.assertEqual(err.exception.code,
+                         'Error: compressed images can only be written with --raw')
+        with self.assertRaises(SystemExit) as err:
+            bdc.start(cliArgs('/dev/sdb', 'image.img.xz', raw=True))
+        self.assertEqual(err.exception.code, 'Error: \'image.img.xz\' is not an ISO image')
+
+class RawWriterTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to create temporary image with data and zero regions before each test"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.iso = os.path.join(self.tmp.name, 'image.iso')
+        self.target = os.path.join(self.tmp.name, 'target.img')
+        self.data = (os.urandom(5000) + bytes(3 * 65536 + 2000) + os.urandom(70000) +
+                     bytes(65536) + os.urandom(1234))
+        with open(self.iso, 'wb') as f:
+            f.write(self.data)
+        with open(self.target, 'wb') as f:
+            f.write(os.urandom(len(self.data) * 2))
+
+    def tearDown(self):
+        """function to remove temporary directory after test finishes"""
+        self.tmp.cleanup()
+
+    def test_raw_write(self):
+        """tests that the image is written exactly and zero buffers are skipped"""
+        written = []
+        writer = RawWriter(self.iso, self.target, written.append, bufferSize=65536)
+        writer.run()
+        with open(self.target, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(sum(written), len(self.data))
+        self.assertEqual(writer.bytesSkipped, 2 * 65536)
+        self.assertEqual(writer.bytesWritten + writer.bytesSkipped, len(self.data))
+
+    def test_raw_write_without_skipping(self):
+        """tests that zero regions are written out when skipping is disabled"""
+        writer = RawWriter(self.iso, self.target, bufferSize=65536, direct=False,
+                           skipZeroes=False)
+        writer.run()
+        with open(self.target, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(writer.bytesSkipped, 0)
+
+    @mock.patch('os.path.isfile')
+    @mock.patch('bdc.bootableDiskCreator.BootableDiskCreator.executeCommand')
+    @mock.patch('pwd.getpwnam')
+    def test_raw_target_not_block_device(self, mockPwd, mockExecute, mockFile):
+        """tests that raw mode only accepts block devices"""
+        mockPwd.return_value = MagicMock(pw_uid=0)
+        mockFile.return_value = True
+        bdc = BootableDiskCreator()
+        bdc.topology = fakeTopology(self.tmp.name, 'sda1,/')
+        with self.assertRaises(SystemExit) as err:
+            bdc.start(cliArgs(self.target, 'image.iso', raw=True))
+        self.assertEqual(err.exception.code,
+                         'Error: device \'{0}\' does not exist'.format(self.target))
+
+    def test_write_image(self):
+        """tests that BootableDiskCreator.main writes the image in raw mode"""
+        bdc = BootableDiskCreator()
+        bdc.verbose = False
+        bdc.raw = True
+        bdc.iso = self.iso
+        bdc.device = self.target
+        bdc.main()
+        self.assertTrue(bdc.done)
+        self.assertAlmostEqual(bdc.copyProgress, 100.0)
+        with open(self.target, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    @mock.patch('os.path.isfile')
+    @mock.patch('pwd.getpwnam')
+    def test_buffer_options(self, mockPwd, mockFile):
+        """tests that the buffer count is checked and the options reach the writer"""
+        mockPwd.return_value = MagicMock(pw_uid=0)
+        mockFile.return_value = True
+        bdc = BootableDiskCreator()
+        with self.assertRaises(SystemExit) as err:
+            bdc.start(cliArgs('/dev/sdb1', 'image.iso', raw=True, buffers=1))
+        self.assertEqual(err.exception.code, 'Error: --buffers has to be at least 2')
+
+        bdc = BootableDiskCreator()
+        bdc.verbose = False
+        bdc.raw = True
+        bdc.iso = self.iso
+        bdc.device = self.target
+        bdc.bufferCount = 2
+        bdc.bufferSize = 65536
+        with mock.patch('bdc.bootableDiskCreator.RawWriter', wraps=RawWriter) as writer:
+            bdc.main()
+        self.assertEqual(writer.call_args[1]['bufferCount'], 2)
+        self.assertEqual(writer.call_args[1]['bufferSize'], 65536)
+        with open(self.target, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
 
 class DependencyCheckerTests(TestCase):
     """test class that inherits from unittest.TestCase class"""
     def setUp(self):
-        """function to create new BootableDiskCreator object before each test"""
-        self.obj = DependencyChecker()
+        """function to create new DependencyChecker object with its own stamp directory"""
+        self.directory = tempfile.mkdtemp()
+        self.obj = DependencyChecker(stampDirectory=self.directory)
 
     def tearDown(self):
-        """function to delete BootableDiskCreator object after test finishes"""
+        """function to delete DependencyChecker object after test finishes"""
         del self.obj
+        shutil.rmtree(self.directory)
 
     @mock.patch('shutil.which')
     @mock.patch('sys.version_info')
@@ -169,7 +2288,7 @@ class DependencyCheckerTests(TestCase):
         sys.modules['PyQt5'].Qt.PYQT_VERSION_STR = '5.11.3'
         mockVersion.major = 3
         mockVersion.minor = 3
-        mockWhich.side_effect = ['/bin/awk', '/bin/mkfs.fat', '/bin/lsblk', '/bin/mount']
+        mockWhich.side_effect = ['/bin/mkfs.fat', '/bin/mount']
 
         with self.assertRaises(SystemExit) as err:
             self.obj.main()
@@ -182,7 +2301,7 @@ class DependencyCheckerTests(TestCase):
         sys.modules['PyQt5'] = None
         mockVersion.major = 3
         mockVersion.minor = 5
-        mockWhich.side_effect = ['/bin/awk', '/bin/mkfs.fat', '/bin/lsblk', '/bin/mount']
+        mockWhich.side_effect = ['/bin/mkfs.fat', '/bin/mount']
 
         with self.assertRaises(SystemExit) as err:
             self.obj.main()
@@ -196,7 +2315,7 @@ class DependencyCheckerTests(TestCase):
         sys.modules['PyQt5'].Qt.PYQT_VERSION_STR = 'FAKE_VERSION'
         mockVersion.major = 3
         mockVersion.minor = 5
-        mockWhich.side_effect = ['/bin/awk', '/bin/mkfs.fat', '/bin/lsblk', '/bin/mount']
+        mockWhich.side_effect = ['/bin/mkfs.fat', '/bin/mount']
 
         output = StringIO()
         with redirect_stderr(output):
@@ -212,14 +2331,12 @@ class DependencyCheckerTests(TestCase):
         sys.modules['PyQt5'].Qt.PYQT_VERSION_STR = '5.11.3'
         mockVersion.major = 3
         mockVersion.minor = 5
-        mockWhich.side_effect = [None, None, None, None]
+        mockWhich.side_effect = [None, None]
 
         with self.assertRaises(SystemExit) as err:
             self.obj.main()
-        self.assertEqual(err.exception.code, ('Error: missing required dependency: awk\nError: '
-                                              'missing required dependency: mkfs.fat\nError: '
-                                              'missing required dependency: lsblk\nError: '
-                                              'missing required dependency: mount'))
+        self.assertEqual(err.exception.code, ('Error: missing required dependency: mkfs.fat\n'
+                                              'Error: missing required dependency: mount'))
 
     @mock.patch('shutil.which')
     @mock.patch('sys.version_info')
@@ -228,12 +2345,89 @@ class DependencyCheckerTests(TestCase):
         sys.modules['PyQt5'] = None
         mockVersion.major = 3
         mockVersion.minor = 5
-        mockWhich.side_effect = [None, None, None, None]
+        mockWhich.side_effect = [None, None]
 
         with self.assertRaises(SystemExit) as err:
             self.obj.main()
         self.assertEqual(err.exception.code, 'Error: missing required dependency: PyQt5\n'
-                                             'Error: missing required dependency: awk\nError: '
-                                             'missing required dependency: mkfs.fat\nError: '
-                                             'missing required dependency: lsblk\nError: '
-                                             'missing required dependency: mount')
+                                             'Error: missing required dependency: mkfs.fat\n'
+                                             'Error: missing required dependency: mount')
+
+    @mock.patch('shutil.which')
+    def test_cli_skips_pyqt(self, mockWhich):
+        """tests that the CLI doesn't need or import PyQt5"""
+        sys.modules['PyQt5'] = None
+        mockWhich.side_effect = ['/bin/mkfs.fat', '/bin/mount']
+        self.obj = DependencyChecker('cli', self.directory)
+        self.obj.main()
+        self.assertFalse(self.obj.PyQtInstall)
+
+    @mock.patch('os.access')
+    @mock.patch('shutil.which')
+    def test_stamp_file(self, mockWhich, mockAccess):
+        """tests that found commands are cached until PATH changes"""
+        mockWhich.side_effect = ['/bin/mkfs.fat', None, '/bin/mkfs.fat', '/bin/mount',
+                                 '/sbin/mkfs.fat', '/bin/mount']
+        mockAccess.return_value = True
+        with self.assertRaises(SystemExit):
+            DependencyChecker('cli', self.directory).main()
+        self.assertEqual(os.listdir(self.directory), [])
+
+        DependencyChecker('cli', self.directory).main()
+        DependencyChecker('cli', self.directory).main()
+        self.assertEqual(mockWhich.call_count, 4)
+        self.assertEqual(os.listdir(self.directory), ['dependencies-cli.json'])
+
+        with mock.patch.dict(os.environ, {'PATH': '/sbin:/bin'}):
+            DependencyChecker('cli', self.directory).main()
+        self.assertEqual(mockWhich.call_count, 6)
+
+        # a cached command that was removed since is searched for again
+        mockAccess.return_value = False
+        mockWhich.side_effect = ['/sbin/mkfs.fat', '/bin/mount']
+        with mock.patch.dict(os.environ, {'PATH': '/sbin:/bin'}):
+            DependencyChecker('cli', self.directory).main()
+        self.assertEqual(mockWhich.call_count, 8)
+
+class StartupTests(TestCase):
+    """test class that inherits from unittest.TestCase class"""
+    def setUp(self):
+        """function to find the directory bdc is imported from before each test"""
+        self.path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def run_python(self, code):
+        """runs code in a new interpreter and returns what it prints as JSON"""
+        env = dict(os.environ, PYTHONPATH=self.path)
+        process = Popen([sys.executable, '-c', code], stdout=PIPE, cwd=self.path, env=env)
+        output = process.communicate()[0]
+        self.assertEqual(process.returncode, 0)
+        return json.loads(output.decode())
+
+    def test_import_budget(self):
+        """tests that importing BootableDiskCreator leaves heavy and feature modules alone
+
+        What is imported is checked instead of how long it takes, so the test doesn't
+        depend on how busy the machine is.
+        """
+        modules = self.run_python(
+            'import json, sys\n'
+            'import bdc.bootableDiskCreator\n'
+            'print(json.dumps(sorted(sys.modules)))')
+        for name in ['PyQt5', 'asyncio', 'ctypes', 'gzip', 'bdc.daemon',
+                     'bdc.dependencyChecker', 'bdc.compressedImage', 'bdc.fanOut',
+                     'bdc.fatImage', 'bdc.imageCache', 'bdc.isoReader', 'bdc.verifier']:
+            self.assertNotIn(name, modules)
+
+    def test_cli_help(self):
+        """tests that bdc --help doesn't import the job modules or PyQt5"""
+        modules = self.run_python(
+            'import io, json, runpy, sys\n'
+            'sys.argv = ["bdc", "--help"]\n'
+            'sys.stdout = io.StringIO()\n'
+            'try:\n'
+            '    runpy.run_path("bdc/bdc", run_name="__main__")\n'
+            'except SystemExit:\n'
+            '    pass\n'
+            'sys.__stdout__.write(json.dumps(sorted(sys.modules)))\n')
+        for name in ['PyQt5', 'asyncio', 'bdc.bootableDiskCreator', 'bdc.daemon']:
+            self.assertNotIn(name, modules)
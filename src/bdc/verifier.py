@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Contains classes to verify what was written against hashes taken while copying
+
+The source is hashed as it is read for the copy, so verification only has to read
+the target back. Target pages are dropped from the page cache first so the data is
+really read back from the device and not from memory.
+
+File name: verifier.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import hashlib
+import os
+import threading
+from collections import deque
+
+class HashingReader:
+    """file object wrapper that hashes everything read through it"""
+    def __init__(self, fsrc, digest):
+        """initializes member variables"""
+        self.fsrc = fsrc
+        self.digest = digest
+
+    def read(self, length=-1):
+        """reads from the wrapped file object and adds the data to the hash"""
+        buf = self.fsrc.read(length)
+        self.digest.update(buf)
+        return buf
+
+class Verifier:
+    """class that re-reads written files on a pool of worker threads and compares hashes"""
+    def __init__(self, root, hashes, algorithm='sha256', workers=4, length=(1024**2)):
+        """initializes member variables
+
+        hashes is a dictionary of paths relative to root and the hex digests taken
+        while copying them
+        """
+        self.root = root
+        self.hashes = hashes
+        self.algorithm = algorithm
+        self.workers = max(1, workers)
+        self.length = length
+        self.pending = deque()
+        self.mismatches = []
+        self.mutex = threading.Lock()
+
+    @staticmethod
+    def dropCache(fd):
+        """flushes a file and drops its pages from the page cache so reads hit the device"""
+        os.fsync(fd)
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+    def hashFile(self, path, size=None):
+        """returns the hex digest of the first size bytes of path, or all of it"""
+        digest = hashlib.new(self.algorithm)
+        with open(path, 'rb', buffering=0) as f:
+            self.dropCache(f.fileno())
+            remaining = size
+            while remaining is None or remaining > 0:
+                length = self.length if remaining is None else min(self.length, remaining)
+                buf = f.read(length)
+                if not buf:
+                    break
+                digest.update(buf)
+                if remaining is not None:
+                    remaining -= len(buf)
+        return digest.hexdigest()
+
+    def checkFile(self, relPath):
+        """returns what is wrong with a written file or None if it matches"""
+        path = os.path.join(self.root, relPath)
+        if not os.path.isfile(path):
+            return 'missing'
+        if self.hashFile(path) != self.hashes[relPath]:
+            return 'hash mismatch'
+        return None
+
+    def worker(self):
+        """checks files until there are none left"""
+        while True:
+            self.mutex.acquire()
+            relPath = self.pending.popleft() if self.pending else None
+            self.mutex.release()
+            if relPath is None:
+                return
+            try:
+                problem = self.checkFile(relPath)
+            except OSError as err:
+                problem = 'unreadable: {0}'.format(err.strerror)
+            if problem is not None:
+                self.mutex.acquire()
+                self.mismatches.append((relPath, problem))
+                self.mutex.release()
+
+    def run(self):
+        """verifies every file and returns a sorted list of (path, problem) tuples"""
+        self.pending = deque(self.hashes)
+        self.mismatches = []
+        threads = [threading.Thread(target=self.worker) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sorted(self.mismatches)
+
+    def checkDevice(self, device, size, expected):
+        """returns what is wrong with an image written onto a device or None if it matches"""
+        try:
+            if self.hashFile(device, size) != expected:
+                return 'hash mismatch'
+        except OSError as err:
+            return 'unreadable: {0}'.format(err.strerror)
+        return None
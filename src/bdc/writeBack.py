@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""Contains classes to bound the dirty data in flight and report bytes once they are on the device
+
+Buffered writes complete as soon as the data is in the page cache, so progress used to
+reach 100% long before the final umount had flushed gigabytes of dirty pages. Written
+ranges are handed to the kernel for write-out every chunk with sync_file_range, and once
+more than window bytes are in flight the oldest ranges are waited on before writing
+goes on. Progress is only reported for ranges that have been waited on. Where
+sync_file_range isn't available, fdatasync is used to wait instead. Ranges on the device
+can also be dropped from the page cache, they won't be read again. A written file keeps
+one duplicate of its descriptor until all of its ranges are on the device.
+
+File name: writeBack.py
+Author: Adam Jenkins
+Date created: 10/18/2026
+Date last modified: 10/18/2026
+Python Version: 3.6.5
+"""
+
+import errno
+import os
+import threading
+from collections import deque
+from functools import lru_cache
+from bdc.pageCache import advise, loadLibc, FADV_DONTNEED
+
+SYNC_FILE_RANGE_WAIT_BEFORE = 1
+SYNC_FILE_RANGE_WRITE = 2
+SYNC_FILE_RANGE_WAIT_AFTER = 4
+
+# errors meaning sync_file_range can't be used on this kind of file
+UNSUPPORTED_ERRORS = (errno.ENOSYS, errno.EINVAL, errno.ESPIPE, errno.EOPNOTSUPP)
+
+@lru_cache(maxsize=None)
+def loadSyncFileRange():
+    """returns sync_file_range from the C library, or None if there isn't one"""
+    import ctypes
+    try:
+        function = loadLibc().sync_file_range
+    except AttributeError:
+        return None
+    function.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_uint]
+    function.restype = ctypes.c_int
+    return function
+
+class Descriptor:
+    """duplicate of a written file's descriptor shared by its stream and its ranges in flight
+
+    It stays open until the stream is closed and every range of the file has been waited
+    on, so a file takes a single extra descriptor however many of its ranges are queued.
+    """
+    def __init__(self, fd):
+        """duplicates fd, the stream holds the first reference"""
+        self.fd = os.dup(fd)
+        self.refs = 1
+
+    def close(self):
+        """closes the duplicate if it is still open"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+class WriteBackStream:
+    """sequential writes to one file descriptor, handed to WriteBack a chunk at a time"""
+    def __init__(self, writeBack, fd, offset=0, flush=None):
+        """initializes member variables
+
+        offset is where writing starts and flush, if given, pushes data buffered in
+        userspace into the file descriptor before a range is handed over.
+        """
+        self.writeBack = writeBack
+        self.fd = fd
+        self.descriptor = None
+        self.start = offset
+        self.end = offset
+        self.progress = 0
+        self.flush = flush
+
+    def wrote(self, length, progress=None):
+        """records that length more bytes were written
+
+        progress is the number of bytes reported once they are committed, which is
+        length unless some of what was written (like file system metadata) doesn't count.
+        """
+        if self.writeBack.window is None:
+            self.writeBack.report(length if progress is None else progress)
+            return
+        self.end += length
+        self.progress += length if progress is None else progress
+        if self.end - self.start >= self.writeBack.chunk:
+            self.submit()
+
+    def submit(self):
+        """hands the range written since the last submit over to the WriteBack"""
+        if self.end > self.start or self.progress:
+            if self.flush is not None:
+                self.flush()
+            if self.descriptor is None:
+                self.descriptor = self.writeBack.open(self.fd)
+            self.writeBack.submit(self.descriptor, self.start, self.end - self.start,
+                                  self.progress)
+        self.start = self.end
+        self.progress = 0
+
+    def close(self):
+        """hands over the rest, the file may be closed afterwards"""
+        if self.writeBack.window is not None:
+            self.submit()
+        if self.descriptor is not None:
+            self.writeBack.release(self.descriptor)
+            self.descriptor = None
+
+class WriteBack:
+    """class that keeps at most window bytes of written data waiting for the device
+
+    It is shared by every thread writing to one device. A window of None turns write-back
+    control off, progress is then reported as soon as data is written. Every range in
+    flight keeps its file's descriptor open, so at most maxRanges ranges are queued to
+    stay well below the open file limit when many small files are written.
+    """
+    def __init__(self, callback=None, window=(64*1024**2), chunk=(8*1024**2), dropCache=False):
+        """initializes member variables
+
+        callback is called with the number of bytes committed to the device, chunk is
+        how much is written to a file before it is handed to the kernel for write-out.
+        If dropCache is set, committed ranges are dropped from the page cache.
+        """
+        self.callback = callback
+        self.dropCache = dropCache
+        self.window = window if window else None
+        self.chunk = min(chunk, self.window) if self.window else chunk
+        self.maxRanges = 64
+        self.syncFileRange = loadSyncFileRange()
+        self.inFlight = deque()
+        self.inFlightBytes = 0
+        self.latest = {}
+        self.descriptors = set()
+        self.committed = 0
+        self.mutex = threading.Lock()
+
+    def stream(self, fd, offset=0, flush=None):
+        """returns a WriteBackStream for sequential writes to fd starting at offset"""
+        return WriteBackStream(self, fd, offset, flush)
+
+    def open(self, fd):
+        """returns a Descriptor duplicating fd so its ranges can be waited on after it is closed"""
+        descriptor = Descriptor(fd)
+        self.mutex.acquire()
+        self.descriptors.add(descriptor)
+        self.mutex.release()
+        return descriptor
+
+    def release(self, descriptor):
+        """drops a reference to a Descriptor, closing it once nothing uses it any more"""
+        self.mutex.acquire()
+        descriptor.refs -= 1
+        unused = descriptor.refs <= 0
+        if unused:
+            self.descriptors.discard(descriptor)
+        self.mutex.release()
+        if unused:
+            descriptor.close()
+
+    def report(self, count):
+        """passes committed bytes to the callback"""
+        if count:
+            self.mutex.acquire()
+            self.committed += count
+            self.mutex.release()
+            if self.callback:
+                self.callback(count)
+
+    def syncRange(self, fd, offset, length, flags):
+        """calls sync_file_range, returns False if it can't be used for fd"""
+        if self.syncFileRange is None:
+            return False
+        if self.syncFileRange(fd, offset, length, flags) == 0:
+            return True
+        import ctypes
+        err = ctypes.get_errno()
+        if err in UNSUPPORTED_ERRORS:
+            return False
+        raise OSError(err, os.strerror(err))
+
+    def start(self, fd, length, offset=0):
+        """starts write-out of a range without tracking it, used for files too small to wait on"""
+        if self.window is not None and length:
+            self.syncRange(fd, offset, length, SYNC_FILE_RANGE_WRITE)
+
+    def settle(self, fd, length, offset=0):
+        """waits until a range whose write-out was started is on the device
+
+        Does nothing if write-back control is off, like start.
+        """
+        if self.window is None or not length:
+            return
+        if not self.syncRange(fd, offset, length, SYNC_FILE_RANGE_WAIT_BEFORE |
+                              SYNC_FILE_RANGE_WRITE | SYNC_FILE_RANGE_WAIT_AFTER):
+            os.fdatasync(fd)
+        if self.dropCache:
+            advise(fd, offset, length, FADV_DONTNEED)
+
+    def submit(self, descriptor, offset, length, progress):
+        """starts write-out of a range and waits for the oldest ones if the window is full
+
+        A range that directly follows the file's last range still in flight is merged
+        into it as long as the two fit in one chunk, so the tails of files don't take
+        a slot each.
+        """
+        if length:
+            self.syncRange(descriptor.fd, offset, length, SYNC_FILE_RANGE_WRITE)
+        self.mutex.acquire()
+        entry = self.latest.get(descriptor)
+        if (entry is not None and entry[1] + entry[2] == offset and
+                entry[2] + length <= self.chunk):
+            entry[2] += length
+            entry[3] += progress
+        else:
+            entry = [descriptor, offset, length, progress]
+            descriptor.refs += 1
+            self.inFlight.append(entry)
+            self.latest[descriptor] = entry
+        self.inFlightBytes += length
+        self.mutex.release()
+        self.throttle()
+
+    def popOldest(self):
+        """removes the oldest range in flight and returns it, or None if there is none
+
+        Must be called with the lock held.
+        """
+        if not self.inFlight:
+            return None
+        entry = self.inFlight.popleft()
+        self.inFlightBytes -= entry[2]
+        if self.latest.get(entry[0]) is entry:
+            del self.latest[entry[0]]
+        return entry
+
+    def throttle(self):
+        """waits for the oldest ranges until the window and the number of ranges fit again"""
+        while True:
+            self.mutex.acquire()
+            if self.inFlightBytes <= self.window and len(self.inFlight) <= self.maxRanges:
+                self.mutex.release()
+                return
+            entry = self.popOldest()
+            self.mutex.release()
+            self.wait(entry)
+
+    def wait(self, entry):
+        """waits until a range is on the device, releases its descriptor and reports it"""
+        descriptor, offset, length, progress = entry
+        try:
+            self.settle(descriptor.fd, length, offset)
+        finally:
+            self.release(descriptor)
+        self.report(progress)
+
+    def drain(self):
+        """waits for every range in flight, the first error is raised once all are released"""
+        error = None
+        while True:
+            self.mutex.acquire()
+            entry = self.popOldest()
+            self.mutex.release()
+            if entry is None:
+                break
+            try:
+                self.wait(entry)
+            except Exception as err:
+                if error is None:
+                    error = err
+        if error is not None:
+            raise error
+
+    def abort(self):
+        """forgets every range in flight without waiting for it, used after a failure
+
+        Every descriptor is closed, including those of streams that were never closed.
+        """
+        self.mutex.acquire()
+        descriptors = list(self.descriptors)
+        self.descriptors.clear()
+        self.inFlight.clear()
+        self.latest.clear()
+        self.inFlightBytes = 0
+        self.mutex.release()
+        for descriptor in descriptors:
+            descriptor.close()